@@ -0,0 +1,163 @@
+# coding: utf8
+
+import sys
+import math
+import operator
+from array import array
+
+## Array type of samples by sample width
+TYPECODES = {1: 'b', 2: 'h', 4: 'i'}
+
+## 8 bits samples are unsigned (centered on 128) : translated to signed
+UNSIGNED_TO_SIGNED = bytes(b ^ 0x80 for b in range(256))
+
+## Levels below are shown as MIN_DBFS (silence is -inf dBFS)
+MIN_DBFS = -120.0
+
+
+def dbfs(value, fullScale):
+    """Level of value in dB relative to the full scale """
+
+    if value <= 0:
+        return MIN_DBFS
+    return max(20 * math.log10(value / fullScale), MIN_DBFS)
+
+
+
+def samples_of(pcm, sampwidth):
+    """Return the signed samples of PCM frames (bytes or memoryview) as an
+    array, or None if the sample width is not supported """
+
+    typecode = TYPECODES.get(sampwidth)
+    if typecode is None:
+        return None
+
+    samples = array(typecode)
+    if samples.itemsize == 1:
+        samples.frombytes(bytes(pcm).translate(UNSIGNED_TO_SIGNED))
+    else:
+        samples.frombytes(pcm[:len(pcm) - len(pcm) % samples.itemsize])
+
+    ## Wave samples are little endian
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples
+
+
+
+class AudioStats:
+
+    def __init__(self, params, silenceThreshold=-50.0, window=0.01):
+        """Signal statistics of an audio stream, updated chunk by chunk.
+        Args:
+            params (tuple)           : Wave parameters of the stream (see class:riff.WaveParams).
+            silenceThreshold (float) : A window with a RMS level below silenceThreshold dBFS is silent.
+            window (float)           : Duration (seconds) of the windows of silence.
+
+        Samples of each chunk are read in an array (no copy by sample), and
+        all sums are done by builtins over the whole array (C loops). Only
+        the sums are kept, so memory does not depend on the duration.
+        Samples of all channels are counted together.
+        """
+        self.params    = params
+        self.fullScale = float(1 << (8 * params.sampwidth - 1))
+
+        ## Silence is counted by window of samples (of all channels)
+        self.threshold = (self.fullScale * 10 ** (silenceThreshold / 20)) ** 2
+        self.windowSize = max(int(params.framerate * window), 1) * params.nchannels
+
+        self.samples    = 0
+        self.sum        = 0
+        self.sumSquares = 0
+        self.peak       = 0
+        self.clipped    = 0
+        self.windows    = 0
+        self.silent     = 0
+
+        ## Sum of squares and count of samples of the last window, not full yet
+        self.__windowSum   = 0
+        self.__windowCount = 0
+
+
+
+    def add(self, pcm):
+        """Count the samples of PCM frames (bytes or memoryview) """
+
+        samples = samples_of(pcm, self.params.sampwidth)
+        if not samples:
+            return
+
+        ## Full scale samples (both signs) are clipped
+        high = int(self.fullScale) - 1
+        self.clipped += samples.count(high) + samples.count(-high - 1)
+        self.peak = max(self.peak, max(samples), -min(samples))
+        self.sum += sum(samples)
+
+        squares = list(map(operator.mul, samples, samples))
+        self.sumSquares += sum(squares)
+        self.samples += len(squares)
+
+        ## Windows of silence, the last window continues on the next chunk
+        position = 0
+        while position < len(squares):
+            end = position + self.windowSize - self.__windowCount
+            window = squares[position:end]
+            self.__windowSum += sum(window)
+            self.__windowCount += len(window)
+            position = end
+            if self.__windowCount == self.windowSize:
+                self.__count_window()
+
+
+
+    def __count_window(self):
+        """Count the current window, silent if its mean square is below the threshold """
+
+        self.windows += 1
+        if self.__windowSum < self.threshold * self.__windowCount:
+            self.silent += 1
+        self.__windowSum = 0
+        self.__windowCount = 0
+
+
+
+    def result(self):
+        """Return the statistics as a dict (None if no sample was counted) :
+            duration (float) : seconds of audio.
+            rms (float)      : RMS level in dBFS.
+            peak (float)     : Peak level in dBFS.
+            clipping (float) : Ratio of samples at full scale.
+            dcOffset (float) : Mean of samples, as a ratio of the full scale.
+            silence (float)  : Ratio of silent windows.
+        """
+
+        if self.samples == 0:
+            return None
+
+        ## The last window counts if it is at least half full (or the only one)
+        if (self.__windowCount * 2 >= self.windowSize) or (self.windows == 0):
+            self.__count_window()
+
+        return {
+            "duration": round(self.samples / self.params.nchannels / self.params.framerate, 3),
+            "rms":      round(dbfs(math.sqrt(self.sumSquares / self.samples), self.fullScale), 1),
+            "peak":     round(dbfs(self.peak, self.fullScale), 1),
+            "clipping": round(self.clipped / self.samples, 5),
+            "dcOffset": round(self.sum / self.samples / self.fullScale, 5),
+            "silence":  round(self.silent / self.windows, 3),
+        }
+
+
+
+def format_stats(stats):
+    """Text of the statistics of a wave file (see AudioStats.result), with
+    the bytes saved by the trim of silence and the compression (if any) """
+
+    text = "{0:.2f} s, rms {1:.1f} dBFS, peak {2:.1f} dBFS, clipping {3:.2f} %, dc offset {4:.2f} %, silence {5:.0f} %" \
+        .format(stats['duration'], stats['rms'], stats['peak'], stats['clipping'] * 100,
+                stats['dcOffset'] * 100, stats['silence'] * 100)
+
+    savedBytes = stats.get('savedBytes')
+    if savedBytes:
+        text += ", {0} bytes saved ({1:.0f} %)".format(savedBytes, savedBytes * 100 / (stats['size'] + savedBytes))
+    return text
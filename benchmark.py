@@ -0,0 +1,554 @@
+#!/usr/bin/env python3
+# coding: utf8
+"""
+Benchmarks of rhasspy-watch hot paths.
+
+    python3 ./benchmark.py --bench dispatch
+    python3 ./benchmark.py --bench ingest --sites 10 --seconds 60
+    python3 ./benchmark.py --bench search --records 10000,100000,1000000
+
+dispatch : translation of messages as human text, with the topic
+           dispatcher (humantext module) versus the if/elif chain of
+           substring tests used before.
+ingest   : synthetic Hermes traffic of N sites (audio streams and
+           dialogues) sent to on_msg/on_audio of RhasspyMQTTClient
+           recording in a temporary folder, without MQTT broker.
+search   : search in archives of 10k, 100k and 1M messages.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+import wave
+from datetime import datetime, timedelta
+from termcolor import colored
+from paho.mqtt.client import MQTTMessage
+import humantext
+from journal import Journal
+from sqlitestore import SqliteStore
+from message import Message
+from rhasspymqttclient import RhasspyMQTTClient
+from writer import WriterOptions
+
+
+def legacy_humanText(payload, topic):
+    """ The if/elif chain of substring tests used before TopicDispatcher,
+        kept as reference for the benchmark
+    """
+
+    ########################
+    #       HOTWORD        #
+    ########################
+    if "hermes/hotword/toggleOn" in topic:
+        text = colored("[hotword]",'magenta') + \
+            " was asked to toggle itself 'on' on site {0}"\
+            .format (colored(payload['siteId'],'white',attrs=['bold']))
+
+    elif "hermes/hotword/toggleOff" in topic:
+        text = colored("[hotword]",'magenta') + \
+            " was asked to toggle itself 'off' on site {0}"\
+            .format (colored(payload['siteId'],'white',attrs=['bold']))
+
+    elif ("hermes/hotword/" in topic) and ("/detected" in topic):
+        text = colored("[hotword]",'yellow') + \
+            " detected on site {0}, for model {1}"\
+            .format(colored(payload['siteId'],'white',attrs=['bold']),
+                    payload['modelId'])  
+
+
+    ########################
+    #         ASR          #
+    ########################
+    elif "hermes/asr/stopListening" in topic:
+        text = colored("[Asr]",'magenta') + \
+            " was asked to stop listening on site {0}"\
+            .format (colored(payload['siteId'],'white',attrs=['bold']))
+        
+    elif ("hermes/asr/startListening" in topic):
+        text = colored("[Asr]",'magenta') + \
+            " was asked to listen on site {0}"\
+            .format (colored(payload['siteId'],'white',attrs=['bold']))
+
+    elif ("hermes/asr/textCaptured" in topic):
+        text = colored("[Asr]",'yellow') + \
+            " captured text '{0}' in {1}s on site {2}"\
+            .format(colored(payload['text'],'green',attrs=['bold']),
+                    payload['seconds'],
+                    colored(payload['siteId'],'white',attrs=['bold']))
+
+    elif "hermes/asr/toggleOn" in topic:
+        text = colored("[Asr]",'magenta') + \
+            " was asked to toggle itself 'on' on site {0}"\
+            .format (colored(payload['siteId'],'white',attrs=['bold']))
+
+    elif "hermes/asr/toggleOff" in topic:
+        text = colored("[Asr]",'magenta') + \
+            " was asked to toggle itself 'off' on site {0}"\
+            .format (colored(payload['siteId'],'white',attrs=['bold']))
+
+
+    ########################
+    #   DIALOGUE MANAGER   #
+    ########################
+    elif ("hermes/dialogueManager/sessionStarted" in topic):
+        text = colored("[Dialogue]",'yellow') \
+            + " session with id {0} was started on site {1}."\
+            .format(payload['sessionId'],
+                    colored(payload['siteId'],'white',attrs=['bold']))
+
+    elif ("hermes/dialogueManager/sessionEnded" in topic):
+        text = colored("[Dialogue]",'yellow') + \
+            " session with id {0} was ended on site {1}. Reason: {2}"\
+            .format(payload['sessionId'],
+                    colored(payload['siteId'],'white',attrs=['bold']),
+                    payload['termination']['reason'])
+        if 'customData' in payload.keys():
+            if payload['customData'] is not None:
+                text = text + "\n           with customData : "
+                text = text + "\n               {0} "\
+                    .format(colored(payload['customData'],'cyan', attrs=['bold']))    
+
+    elif ("hermes/dialogueManager/endSession" in topic):
+        text = colored("[Dialogue]",'magenta') + \
+            " was ask to end session with id {0} by saying '{1}'"\
+            .format(payload['sessionId'],
+                    (payload['text']))
+
+    elif ("hermes/dialogueManager/continueSession" in topic):
+        text = colored("[Dialogue]",'magenta') + \
+            " was ask to continue session with id {0} by saying '{1}'"\
+            .format(payload['sessionId'],
+                    (payload['text']))
+        if 'customData' in payload.keys():
+            if payload['customData'] is not None:
+                text = text + "\n           with customData : "
+                text = text + "\n               {0}"\
+                        .format(colored(payload['customData'],'cyan', attrs=['bold']))    
+
+    elif ("hermes/dialogueManager/intentNotRecognized" in topic):
+        text = colored("[Dialogue]",'red') + \
+            " Intent NOT recognized for session with id {0} by saying '{1}'"\
+            .format(payload['sessionId'],
+                    (payload['input']))
+        if 'customData' in payload.keys():
+            if payload['customData'] is not None:
+                    text = text + "\n           with customData : "
+                    text = text + "\n               {0}"\
+                            .format(colored(payload['customData'],'cyan', attrs=['bold']))    
+
+
+    ########################
+    #         NLU          #
+    ########################
+    elif ("hermes/nlu/query" in topic):
+        text = colored("[Nlu]",'magenta') + \
+            " was asked to parse input '{0}'"\
+            .format(payload['input'])
+
+    elif ("hermes/nlu/intentNotRecognized" in topic):
+        text = colored("[Nlu]",'yellow') + \
+            " Intent not recognized for {0}"\
+            .format(colored(payload['input'],'red', attrs=['bold']))
+
+    elif ("hermes/nlu/intentParsed" in topic):
+        text = colored("[Nlu]",'yellow') + \
+            " Detected intent {0} with confidence score {1} for input '{2}'"\
+            .format(colored(payload["intent"]["intentName"],'green', attrs=['bold']),
+                    payload["intent"]["confidenceScore"],
+                    payload['input'])
+
+
+    ########################
+    #       INTENT         #
+    ########################
+    elif ("hermes/intent/" in topic):
+
+        text = colored("[Nlu]",'yellow') + \
+            " Intent {0} with confidence score {1} on site {2} "\
+            .format(colored(payload["intent"]["intentName"],'green', attrs=['bold']),
+                    payload["intent"]["confidenceScore"],
+                    colored(payload['siteId'],'white',attrs=['bold']))
+
+        """
+        In snips, in slot, the word is "confidenceScore"
+        In rhasspy, in slot, the word is "confidence"
+
+        """        
+        if len(payload['slots']) > 0:
+
+            text = text + "\n           with slots : "
+            for slot in payload['slots']:
+
+                confidence = "N/A"
+                if "confidenceScore" in slot.keys():
+                    confidence = slot['confidenceScore']
+                else:
+                    confidence = slot['confidence']
+
+                text = text + "\n               {0} => {1} (confidenceScore={2})"\
+                    .format(colored(slot['slotName'],'cyan', attrs=['bold']),
+                            slot['value']['value'],
+                            confidence)    
+
+        if 'customData' in payload.keys():
+            if payload['customData'] is not None:
+                text = text + "\n           with customData : "
+                text = text + "\n               {0} "\
+                    .format(colored(payload['customData'],'cyan', attrs=['bold']))    
+
+
+    ########################
+    #         TTS          #
+    ########################
+    elif ("hermes/tts/say" == topic):
+        text = colored("[Tts]",'yellow') + \
+            " was asked to say '{0}' in {1} on site {2}".\
+            format(colored(payload['text'],'green', attrs=['bold']),
+                payload['lang'],
+                colored(payload['siteId'],'white',attrs=['bold']))
+    
+    elif ("hermes/tts/sayFinished" in topic):
+        text = colored("[Tts]",'cyan') + \
+            " finished speaking with id '{0}'"\
+            .format(payload['sessionId'])
+
+
+    ########################
+    #    AUDIO SERVER      #
+    ########################
+    elif ("hermes/audioServer" in topic):
+        text = colored("[audioServer]",'cyan') + \
+            " audio on topic {0}".format(topic)
+
+
+    ########################
+    #       UNKNOWN        #
+    ########################
+    else:
+        text = colored("[UNKNOWN]",'red') + \
+            " message on topic {0}".format(topic)
+    
+    return text
+
+
+## Messages of a typical dialogue (intents are the most frequent)
+SAMPLES = [
+    ("hermes/hotword/default/detected",        {"siteId": "kitchen", "modelId": "porcupine"}),
+    ("hermes/asr/startListening",              {"siteId": "kitchen", "sessionId": "s1"}),
+    ("hermes/asr/textCaptured",                {"siteId": "kitchen", "sessionId": "s1", "text": "turn on the light", "seconds": 1.2}),
+    ("hermes/asr/stopListening",               {"siteId": "kitchen", "sessionId": "s1"}),
+    ("hermes/nlu/query",                       {"siteId": "kitchen", "sessionId": "s1", "input": "turn on the light"}),
+    ("hermes/nlu/intentParsed",                {"siteId": "kitchen", "sessionId": "s1", "input": "turn on the light",
+                                                "intent": {"intentName": "LightOn", "confidenceScore": 0.98}}),
+    ("hermes/intent/LightOn",                  {"siteId": "kitchen", "sessionId": "s1", "input": "turn on the light",
+                                                "intent": {"intentName": "LightOn", "confidenceScore": 0.98},
+                                                "slots": [{"slotName": "room", "value": {"value": "kitchen"}, "confidence": 1.0}],
+                                                "customData": None}),
+    ("hermes/intent/LightOff",                 {"siteId": "kitchen", "sessionId": "s1", "input": "turn off the light",
+                                                "intent": {"intentName": "LightOff", "confidenceScore": 0.91},
+                                                "slots": [], "customData": "data"}),
+    ("hermes/dialogueManager/endSession",      {"sessionId": "s1", "text": "done"}),
+    ("hermes/tts/say",                         {"siteId": "kitchen", "sessionId": "s1", "text": "done", "lang": "en"}),
+    ("hermes/tts/sayFinished",                 {"siteId": "kitchen", "sessionId": "s1"}),
+    ("hermes/dialogueManager/sessionEnded",    {"siteId": "kitchen", "sessionId": "s1", "termination": {"reason": "nominal"}}),
+]
+
+
+
+def bench_dispatch(iterations):
+    """Compare the topic dispatcher with the if/elif chain """
+
+    ## Both must give the same text
+    for topic, payload in SAMPLES:
+        renderer = humantext.DISPATCHER.resolve(topic) or humantext.unknown
+        assert renderer(payload, topic) == legacy_humanText(payload, topic), topic
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        for topic, payload in SAMPLES:
+            legacy_humanText(payload, topic)
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        for topic, payload in SAMPLES:
+            humantext.DISPATCHER.resolve(topic)(payload, topic)
+    dispatcher = time.perf_counter() - start
+
+    ## Resolution only (without the text formatting)
+    start = time.perf_counter()
+    for i in range(iterations):
+        for topic, payload in SAMPLES:
+            humantext.DISPATCHER.resolve(topic)
+    resolution = time.perf_counter() - start
+
+    count = iterations * len(SAMPLES)
+    print("dispatch : {0} messages".format(count))
+    print("    if/elif chain     : {0:.2f} us/message".format(legacy / count * 1e6))
+    print("    topic dispatcher  : {0:.2f} us/message (x{1:.1f})".format(dispatcher / count * 1e6, legacy / dispatcher))
+    print("    resolution only   : {0:.3f} us/message".format(resolution / count * 1e6))
+
+
+
+## Audio of Rhasspy satellites : 16kHz 16 bits mono, by chunks of 1024 frames
+FRAMERATE   = 16000
+CHUNKFRAMES = 1024
+
+
+def wav_chunk(frames, seed=0):
+    """Return a wave file of frames (noise) as bytes """
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(FRAMERATE)
+        wav.writeframes(random.Random(seed).getrandbits(frames * 16).to_bytes(frames * 2, 'little'))
+    return buffer.getvalue()
+
+
+def mqtt_message(topic, payload):
+    """Return a paho MQTT message, like the ones received from the broker """
+
+    if isinstance(payload, dict):
+        payload = json.dumps(payload).encode('utf8')
+    message = MQTTMessage(topic=topic.encode('utf8'))
+    message.payload = payload
+    return message
+
+
+
+class HermesTraffic:
+
+    def __init__(self, sites=10, seconds=60, dialogueEvery=20, seed=0):
+        """Synthetic traffic of Rhasspy satellites.
+        Args:
+            sites (int)         : Count of satellites streaming their microphone.
+            seconds (int)       : Duration of the traffic.
+            dialogueEvery (int) : Each site has a dialogue every dialogueEvery seconds.
+            seed (int)          : Seed of random choices.
+
+        Each site sends an audioFrame chunk every 64ms. A dialogue is a burst
+        of hotword, ASR, NLU, intent, dialogue manager and TTS messages, with
+        the audio of the answer (playBytes).
+        """
+        self.sites   = ["site{0}".format(i) for i in range(sites)]
+        self.seconds = seconds
+        self.dialogueEvery = dialogueEvery
+        self.random  = random.Random(seed)
+
+        self.__chunk = wav_chunk(CHUNKFRAMES)
+        self.__answer = wav_chunk(FRAMERATE)
+
+
+
+    def dialogue(self, siteId, sessionId):
+        """Return the messages of a dialogue, as [(chunks of audio before, topic, payload)] """
+
+        intentName = self.random.choice(["LightOn", "LightOff", "GetTime", "GetWeather"])
+        text = "what time is it in the " + siteId
+        intent = {"intentName": intentName, "confidenceScore": round(self.random.uniform(0.5, 1.0), 3)}
+
+        return [
+            (0,  "hermes/hotword/default/detected",         {"siteId": siteId, "modelId": "porcupine"}),
+            (0,  "hermes/dialogueManager/sessionStarted",   {"siteId": siteId, "sessionId": sessionId}),
+            (1,  "hermes/asr/startListening",               {"siteId": siteId, "sessionId": sessionId}),
+            (25, "hermes/asr/textCaptured",                 {"siteId": siteId, "sessionId": sessionId, "text": text,
+                                                             "seconds": round(self.random.uniform(1.0, 3.0), 2)}),
+            (0,  "hermes/asr/stopListening",                {"siteId": siteId, "sessionId": sessionId}),
+            (0,  "hermes/nlu/query",                        {"siteId": siteId, "sessionId": sessionId, "input": text}),
+            (1,  "hermes/nlu/intentParsed",                 {"siteId": siteId, "sessionId": sessionId, "input": text, "intent": intent}),
+            (0,  "hermes/intent/" + intentName,             {"siteId": siteId, "sessionId": sessionId, "input": text, "intent": intent,
+                                                             "slots": [{"slotName": "room", "value": {"value": siteId}, "confidence": 1.0}]}),
+            (1,  "hermes/dialogueManager/endSession",       {"sessionId": sessionId, "text": "it's noon"}),
+            (0,  "hermes/tts/say",                          {"siteId": siteId, "sessionId": sessionId, "text": "it's noon", "lang": "en"}),
+            (2,  "hermes/audioServer/{0}/playBytes/{1}".format(siteId, sessionId), self.__answer),
+            (16, "hermes/tts/sayFinished",                  {"siteId": siteId, "sessionId": sessionId}),
+            (0,  "hermes/dialogueManager/sessionEnded",     {"siteId": siteId, "sessionId": sessionId, "termination": {"reason": "nominal"}}),
+        ]
+
+
+
+    def messages(self):
+        """Return the list of MQTT messages (built before the measure) """
+
+        ticks = int(self.seconds * FRAMERATE / CHUNKFRAMES)
+        dialogueTicks = int(self.dialogueEvery * FRAMERATE / CHUNKFRAMES)
+
+        ## Key is siteId / Value is the remaining messages of its dialogue
+        dialogues = {}
+        messages = []
+        for tick in range(ticks):
+            for i, siteId in enumerate(self.sites):
+
+                ## Dialogues of sites are spread over time
+                if (tick + i * dialogueTicks // len(self.sites)) % dialogueTicks == 0 and siteId not in dialogues:
+                    dialogues[siteId] = self.dialogue(siteId, "{0}-{1}".format(siteId, tick))
+
+                messages.append(mqtt_message("hermes/audioServer/{0}/audioFrame".format(siteId), self.__chunk))
+
+                ## Messages of the dialogue after their count of chunks
+                pending = dialogues.get(siteId)
+                while pending:
+                    wait, topic, payload = pending[0]
+                    if wait > 0:
+                        pending[0] = (wait - 1, topic, payload)
+                        break
+                    messages.append(mqtt_message(topic, payload))
+                    pending.pop(0)
+                if pending == []:
+                    del dialogues[siteId]
+
+        return messages
+
+
+
+def peak_rss():
+    """Peak resident memory of the process, in MB """
+    ## ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+
+def bench_ingest(sites, seconds, storage, display, audioWorkers=1):
+    """Send synthetic traffic to a recording RhasspyMQTTClient """
+
+    traffic = HermesTraffic(sites, seconds)
+    messages = traffic.messages()
+    size = sum(len(message.payload) for message in messages)
+
+    logger = logging.getLogger("benchmark")
+    folder = tempfile.mkdtemp(prefix="rhasspy-watch-bench-")
+    try:
+        client = RhasspyMQTTClient(jsonfolder=folder, logger=logger, recording=True, storage=storage,
+                                   writer=WriterOptions(audioWorkers=audioWorkers))
+        if display:
+            client.on_message = lambda c, u, msg, logTime: client.translate_message(msg.payload, msg.topic, "", "human")
+
+        ## Like the network loop of paho : writers are started by connect
+        client.start_writers()
+
+        wallStart = time.perf_counter()
+        cpuStart = time.process_time()
+        for message in messages:
+            if message.topic.startswith("hermes/audioServer/"):
+                client.on_audio(None, None, message)
+            else:
+                client.on_msg(None, None, message)
+        callbacks = time.perf_counter() - wallStart
+
+        ## All writes done
+        client.close()
+        wall = time.perf_counter() - wallStart
+        cpu = time.process_time() - cpuStart
+        stats = client.writer_stats()
+        audioStats = client.audio_stats()
+        files = len(os.listdir(folder))
+    finally:
+        shutil.rmtree(folder)
+
+    count = len(messages)
+    print("ingest : {0} sites, {1}s of traffic, {2} messages, {3:.1f} MB, storage {4}, {5} audio workers"
+          .format(sites, seconds, count, size / 1e6, storage, audioWorkers))
+    print("    callbacks         : {0:.0f} messages/s ({1:.1f} us/message)".format(count / callbacks, callbacks / count * 1e6))
+    print("    with writes       : {0:.0f} messages/s, {1:.1f} MB/s".format(count / wall, size / wall / 1e6))
+    print("    cpu               : {0:.1f} us/message".format(cpu / count * 1e6))
+    print("    real time         : x{0:.1f} (about {1} sites)".format(seconds / wall, int(sites * seconds / wall)))
+    print("    writer            : max depth {0}, dropped {1}, max latency {2:.2f} ms, {3} files"
+          .format(stats["maxDepth"], stats["dropped"], stats["latencyMax"] * 1e3, files))
+    for i, audio in enumerate(audioStats):
+        print("    audio writer {0:<4} : max depth {1}, dropped {2}, max latency {3:.2f} ms, {4} writes"
+              .format(i, audio["maxDepth"], audio["dropped"], audio["latencyMax"] * 1e3, audio["written"]))
+    print("    peak RSS          : {0:.1f} MB".format(peak_rss()))
+
+
+
+def build_archive(folder, records, storage):
+    """Save records messages (of 10 sites, every 10ms) in folder. Return (first, last) datetimes """
+
+    logger = logging.getLogger("benchmark")
+    traffic = HermesTraffic(10, 10)
+    samples = [(topic, json.dumps(payload).encode('utf8'))
+               for siteId in traffic.sites
+               for wait, topic, payload in traffic.dialogue(siteId, siteId + "-0")
+               if isinstance(payload, dict)]
+
+    if storage == 'sqlite':
+        store = SqliteStore(folder, logger, batchSize=10000)
+    else:
+        store = Journal(folder, logger=logger)
+
+    first = datetime(2020, 1, 1)
+    for i in range(records):
+        topic, raw = samples[i % len(samples)]
+        logTime = first + timedelta(milliseconds=10 * i)
+        store.append_message(Message.decode(topic, raw, logTime))
+    store.close()
+
+    return (first, logTime)
+
+
+
+def bench_search(counts, storage):
+    """Search in archives of counts messages """
+
+    logger = logging.getLogger("benchmark")
+    for records in counts:
+        folder = tempfile.mkdtemp(prefix="rhasspy-watch-bench-")
+        try:
+            start = time.perf_counter()
+            first, last = build_archive(folder, records, storage)
+            build = time.perf_counter() - start
+
+            client = RhasspyMQTTClient(jsonfolder=folder, logger=logger, storage=storage)
+            found = [0]
+            def on_message(client, userdata, msg, logTime):
+                found[0] += 1
+            client.on_message = on_message
+
+            middle = first + (last - first) / 2
+            searches = [("all", first, last, ""),
+                        ("1 minute", middle, middle + timedelta(minutes=1), ""),
+                        ("1 site", first, last, "site3")]
+
+            print("search : {0} messages ({1}s of messages), storage {2}, built in {3:.1f}s"
+                  .format(records, int((last - first).total_seconds()), storage, build))
+            for name, datestart, datestop, siteId in searches:
+                found[0] = 0
+                wallStart = time.perf_counter()
+                cpuStart = time.process_time()
+                client.search_message(datestart, datestop, siteId, folder, "raw", "")
+                wall = time.perf_counter() - wallStart
+                cpu = time.process_time() - cpuStart
+                print("    {0:<17} : {1:>8} messages in {2:8.1f} ms ({3:.2f} us/message cpu)"
+                      .format(name, found[0], wall * 1e3, cpu / max(found[0], 1) * 1e6))
+            print("    peak RSS          : {0:.1f} MB".format(peak_rss()))
+        finally:
+            shutil.rmtree(folder)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench",      help="dispatch : translation of messages as human text / ingest : synthetic traffic / search : search in archives", default="dispatch")
+    parser.add_argument("--iterations", help="count of iterations on sample messages", default=20000)
+    parser.add_argument("--sites",      help="ingest : count of sites streaming audio", default=10)
+    parser.add_argument("--seconds",    help="ingest : seconds of traffic", default=60)
+    parser.add_argument("--display",    help="ingest : messages are also translated as human text", default=False)
+    parser.add_argument("--records",    help="search : counts of messages of archives", default="10000,100000,1000000")
+    parser.add_argument("--storage",    help="ingest and search : journal or sqlite", default="journal")
+    parser.add_argument("--audioWorkers", help="ingest : count of threads writing wave files", default=1)
+    args = parser.parse_args()
+
+    if args.bench == "dispatch":
+        bench_dispatch(int(args.iterations))
+    elif args.bench == "ingest":
+        bench_ingest(int(args.sites), int(args.seconds), str(args.storage), args.display, int(args.audioWorkers))
+    elif args.bench == "search":
+        bench_search([int(records) for records in str(args.records).split(",")], str(args.storage))
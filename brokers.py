@@ -0,0 +1,57 @@
+# coding: utf8
+
+from metrics import Counters
+
+
+class Broker:
+
+    def __init__(self, name, host, port=1883):
+        """A MQTT broker watched by the client.
+        Args:
+            name (str) : Name of the broker, attached to its messages and
+                         wave files (when several brokers are watched).
+            host (str) : MQTT Server name or IP.
+            port (int) : MQTT server TCP port.
+
+        Each broker has its own paho client (set by the client), so its own
+        network thread, and its own counters.
+        """
+        self.name     = name
+        self.host     = host
+        self.port     = port
+        self.client   = None
+        self.counters = Counters()
+
+
+
+def site_key(siteId, brokerName=None):
+    """Site of wave files and index : siteId@broker when messages come
+    from several brokers (sites of 2 brokers may have the same name) """
+    return "{0}@{1}".format(siteId, brokerName) if brokerName else siteId
+
+
+
+def parse_brokers(text, port=1883):
+    """Return the list of class:Broker of text : name=host:port,...
+    Name (default : host) and port (default : port) are optional.
+    ex: master1=rhasspy-1,master2=rhasspy-2:1884
+    """
+
+    brokers = []
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+
+        name, _, address = item.rpartition('=')
+        host, _, strPort = address.partition(':')
+        name = name.strip() or host.strip()
+
+        ## Names are part of wave file names : <date>_<site>@<broker>_<flux>.wav
+        if (not name) or any(c in name for c in "_/@ "):
+            raise ValueError("Invalid broker name : '{0}'".format(name))
+        if name in (broker.name for broker in brokers):
+            raise ValueError("Duplicate broker name : '{0}'".format(name))
+
+        brokers.append(Broker(name, host.strip(), int(strPort) if strPort else port))
+    return brokers
@@ -0,0 +1,235 @@
+# coding: utf8
+
+import os
+import json
+import time
+import select
+import ctypes
+import ctypes.util
+from journal import Journal, SEGMENT_EXT
+from sqlitestore import DATABASE_NAME
+
+
+## inotify events (linux/inotify.h)
+IN_MODIFY   = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE   = 0x00000100
+
+
+class InotifyWatcher:
+
+    def __init__(self, folder):
+        """Wait for changes of the segments of folder with inotify (Linux).
+        Raise OSError if inotify is not available.
+        Args:
+            folder (str) : Folder of segments. New files are watched in the
+                           folder, writes only in the current segment.
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.__libc = libc
+
+        ## Not blocking, so all pending events are read at once
+        self.__fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        if libc.inotify_add_watch(self.__fd, folder.encode(), IN_CREATE | IN_MOVED_TO) < 0:
+            os.close(self.__fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed on {0}".format(folder))
+        self.__fileWatch = None
+
+
+
+    def watch_file(self, path):
+        """Watch the writes of path (instead of the previous file) """
+
+        if self.__fileWatch is not None:
+            self.__libc.inotify_rm_watch(self.__fd, self.__fileWatch)
+        wd = self.__libc.inotify_add_watch(self.__fd, path.encode(), IN_MODIFY)
+        self.__fileWatch = wd if wd >= 0 else None
+
+
+
+    def wait(self, timeout):
+        """Wait for a change at most timeout seconds """
+
+        ready, _, _ = select.select([self.__fd], [], [], timeout)
+        if ready:
+            try:
+                while os.read(self.__fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+
+
+    def close(self):
+        os.close(self.__fd)
+
+
+
+class PollingWatcher:
+
+    def __init__(self, interval=0.2):
+        """Wait for changes of segments by polling every interval seconds
+        (fallback when inotify is not available) """
+        self.interval = interval
+
+
+    def watch_file(self, path):
+        """Nothing to do, all files are polled """
+
+
+    def wait(self, timeout):
+        time.sleep(min(self.interval, timeout))
+
+
+    def close(self):
+        """Nothing to close """
+
+
+
+class Follower:
+
+    def __init__(self, folder, logger, cursorFile="", pollInterval=0.2, saveInterval=1.0):
+        """Tail of the journal segments written by a recording instance.
+        Args:
+            folder (str)         : Folder of segments (json folder).
+            logger (class:logging.Logger): Logger object for logging messages.
+            cursorFile (str)     : File where the cursor (segment and offset) is
+                                   saved, to continue from there on next start.
+                                   Empty = no cursor, start at the end of the journal.
+            pollInterval (float) : Seconds between 2 reads when inotify is not available.
+            saveInterval (float) : Min seconds between 2 saves of the cursor.
+
+        Records are read from the cursor until the end of the current
+        segment, then the follower waits for new writes (inotify, or
+        polling) and goes to the next segment when the writer rotates.
+        """
+        self.folder       = folder
+        self.logger       = logger
+        self.cursorFile   = cursorFile
+        self.pollInterval = pollInterval
+        self.saveInterval = saveInterval
+
+        self.__journal = Journal(folder, logger=logger)
+
+        ## Cursor : current segment and offset of the next record
+        self.segment = None
+        self.offset  = 0
+        self.__saved = None
+        self.__savedTime = 0.0
+
+
+
+    def __load(self):
+        """Set the cursor from the cursor file, or at the end of the journal """
+
+        if self.cursorFile and os.path.exists(self.cursorFile):
+            try:
+                with open(self.cursorFile) as f:
+                    cursor = json.load(f)
+                self.segment, self.offset = cursor['segment'], int(cursor['offset'])
+                self.__saved = (self.segment, self.offset)
+                self.logger.info("Follow from cursor : segment %s, offset %s", self.segment, self.offset)
+                return
+            except (ValueError, KeyError, TypeError):
+                self.logger.warning("Invalid cursor file ignored : %s", self.cursorFile)
+
+        segments = self.__segments()
+        if segments:
+            self.segment = segments[-1]
+            self.offset = os.path.getsize(os.path.join(self.folder, self.segment))
+        elif os.path.exists(os.path.join(self.folder, DATABASE_NAME)):
+            self.logger.warning("No segment in %s, but a SQLite database : messages saved with --storage sqlite "
+                                "can't be followed", self.folder)
+        self.logger.info("Follow from the end of the journal : segment %s, offset %s", self.segment, self.offset)
+
+
+
+    def save(self, force=False):
+        """Save the cursor (atomically), at most every saveInterval seconds """
+
+        if (not self.cursorFile) or (self.segment is None) or (self.__saved == (self.segment, self.offset)):
+            return
+        if (not force) and (time.monotonic() - self.__savedTime < self.saveInterval):
+            return
+
+        temporary = self.cursorFile + ".tmp"
+        with open(temporary, 'w') as f:
+            json.dump({"segment": self.segment, "offset": self.offset}, f)
+        os.replace(temporary, self.cursorFile)
+        self.__saved = (self.segment, self.offset)
+        self.__savedTime = time.monotonic()
+
+
+
+    def __segments(self):
+        """Names of segments being written or closed (not compressed), sorted """
+        return sorted(filename for filename in os.listdir(self.folder) if filename.endswith(SEGMENT_EXT))
+
+
+
+    def __next_segment(self):
+        """Return the first segment after the current one, or None """
+
+        for filename in self.__segments():
+            if (self.segment is None) or (filename > self.segment):
+                return filename
+        return None
+
+
+
+    def records(self, stop=None):
+        """Generator of (datetime, topic, payload, broker) records appended
+        to the journal, until stop (a threading.Event, None = never) is set.
+        The cursor is saved while waiting for new records. """
+
+        self.__load()
+
+        try:
+            watcher = InotifyWatcher(self.folder)
+            self.logger.info("Follow : inotify")
+        except (OSError, AttributeError):
+            watcher = PollingWatcher(self.pollInterval)
+            self.logger.info("Follow : polling every %s seconds", self.pollInterval)
+
+        watchedSegment = None
+        try:
+            while (stop is None) or not stop.is_set():
+
+                ## The current segment may have been deleted by the retention task
+                if (self.segment is not None) and not os.path.exists(os.path.join(self.folder, self.segment)):
+                    self.logger.warning("Segment %s deleted, follow from the next one", self.segment)
+                    self.segment, self.offset = self.__next_segment(), 0
+
+                if self.segment is None:
+                    self.segment, self.offset = self.__next_segment(), 0
+
+                if self.segment is not None:
+                    if watchedSegment != self.segment:
+                        watcher.watch_file(os.path.join(self.folder, self.segment))
+                        watchedSegment = self.segment
+
+                    found = False
+                    for self.offset, record in self.__journal.scan_segment(self.segment, self.offset):
+                        found = True
+                        yield record
+                    if found:
+                        continue
+
+                    ## Nothing new : if the writer has moved to a newer segment,
+                    ## the end of this one is reached (once the records written
+                    ## before the rotation are read)
+                    nextSegment = self.__next_segment()
+                    if nextSegment is not None:
+                        for self.offset, record in self.__journal.scan_segment(self.segment, self.offset):
+                            yield record
+                        self.segment, self.offset = nextSegment, 0
+                        continue
+
+                self.save()
+                watcher.wait(1.0)
+        finally:
+            self.save(force=True)
+            watcher.close()
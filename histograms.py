@@ -0,0 +1,196 @@
+# coding: utf8
+
+import math
+from termcolor import colored
+from sessions import SessionCorrelator
+
+STATS = colored("[Stats]",'cyan')
+
+QUANTILES = (0.50, 0.95, 0.99)
+
+
+class LogHistogram:
+
+    def __init__(self, low=0.001, high=1000.0, bucketsPerDecade=20):
+        """Histogram with a fixed count of buckets of logarithmic width.
+        Args:
+            low (float)            : Values below low are counted in the first bucket.
+            high (float)           : Values above high are counted in the last bucket.
+            bucketsPerDecade (int) : Buckets between x and 10*x. 20 buckets = about 6%
+                                     of relative error on quantiles.
+
+        Memory does not depend on the count of values.
+        """
+        self.low   = low
+        self.high  = high
+        self.bucketsPerDecade = bucketsPerDecade
+
+        self.__size    = int(math.ceil(math.log10(high / low) * bucketsPerDecade)) + 1
+        self.__buckets = [0] * self.__size
+        self.reset()
+
+
+
+    def reset(self):
+        """Forget all values """
+
+        for i in range(self.__size):
+            self.__buckets[i] = 0
+        self.count   = 0
+        self.total   = 0.0
+        self.minimum = None
+        self.maximum = None
+
+
+
+    def add(self, value):
+        """Count a value """
+
+        if value <= self.low:
+            index = 0
+        else:
+            index = min(int(math.log10(value / self.low) * self.bucketsPerDecade), self.__size - 1)
+        self.__buckets[index] += 1
+
+        self.count += 1
+        self.total += value
+        if (self.minimum is None) or (value < self.minimum):
+            self.minimum = value
+        if (self.maximum is None) or (value > self.maximum):
+            self.maximum = value
+
+
+
+    def quantile(self, q):
+        """Return an estimation of the quantile q (0.5 = median), or None if empty """
+
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        cumulated = 0
+        for index, count in enumerate(self.__buckets):
+            cumulated += count
+            if cumulated >= rank and count > 0:
+                break
+
+        ## Geometric middle of the bucket, in the range of seen values
+        value = self.low * 10 ** ((index + 0.5) / self.bucketsPerDecade)
+        return min(max(value, self.minimum), self.maximum)
+
+
+
+class LatencyStats:
+
+    def __init__(self):
+        """Distributions of latency and confidence, by site and by intent :
+            - asr        : seconds of ASR (textCaptured), by site
+            - confidence : confidence score of NLU (intentParsed), by site and intent
+            - dialogue   : ms from the hotword (or the start) to the end of a
+                           session, by site and intent
+            - rms, clipping, silence, dcoffset : signal statistics of record
+                           wave files, by site (rms in dB below the full scale,
+                           others in % of samples or of time)
+
+        Each distribution is a LogHistogram, so memory only depends on the
+        count of sites and intents.
+        """
+        ## Key is (metric, dimension, name) / Value is LogHistogram
+        self.__histograms = {}
+        self.__correlator = SessionCorrelator()
+
+
+
+    def __add(self, metric, dimension, name, value):
+        """Count value in the histogram of (metric, dimension, name) """
+
+        if name is None:
+            return
+
+        key = (metric, dimension, name)
+        histogram = self.__histograms.get(key)
+        if histogram is None:
+            if metric == "confidence":
+                histogram = LogHistogram(0.01, 1.0, 100)
+            elif metric == "dialogue":
+                histogram = LogHistogram(1.0, 1000000.0, 20)
+            elif metric in ("clipping", "silence", "dcoffset"):
+                histogram = LogHistogram(0.001, 100.0, 20)
+            else:
+                histogram = LogHistogram(0.01, 1000.0, 20)
+            self.__histograms[key] = histogram
+        histogram.add(value)
+
+
+
+    def __add_dialogues(self, dialogues):
+        """Count the duration of ended dialogues """
+
+        for dialogue in dialogues:
+            if dialogue.ended:
+                duration = (dialogue.end - dialogue.start).total_seconds() * 1000
+                self.__add("dialogue", "site", dialogue.siteId, duration)
+                self.__add("dialogue", "intent", dialogue.intentName, duration)
+
+
+
+    def feed(self, message):
+        """Count the values of a message (class:message.Message) """
+
+        self.__add_dialogues(self.__correlator.feed(message))
+
+        payload = message.payload
+        if not isinstance(payload, dict):
+            return
+
+        if message.topic == "hermes/asr/textCaptured":
+            seconds = payload.get('seconds')
+            if isinstance(seconds, (int, float)):
+                self.__add("asr", "site", payload.get('siteId'), seconds)
+
+        elif message.topic == "hermes/nlu/intentParsed":
+            intent = payload.get('intent')
+            if isinstance(intent, dict) and isinstance(intent.get('confidenceScore'), (int, float)):
+                self.__add("confidence", "site", payload.get('siteId'), intent['confidenceScore'])
+                self.__add("confidence", "intent", intent.get('intentName'), intent['confidenceScore'])
+
+
+
+    def feed_wav(self, siteId, flux, stats):
+        """Count the statistics of a wave file (dict of class:audiostats.AudioStats,
+        None if unknown). Only record wave files are counted. """
+
+        if (flux != 'record') or not stats:
+            return
+
+        if isinstance(stats.get('rms'), (int, float)):
+            self.__add("rms", "site", siteId, -stats['rms'])
+        for metric, field in (("clipping", 'clipping'), ("silence", 'silence'), ("dcoffset", 'dcOffset')):
+            if isinstance(stats.get(field), (int, float)):
+                self.__add(metric, "site", siteId, abs(stats[field]) * 100)
+
+
+
+    def close(self):
+        """Count the dialogues not finished yet (end of a search) """
+
+        self.__add_dialogues(self.__correlator.close())
+
+
+
+    def summary(self, reset=False):
+        """Return the summary lines (count, p50, p95, p99 of each histogram).
+        If reset, histograms are emptied (rolling window). """
+
+        lines = []
+        for (metric, dimension, name), histogram in sorted(self.__histograms.items()):
+            if histogram.count == 0:
+                continue
+
+            lines.append(STATS + " {0:<10} {1:<6} {2:<20} count {3:>6} {4}"
+                         .format(metric, dimension, name, histogram.count,
+                                 " ".join("p{0:02d} {1:>9.3f}".format(int(q * 100), histogram.quantile(q)) for q in QUANTILES)))
+            if reset:
+                histogram.reset()
+
+        return lines
@@ -0,0 +1,301 @@
+# coding: utf8
+"""
+Translation of Rhasspy/snips MQTT messages as human readable text.
+
+The renderer of a topic is found by a TopicDispatcher : exact topics are
+found in a dict, topics with MQTT wildcards (+ and #) in a trie. The
+result is cached by topic, so each distinct topic is resolved once.
+"""
+from functools import lru_cache
+from termcolor import colored
+
+
+########################
+#  STATIC FRAGMENTS    #
+########################
+HOTWORD_ASKED   = colored("[hotword]",'magenta')
+HOTWORD         = colored("[hotword]",'yellow')
+ASR_ASKED       = colored("[Asr]",'magenta')
+ASR             = colored("[Asr]",'yellow')
+DIALOGUE        = colored("[Dialogue]",'yellow')
+DIALOGUE_ASKED  = colored("[Dialogue]",'magenta')
+DIALOGUE_ERROR  = colored("[Dialogue]",'red')
+NLU_ASKED       = colored("[Nlu]",'magenta')
+NLU             = colored("[Nlu]",'yellow')
+TTS             = colored("[Tts]",'yellow')
+TTS_FINISHED    = colored("[Tts]",'cyan')
+AUDIO_SERVER    = colored("[audioServer]",'cyan')
+UNKNOWN         = colored("[UNKNOWN]",'red')
+
+WITH_SLOTS      = "\n           with slots : "
+WITH_CUSTOMDATA = "\n           with customData : "
+WITH_STATS      = "\n           with stats : "
+
+
+@lru_cache(maxsize=256)
+def site(siteId):
+    """Colored site name (sites are few, so they are cached) """
+    return colored(siteId,'white',attrs=['bold'])
+
+
+def customData(text, payload, end=""):
+    """Add customData of payload to text, if any """
+    if payload.get('customData') is not None:
+        text = text + WITH_CUSTOMDATA
+        text = text + "\n               {0}{1}"\
+            .format(colored(payload['customData'],'cyan', attrs=['bold']), end)
+    return text
+
+
+
+########################
+#       HOTWORD        #
+########################
+def hotword_toggleOn(payload, topic):
+    return HOTWORD_ASKED + " was asked to toggle itself 'on' on site {0}".format(site(payload['siteId']))
+
+def hotword_toggleOff(payload, topic):
+    return HOTWORD_ASKED + " was asked to toggle itself 'off' on site {0}".format(site(payload['siteId']))
+
+def hotword_detected(payload, topic):
+    return HOTWORD + " detected on site {0}, for model {1}".format(site(payload['siteId']), payload['modelId'])
+
+
+########################
+#         ASR          #
+########################
+def asr_stopListening(payload, topic):
+    return ASR_ASKED + " was asked to stop listening on site {0}".format(site(payload['siteId']))
+
+def asr_startListening(payload, topic):
+    return ASR_ASKED + " was asked to listen on site {0}".format(site(payload['siteId']))
+
+def asr_textCaptured(payload, topic):
+    return ASR + " captured text '{0}' in {1}s on site {2}"\
+        .format(colored(payload['text'],'green',attrs=['bold']),
+                payload['seconds'],
+                site(payload['siteId']))
+
+def asr_toggleOn(payload, topic):
+    return ASR_ASKED + " was asked to toggle itself 'on' on site {0}".format(site(payload['siteId']))
+
+def asr_toggleOff(payload, topic):
+    return ASR_ASKED + " was asked to toggle itself 'off' on site {0}".format(site(payload['siteId']))
+
+
+########################
+#   DIALOGUE MANAGER   #
+########################
+def dialogue_sessionStarted(payload, topic):
+    return DIALOGUE + " session with id {0} was started on site {1}."\
+        .format(payload['sessionId'], site(payload['siteId']))
+
+def dialogue_sessionEnded(payload, topic):
+    text = DIALOGUE + " session with id {0} was ended on site {1}. Reason: {2}"\
+        .format(payload['sessionId'],
+                site(payload['siteId']),
+                payload['termination']['reason'])
+    return customData(text, payload, " ")
+
+def dialogue_endSession(payload, topic):
+    return DIALOGUE_ASKED + " was ask to end session with id {0} by saying '{1}'"\
+        .format(payload['sessionId'], payload['text'])
+
+def dialogue_continueSession(payload, topic):
+    text = DIALOGUE_ASKED + " was ask to continue session with id {0} by saying '{1}'"\
+        .format(payload['sessionId'], payload['text'])
+    return customData(text, payload)
+
+def dialogue_intentNotRecognized(payload, topic):
+    text = DIALOGUE_ERROR + " Intent NOT recognized for session with id {0} by saying '{1}'"\
+        .format(payload['sessionId'], payload['input'])
+    return customData(text, payload)
+
+
+########################
+#         NLU          #
+########################
+def nlu_query(payload, topic):
+    return NLU_ASKED + " was asked to parse input '{0}'".format(payload['input'])
+
+def nlu_intentNotRecognized(payload, topic):
+    return NLU + " Intent not recognized for {0}".format(colored(payload['input'],'red', attrs=['bold']))
+
+def nlu_intentParsed(payload, topic):
+    return NLU + " Detected intent {0} with confidence score {1} for input '{2}'"\
+        .format(colored(payload["intent"]["intentName"],'green', attrs=['bold']),
+                payload["intent"]["confidenceScore"],
+                payload['input'])
+
+
+########################
+#       INTENT         #
+########################
+def intent(payload, topic):
+    text = NLU + " Intent {0} with confidence score {1} on site {2} "\
+        .format(colored(payload["intent"]["intentName"],'green', attrs=['bold']),
+                payload["intent"]["confidenceScore"],
+                site(payload['siteId']))
+
+    """
+    In snips, in slot, the word is "confidenceScore"
+    In rhasspy, in slot, the word is "confidence"
+
+    """
+    if len(payload['slots']) > 0:
+
+        text = text + WITH_SLOTS
+        for slot in payload['slots']:
+
+            if "confidenceScore" in slot:
+                confidence = slot['confidenceScore']
+            else:
+                confidence = slot['confidence']
+
+            text = text + "\n               {0} => {1} (confidenceScore={2})"\
+                .format(colored(slot['slotName'],'cyan', attrs=['bold']),
+                        slot['value']['value'],
+                        confidence)
+
+    return customData(text, payload, " ")
+
+
+########################
+#         TTS          #
+########################
+def tts_say(payload, topic):
+    return TTS + " was asked to say '{0}' in {1} on site {2}"\
+        .format(colored(payload['text'],'green', attrs=['bold']),
+                payload['lang'],
+                site(payload['siteId']))
+
+def tts_sayFinished(payload, topic):
+    return TTS_FINISHED + " finished speaking with id '{0}'".format(payload['sessionId'])
+
+
+########################
+#    AUDIO SERVER      #
+########################
+def audioServer(payload, topic):
+    return AUDIO_SERVER + " audio on topic {0}".format(topic)
+
+
+########################
+#       UNKNOWN        #
+########################
+def unknown(payload, topic):
+    return UNKNOWN + " message on topic {0}".format(topic)
+
+
+
+class TopicDispatcher:
+
+    def __init__(self, cacheSize=4096):
+        """Find the renderer of a topic, among topics or MQTT topic filters.
+        Args:
+            cacheSize (int) : Max count of topics kept in the cache.
+
+        When several filters match a topic, the first one added wins.
+        """
+        self.cacheSize = cacheSize
+
+        ## Key is topic / Value is (order, renderer)
+        self.__exact = {}
+        ## Node of trie : [dict of children by level, (order, renderer) or None]
+        self.__trie  = [{}, None]
+        self.__count = 0
+
+        ## Key is topic / Value is the renderer (or None)
+        self.__cache = {}
+
+
+
+    def add(self, topicFilter, renderer):
+        """Add a renderer for a topic or a MQTT topic filter """
+
+        entry = (self.__count, renderer)
+        self.__count += 1
+        self.__cache.clear()
+
+        if ('+' not in topicFilter) and ('#' not in topicFilter):
+            self.__exact.setdefault(topicFilter, entry)
+            return
+
+        node = self.__trie
+        for level in topicFilter.split('/'):
+            node = node[0].setdefault(level, [{}, None])
+        if node[1] is None:
+            node[1] = entry
+
+
+
+    def __match(self, node, levels, i):
+        """Return the first added (order, renderer) of the trie matching levels[i:] """
+
+        best = None
+        children = node[0]
+
+        ## '#' matches the parent level and all the remaining levels
+        if '#' in children:
+            best = children['#'][1]
+
+        if i == len(levels):
+            if node[1] is not None and (best is None or node[1] < best):
+                best = node[1]
+            return best
+
+        for key in (levels[i], '+'):
+            if key in children:
+                entry = self.__match(children[key], levels, i + 1)
+                if entry is not None and (best is None or entry < best):
+                    best = entry
+
+        return best
+
+
+
+    def resolve(self, topic):
+        """Return the renderer of topic, or None if no one matches """
+
+        try:
+            return self.__cache[topic]
+        except KeyError:
+            pass
+
+        best = self.__exact.get(topic)
+        entry = self.__match(self.__trie, topic.split('/'), 0)
+        if entry is not None and (best is None or entry < best):
+            best = entry
+        renderer = best[1] if best is not None else None
+
+        ## Topics with ids (intents, hotword models...) are not unlimited,
+        ## but the cache is bounded anyway
+        if len(self.__cache) >= self.cacheSize:
+            self.__cache.clear()
+        self.__cache[topic] = renderer
+
+        return renderer
+
+
+
+DISPATCHER = TopicDispatcher()
+DISPATCHER.add("hermes/hotword/toggleOn",                    hotword_toggleOn)
+DISPATCHER.add("hermes/hotword/toggleOff",                   hotword_toggleOff)
+DISPATCHER.add("hermes/hotword/+/detected",                  hotword_detected)
+DISPATCHER.add("hermes/asr/stopListening",                   asr_stopListening)
+DISPATCHER.add("hermes/asr/startListening",                  asr_startListening)
+DISPATCHER.add("hermes/asr/textCaptured",                    asr_textCaptured)
+DISPATCHER.add("hermes/asr/toggleOn",                        asr_toggleOn)
+DISPATCHER.add("hermes/asr/toggleOff",                       asr_toggleOff)
+DISPATCHER.add("hermes/dialogueManager/sessionStarted",      dialogue_sessionStarted)
+DISPATCHER.add("hermes/dialogueManager/sessionEnded",        dialogue_sessionEnded)
+DISPATCHER.add("hermes/dialogueManager/endSession",          dialogue_endSession)
+DISPATCHER.add("hermes/dialogueManager/continueSession",     dialogue_continueSession)
+DISPATCHER.add("hermes/dialogueManager/intentNotRecognized", dialogue_intentNotRecognized)
+DISPATCHER.add("hermes/nlu/query",                           nlu_query)
+DISPATCHER.add("hermes/nlu/intentNotRecognized",             nlu_intentNotRecognized)
+DISPATCHER.add("hermes/nlu/intentParsed",                    nlu_intentParsed)
+DISPATCHER.add("hermes/intent/#",                            intent)
+DISPATCHER.add("hermes/tts/say",                             tts_say)
+DISPATCHER.add("hermes/tts/sayFinished",                     tts_sayFinished)
+DISPATCHER.add("hermes/audioServer/#",                       audioServer)
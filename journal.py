@@ -0,0 +1,284 @@
+# coding: utf8
+
+import os
+import gzip
+import struct
+import zlib
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+
+## Every segment file starts with this magic. Segments of previous
+## versions (RWJ1) have no broker in their records
+SEGMENT_MAGIC = b'RWJ2'
+SEGMENT_MAGIC_V1 = b'RWJ1'
+SEGMENT_EXT = ".seg"
+INDEX_EXT = ".idx"
+## Segments compressed by the retention task
+COMPRESSED_EXT = ".gz"
+
+## Record header : crc32, payload length, time (in microseconds), topic length, broker length
+RECORD_HEADER = struct.Struct('<IIqHB')
+RECORD_HEADER_V1 = struct.Struct('<IIqH')
+
+## Index entry : time (in microseconds), offset of the record in the segment
+INDEX_ENTRY = struct.Struct('<qQ')
+
+## Naive datetimes are stored as microseconds from this date
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def to_micros(logTime):
+    """Convert a (naive) datetime to microseconds since 1970-01-01 """
+    return (logTime - EPOCH) // ONE_MICROSECOND
+
+
+def from_micros(micros):
+    """Convert microseconds since 1970-01-01 to a (naive) datetime """
+    return EPOCH + timedelta(microseconds=micros)
+
+
+class Journal:
+
+    def __init__(self, folder, segmentSize=16*1024*1024, segmentTime=3600, logger=None, indexInterval=64*1024):
+        """Append-only storage of MQTT messages in rotating segment files.
+        Args:
+            folder (str)       : Folder where segments are saved.
+            segmentSize (int)  : Max size (bytes) of a segment before rotation.
+            segmentTime (int)  : Max duration (seconds) of a segment before rotation.
+            logger (class:logging.Logger): Logger object for logging messages.
+            indexInterval (int): Count of bytes written between 2 index entries.
+
+        Each record of a segment is framed as :
+            crc32 | payload length | time | topic length | broker length | topic | broker | payload
+        (broker is empty when a single broker is watched).
+        The segment name is the datetime of its first record, so the
+        segments sorted by name are sorted by datetime.
+
+        Each segment has a sidecar index (same name, .idx extension) with
+        an entry (time, offset) every indexInterval bytes. So a search
+        seeks near its start date instead of reading the whole segment.
+        """
+        self.folder      = folder
+        self.segmentSize = segmentSize
+        self.segmentTime = timedelta(seconds=segmentTime)
+        self.logger      = logger
+        self.indexInterval = indexInterval
+        self.__dateFileFormat = '%Y%m%d%H%M%S%f'
+
+        ## Current segment (and its index) opened for writing
+        self.__file      = None
+        self.__index     = None
+        self.__fileName  = None
+        self.__fileStart = None
+        self.__fileSize  = 0
+        self.__indexedSize = 0
+
+
+
+    def __rotate(self, logTime):
+        """Close the current segment and open a new one starting at logTime """
+
+        self.close()
+
+        name = logTime.strftime(self.__dateFileFormat)
+        self.logger.debug("Opening new segment %s", name + SEGMENT_EXT)
+
+        self.__fileName = name + SEGMENT_EXT
+        self.__file = open(os.path.join(self.folder, self.__fileName), 'ab')
+        if self.__file.tell() == 0:
+            self.__file.write(SEGMENT_MAGIC)
+        self.__index = open(os.path.join(self.folder, name + INDEX_EXT), 'ab')
+        self.__fileStart = logTime
+        self.__fileSize  = self.__file.tell()
+
+        ## First record of the segment is always indexed
+        self.__indexedSize = -self.indexInterval
+
+
+
+    def append(self, logTime, topic, payload, broker=None):
+        """Append a message (payload as bytes) of broker to the current segment.
+        Return the location of the record : (segment filename, offset) """
+
+        if (self.__file is None) \
+                or (self.__fileSize >= self.segmentSize) \
+                or (logTime - self.__fileStart >= self.segmentTime):
+            self.__rotate(logTime)
+
+        micros = to_micros(logTime)
+        bTopic = topic.encode('utf8')
+        bBroker = broker.encode('utf8') if broker else b''
+        header = struct.pack('<qHB', micros, len(bTopic), len(bBroker))
+        crc = zlib.crc32(payload, zlib.crc32(bBroker, zlib.crc32(bTopic, zlib.crc32(header))))
+
+        self.__file.write(struct.pack('<II', crc, len(payload)))
+        self.__file.write(header)
+        self.__file.write(bTopic)
+        self.__file.write(bBroker)
+        self.__file.write(payload)
+        self.__file.flush()
+
+        ## Add an index entry every indexInterval bytes (once the record is written)
+        if self.__fileSize - self.__indexedSize >= self.indexInterval:
+            self.__index.write(INDEX_ENTRY.pack(micros, self.__fileSize))
+            self.__index.flush()
+            self.__indexedSize = self.__fileSize
+
+        offset = self.__fileSize
+        self.__fileSize += RECORD_HEADER.size + len(bTopic) + len(bBroker) + len(payload)
+        return (self.__fileName, offset)
+
+
+
+    def append_message(self, message):
+        """Append a message (class:message.Message) to the current segment.
+        Return the location of the record : (segment filename, offset) """
+        return self.append(message.time, message.topic, message.raw, message.broker)
+
+
+
+    def flush(self):
+        """Records are flushed on each append, nothing is buffered """
+
+
+
+    def close(self):
+        """Close the segment opened for writing """
+
+        if self.__file is not None:
+            self.__file.close()
+            self.__index.close()
+            self.__file  = None
+            self.__index = None
+
+
+
+    def segments(self):
+        """Return the list of (datetime, filename) of all segments (compressed
+        or not), sorted by datetime """
+
+        segments = []
+        for filename in os.listdir(self.folder):
+            name, extension = os.path.splitext(filename)
+            if extension == COMPRESSED_EXT:
+                name, extension = os.path.splitext(name)
+            if extension == SEGMENT_EXT:
+                try:
+                    segments.append((datetime.strptime(name, self.__dateFileFormat), filename))
+                except ValueError:
+                    self.logger.warning("Segment with invalid name ignored : %s", filename)
+        segments.sort()
+        return segments
+
+
+
+    def seek_offset(self, filename, datestart):
+        """Return the offset in segment from where records after
+        datestart have to be read. Use the index of the segment if any.
+        """
+
+        indexFilename = os.path.join(self.folder, filename.split('.')[0] + INDEX_EXT)
+        try:
+            with open(indexFilename, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+
+        ## Ignore an entry partially written
+        count = len(data) // INDEX_ENTRY.size
+        entries = [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(count)]
+
+        ## Last entry before datestart : all following records are read from there
+        i = bisect_left([entry[0] for entry in entries], to_micros(datestart))
+        if i == 0:
+            return 0
+        return entries[i - 1][1]
+
+
+
+    def read_segment(self, filename, offset=0):
+        """Generator of (datetime, topic, payload, broker) records of a segment
+        starting at offset. Stop on the first truncated or corrupted record.
+        """
+
+        for nextOffset, record in self.scan_segment(filename, offset):
+            yield record
+
+
+
+    def scan_segment(self, filename, offset=0):
+        """Generator of (offset after the record, (datetime, topic, payload, broker))
+        of the records of a segment starting at offset (0 = first record).
+        Stop on the first truncated or corrupted record, so a record being
+        written is read on a next scan from the last offset.
+        """
+
+        ## Offsets of a compressed segment are offsets in the uncompressed data
+        opener = gzip.open if filename.endswith(COMPRESSED_EXT) else open
+
+        with opener(os.path.join(self.folder, filename), 'rb') as f:
+            magic = f.read(len(SEGMENT_MAGIC))
+            if magic not in (SEGMENT_MAGIC, SEGMENT_MAGIC_V1):
+                if len(magic) == len(SEGMENT_MAGIC):
+                    self.logger.warning("Not a segment file : %s", filename)
+                return
+            recordHeader = RECORD_HEADER if magic == SEGMENT_MAGIC else RECORD_HEADER_V1
+            if offset > 0:
+                f.seek(offset)
+
+            brokerLength = 0
+            while True:
+                header = f.read(recordHeader.size)
+                if len(header) < recordHeader.size:
+                    break
+                if recordHeader is RECORD_HEADER:
+                    crc, payloadLength, micros, topicLength, brokerLength = recordHeader.unpack(header)
+                else:
+                    crc, payloadLength, micros, topicLength = recordHeader.unpack(header)
+                body = f.read(topicLength + brokerLength + payloadLength)
+                if len(body) < topicLength + brokerLength + payloadLength:
+                    break
+                if zlib.crc32(body, zlib.crc32(header[8:])) != crc:
+                    self.logger.warning("Corrupted record in segment %s at offset %s", filename, f.tell())
+                    break
+
+                payloadStart = topicLength + brokerLength
+                yield (f.tell(),
+                       (from_micros(micros),
+                        body[:topicLength].decode('utf8'),
+                        body[payloadStart:],
+                        body[topicLength:payloadStart].decode('utf8') or None))
+
+
+
+    def read_record(self, filename, offset):
+        """Return the (datetime, topic, payload, broker) record at offset
+        of a segment, or None """
+        return next(self.read_segment(filename, offset), None)
+
+
+
+    def read(self, datestart, datestop):
+        """Generator of (datetime, topic, payload, broker) records saved
+        between datestart and datestop, sorted by datetime
+        """
+
+        segments = self.segments()
+
+        for i, (segmentStart, filename) in enumerate(segments):
+
+            ## Segments are sorted, so no need to go further
+            if segmentStart > datestop:
+                break
+
+            ## The segment ends when the next one starts
+            if (i + 1 < len(segments)) and (segments[i + 1][0] < datestart):
+                continue
+
+            for record in self.read_segment(filename, self.seek_offset(filename, datestart)):
+                if record[0] > datestop:
+                    break
+                if record[0] >= datestart:
+                    yield record
@@ -0,0 +1,37 @@
+# coding: utf8
+
+import json
+
+## Use a faster json backend if installed
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+
+class Message:
+    """A MQTT message (not audio), decoded once and shared by recording,
+    display and search.
+        topic (str)       : MQTT topic.
+        payload (dict)    : Decoded json payload.
+        raw (bytes)       : Raw payload as received (None for json files
+                            saved by previous versions).
+        time (datetime)   : Datetime when the message was received.
+        broker (str)      : Name of the broker of the message (None when
+                            a single broker is watched).
+    """
+    __slots__ = ('topic', 'payload', 'raw', 'time', 'broker')
+
+    def __init__(self, topic, payload, raw, time, broker=None):
+        self.topic   = topic
+        self.payload = payload
+        self.raw     = raw
+        self.time    = time
+        self.broker  = broker
+
+
+    @classmethod
+    def decode(cls, topic, raw, time, broker=None):
+        """Create the message from a raw json payload """
+        return cls(topic, loads(raw), raw, time, broker)
@@ -0,0 +1,159 @@
+# coding: utf8
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def family(topic):
+    """Family of a Hermes topic : hermes/<family>/... """
+    levels = topic.split('/', 2)
+    return levels[1] if len(levels) > 1 else topic
+
+
+
+class Counters:
+
+    def __init__(self):
+        """Counters of the MQTT callbacks and of the writer threads.
+
+        Counters are incremented by the network thread of each broker, the
+        writer thread and the audio writer threads, and read by the threads
+        of the metrics server : they are updated and read under a lock, so
+        the message and byte counts of a topic family are never torn.
+        """
+        ## Key is topic family / Value is count of messages or of bytes
+        self.messages    = {}
+        self.bytes       = {}
+        self.parseErrors = 0
+        self.connects    = 0
+        self.records     = 0
+        self.wavFiles    = 0
+
+        self.__lock = threading.Lock()
+
+
+
+    def count(self, topic, size):
+        """Count a message of topic and its payload size """
+
+        name = family(topic)
+        with self.__lock:
+            try:
+                self.messages[name] += 1
+                self.bytes[name] += size
+            except KeyError:
+                self.messages[name] = 1
+                self.bytes[name] = size
+
+
+
+    def increment(self, name):
+        """Add 1 to the counter name (parseErrors, connects, records or wavFiles) """
+
+        with self.__lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+
+    def snapshot(self):
+        """Return a copy of all counters as a dict, read at once """
+
+        with self.__lock:
+            return {"messages":    dict(self.messages),
+                    "bytes":       dict(self.bytes),
+                    "parseErrors": self.parseErrors,
+                    "connects":    self.connects,
+                    "records":     self.records,
+                    "wavFiles":    self.wavFiles}
+
+
+
+def exposition(metrics):
+    """Prometheus text format of metrics, a list of
+    (name, type, help, [(labels dict, value)]) """
+
+    lines = []
+    for name, kind, text, samples in metrics:
+        lines.append("# HELP {0} {1}".format(name, text))
+        lines.append("# TYPE {0} {1}".format(name, kind))
+        for labels, value in samples:
+            if labels:
+                strLabels = ",".join('{0}="{1}"'.format(key, str(label).replace('\\', '\\\\').replace('"', '\\"'))
+                                     for key, label in sorted(labels.items()))
+                lines.append("{0}{{{1}}} {2}".format(name, strLabels, value))
+            else:
+                lines.append("{0} {1}".format(name, value))
+    return "\n".join(lines) + "\n"
+
+
+
+class MetricsServer:
+
+    def __init__(self, host="127.0.0.1", port=9100, collect=None, logger=None):
+        """HTTP server of metrics in Prometheus text format (GET /metrics).
+        Args:
+            host (str)         : Address to listen (localhost by default).
+            port (int)         : TCP port to listen.
+            collect (callable) : Return the metrics, as expected by exposition().
+            logger (class:logging.Logger): Logger object for logging messages.
+
+        The server runs in its own thread. Metrics are only collected
+        when they are requested.
+        """
+        self.host    = host
+        self.port    = port
+        self.collect = collect
+        self.logger  = logger
+
+        self.__server = None
+        self.__thread = None
+
+
+
+    def start(self):
+        """Start to listen in a background thread """
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                try:
+                    body = exposition(server.collect()).encode('utf8')
+                except Exception:
+                    server.logger.exception("ERROR : Failed to collect metrics")
+                    self.send_error(500)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                server.logger.debug("Metrics : " + format, *args)
+
+        self.__server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="rhasspy-watch-metrics", daemon=True)
+        self.__thread.start()
+        self.logger.info("Metrics on http://%s:%s/metrics", self.host, self.port)
+
+
+
+    def stop(self):
+        """Stop the server """
+
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__thread.join()
+            self.__server = None
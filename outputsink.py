@@ -0,0 +1,167 @@
+# coding: utf8
+
+import os
+import sys
+import gzip
+import shutil
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+
+## Options of the buffering and rotation of outputs (same names as the args of OutputSink)
+OutputOptions = namedtuple('OutputOptions', 'flushLines flushInterval rotateSize rotateTime gzipRotated',
+                           defaults=(100, 1.0, 0, 0, False))
+
+
+class OutputSink:
+
+    def __init__(self, filename="", flushLines=100, flushInterval=1.0, rotateSize=0, rotateTime=0, gzipRotated=False, logger=None):
+        """Buffered output of the display, to a file or to stdout.
+        Args:
+            filename (str)       : File where lines are appended. If empty, stdout.
+            flushLines (int)     : Lines are written when flushLines are buffered...
+            flushInterval (float): ...or at least every flushInterval seconds.
+            rotateSize (int)     : The file is rotated when it reaches about rotateSize bytes (0 = never).
+            rotateTime (int)     : The file is rotated every rotateTime seconds (0 = never).
+            gzipRotated (bool)   : Rotated files are compressed with gzip.
+            logger (class:logging.Logger): Logger object for logging messages.
+
+        The file is kept opened. A rotated file is renamed with the datetime
+        of the rotation as suffix. stdout is not buffered if it's a TTY.
+        """
+        self.filename      = filename
+        self.flushLines    = flushLines
+        self.flushInterval = flushInterval
+        self.rotateSize    = rotateSize
+        self.rotateTime    = rotateTime
+        self.gzipRotated   = gzipRotated
+        self.logger        = logger
+
+        self.__lock   = threading.Lock()
+        self.__lines  = []
+        self.__file   = None
+        self.__size   = 0
+        self.__opened = 0.0
+        self.__gzipThreads = []
+
+        if filename == "":
+            self.__file = sys.stdout
+            self.__buffered = not sys.stdout.isatty()
+        else:
+            self.__open()
+            self.__buffered = True
+
+        ## Buffered lines are flushed even if no new line comes
+        self.__stopped = threading.Event()
+        self.__flusher = None
+        if self.__buffered and flushInterval > 0:
+            self.__flusher = threading.Thread(target=self.__run, name="rhasspy-watch-output", daemon=True)
+            self.__flusher.start()
+
+
+
+    def __open(self):
+        """Open the file for appending """
+
+        self.__file   = open(self.filename, 'a', encoding='utf8')
+        self.__size   = self.__file.tell()
+        self.__opened = time.monotonic()
+
+
+
+    def __rotate(self):
+        """Rename the current file (and compress it) and open a new one """
+
+        self.__file.close()
+
+        rotated = "{0}.{1}".format(self.filename, datetime.now().strftime('%Y%m%d%H%M%S%f'))
+        os.rename(self.filename, rotated)
+        self.logger.info("Output file rotated to %s", rotated)
+
+        if self.gzipRotated:
+            thread = threading.Thread(target=self.__gzip, args=(rotated,), name="rhasspy-watch-gzip", daemon=True)
+            thread.start()
+            self.__gzipThreads = [t for t in self.__gzipThreads if t.is_alive()] + [thread]
+
+        self.__open()
+
+
+
+    def __gzip(self, filename):
+        """Compress a rotated file (in its own thread, so display is not delayed) """
+
+        try:
+            with open(filename, 'rb') as f_in:
+                with gzip.open(filename + ".gz", 'wb') as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+            os.remove(filename)
+        except OSError:
+            self.logger.exception("ERROR : Failed to compress %s", filename)
+
+
+
+    def write(self, text):
+        """Add a line to the output """
+
+        with self.__lock:
+            if not self.__buffered:
+                self.__file.write(text + "\n")
+                self.__file.flush()
+                return
+
+            self.__lines.append(text)
+            if len(self.__lines) >= self.flushLines:
+                self.__flush()
+
+
+
+    def __flush(self):
+        """Write buffered lines (lock must be held) """
+
+        if self.__lines:
+            data = "\n".join(self.__lines) + "\n"
+            self.__lines = []
+
+            self.__file.write(data)
+            self.__file.flush()
+            self.__size += len(data)
+
+        if self.filename != "":
+            if ((self.rotateSize > 0) and (self.__size >= self.rotateSize)) \
+                    or ((self.rotateTime > 0) and (time.monotonic() - self.__opened >= self.rotateTime)):
+                self.__rotate()
+
+
+
+    def flush(self):
+        """Write buffered lines """
+
+        with self.__lock:
+            self.__flush()
+
+
+
+    def __run(self):
+        """Loop of the flusher thread """
+
+        while not self.__stopped.wait(self.flushInterval):
+            try:
+                self.flush()
+            except Exception:
+                self.logger.exception("ERROR : Failed to write output")
+
+
+
+    def close(self):
+        """Write buffered lines and close the file (wait for compressions) """
+
+        self.__stopped.set()
+        with self.__lock:
+            self.__flush()
+            if self.filename != "":
+                self.__file.close()
+
+        for thread in self.__gzipThreads:
+            thread.join()
@@ -0,0 +1,112 @@
+# coding: utf8
+
+import os
+import logging
+import signal
+import multiprocessing
+from datetime import datetime, timedelta
+from rhasspymqttclient import RhasspyMQTTClient
+from sqlitestore import SqliteStore
+
+
+## Client of a worker process, created once by process
+_client = None
+
+
+def date_chunks(datestart, datestop, count, minimum=timedelta(minutes=1)):
+    """Split [datestart, datestop] in at most count disjoint ranges
+    [start, stop] (bounds included, like searches), sorted by datetime """
+
+    ## Datetimes have a microsecond resolution : [start, stop - 1us]
+    ## ranges don't share any message
+    end = datestop + timedelta(microseconds=1)
+    span = max(-((datestart - end) // count), minimum)
+    chunks = []
+    start = datestart
+    while start < end:
+        stop = min(start + span, end)
+        chunks.append((start, stop - timedelta(microseconds=1)))
+        start = stop
+    return chunks
+
+
+
+def archive_start(jsonfolder, logger):
+    """Return the datetime of the first message or file of the archive, or None.
+    Json, wave and segment files are named with their datetime, other
+    files (config.json...) are ignored. """
+
+    dates = []
+    for filename in os.listdir(jsonfolder):
+        name, extension = os.path.splitext(filename)
+        if extension == ".gz":
+            name, extension = os.path.splitext(name)
+        if extension in (".json", ".wav", ".seg"):
+            try:
+                dates.append(datetime.strptime(name.split("_")[0], '%Y%m%d%H%M%S%f'))
+            except ValueError:
+                logger.warning("File with invalid name ignored : %s", filename)
+    first = [min(dates)] if dates else []
+
+    databaseFirst = SqliteStore(jsonfolder).first_time()
+    if databaseFirst is not None:
+        first.append(databaseFirst)
+
+    return min(first) if first else None
+
+
+
+def init_worker(loggerName):
+    """Create the client of the worker process """
+
+    ## Workers don't inherit the handlers of rhasspy-watch : SIGTERM (sent by
+    ## terminate) stops them, Ctrl-C is handled by the parent process
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    global _client
+    _client = RhasspyMQTTClient(logger=logging.getLogger(loggerName))
+
+
+
+def search_chunk(task):
+    """Return the texts displayed by the search of a chunk """
+
+    datestart, datestop, jsonfolder, outputFormat, timeFormat, siteId, topic, sessionId = task
+    return list(_client.render_archive(datestart, datestop, jsonfolder, outputFormat, timeFormat, siteId, topic, sessionId))
+
+
+
+def parallel_search(datestart, datestop, jsonfolder, outputFormat, timeFormat, siteId=None, topic=None, sessionId=None,
+                    workers=2, logger=None):
+    """Generator of the texts displayed by a search, in the same order as a
+    sequential search. The date range is split in chunks (8 by worker),
+    searched and translated by a pool of worker processes.
+
+    Chunks are disjoint ranges of datetimes, so the results of chunks, taken
+    in the order of chunks, are sorted by datetime : each worker merges the
+    sources (json files, segments, database) of its chunk, and the results
+    are merged by chunk order (imap keeps the order of tasks).
+    """
+
+    ## Chunks are spread over the dates of the archive (not the future),
+    ## the first and last ones are extended to the whole range
+    first = archive_start(jsonfolder, logger)
+    if first is None:
+        return
+    chunks = date_chunks(max(datestart, first), max(min(datestop, datetime.now()), datestart), workers * 8)
+    if not chunks:
+        return
+    chunks[0] = (datestart, chunks[0][1])
+    chunks[-1] = (chunks[-1][0], datestop)
+
+    tasks = [(chunkStart, chunkStop, jsonfolder, outputFormat, timeFormat, siteId, topic, sessionId)
+             for chunkStart, chunkStop in chunks]
+    logger.info("Parallel search : %s chunks on %s workers", len(tasks), workers)
+
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(logger.name,)) as pool:
+        for texts in pool.imap(search_chunk, tasks):
+            yield from texts
+        ## Workers end when all tasks are done (no terminate on exit)
+        pool.close()
+        pool.join()
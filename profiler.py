@@ -0,0 +1,115 @@
+# coding: utf8
+
+import cProfile
+import functools
+import time
+import threading
+import tracemalloc
+
+
+class Profiler:
+
+    def __init__(self, logger=None, profileFile="", memoryTop=0):
+        """Timers of the hot paths, with cProfile and tracemalloc on demand.
+        Args:
+            logger (class:logging.Logger): Logger object for logging the reports.
+            profileFile (str) : If not empty, cProfile runs and its stats
+                                are dumped in this file by report. cProfile
+                                only profiles the thread where start is
+                                called : audio writer threads and network
+                                threads of --brokers are not profiled.
+            memoryTop (int)   : If > 0, tracemalloc runs and the memoryTop
+                                biggest allocations are logged by report.
+
+        Each stage is a [count, total ns, max ns] list. Wrapped functions
+        run on several threads (one network thread by broker, audio writer
+        threads), so stages are updated under a lock.
+        """
+        self.logger      = logger
+        self.profileFile = profileFile
+        self.memoryTop   = memoryTop
+
+        ## Key is stage name / Value is [count, total ns, max ns]
+        self.__stages  = {}
+        self.__lock    = threading.Lock()
+        self.__profile = None
+
+
+
+    def start(self):
+        """Start cProfile and tracemalloc (if wanted) """
+
+        if self.profileFile:
+            self.__profile = cProfile.Profile()
+            self.__profile.enable()
+
+        if self.memoryTop > 0:
+            tracemalloc.start()
+
+
+
+    def wrap(self, name, function):
+        """Return function, measured as the stage name """
+
+        stage = self.__stages.setdefault(name, [0, 0, 0])
+        clock = time.perf_counter_ns
+        lock  = self.__lock
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                with lock:
+                    stage[0] += 1
+                    stage[1] += elapsed
+                    if elapsed > stage[2]:
+                        stage[2] = elapsed
+
+        return wrapper
+
+
+
+    def lines(self):
+        """Return the report of stages as text lines """
+
+        with self.__lock:
+            stages = sorted((name, tuple(stage)) for name, stage in self.__stages.items())
+
+        lines = ["{0:<16} {1:>10} {2:>12} {3:>10} {4:>10}".format("stage", "calls", "total ms", "avg us", "max us")]
+        for name, (count, total, maximum) in stages:
+            lines.append("{0:<16} {1:>10} {2:>12.1f} {3:>10.1f} {4:>10.1f}"
+                         .format(name, count, total / 1e6, (total / count / 1e3) if count else 0.0, maximum / 1e3))
+        return lines
+
+
+
+    def report(self):
+        """Log the stages, dump cProfile stats and log the top allocations """
+
+        self.logger.info("Profile :\n%s", "\n".join(self.lines()))
+
+        ## Snapshot before the dump, so cProfile allocations are not counted
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+            current, peak = tracemalloc.get_traced_memory()
+            self.logger.info("Memory : %s bytes (peak %s bytes), top %s :\n%s", current, peak, self.memoryTop,
+                             "\n".join(str(statistic) for statistic in snapshot.statistics('lineno')[:self.memoryTop]))
+
+        if self.__profile is not None:
+            self.__profile.dump_stats(self.profileFile)
+            self.logger.info("cProfile stats dumped to %s", self.profileFile)
+
+
+
+    def stop(self):
+        """Report and stop cProfile and tracemalloc """
+
+        if self.__profile is not None:
+            self.__profile.disable()
+        self.report()
+        self.__profile = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
@@ -0,0 +1,101 @@
+# coding: utf8
+
+import heapq
+import io
+import time
+import wave
+from datetime import timedelta
+from wavsink import open_wav
+
+
+## Chunks of audioFrame sent by Rhasspy satellites
+CHUNK_FRAMES = 1024
+
+
+def wave_chunks(filename, logTime, topic, chunkFrames=CHUNK_FRAMES):
+    """Generator of (datetime, topic, wav bytes, None) chunks of a wave file,
+    each chunk at logTime + its offset in the file. The file (compressed
+    or not) is read chunk by chunk. """
+
+    with open_wav(filename) as wav_file, wave.open(wav_file, 'rb') as wav:
+        params = wav.getparams()
+        offset = 0
+        while True:
+            frames = wav.readframes(chunkFrames)
+            if not frames:
+                break
+
+            buffer = io.BytesIO()
+            with wave.open(buffer, 'wb') as chunk:
+                chunk.setparams(params)
+                chunk.writeframes(frames)
+
+            yield (logTime + timedelta(seconds=offset / params.framerate), topic, buffer.getvalue(), None)
+            offset += len(frames) // (params.sampwidth * params.nchannels)
+
+
+
+def lookahead(records):
+    """Merge records in time order. records is a sorted iterable of
+    (datetime, items), items an iterator of sorted (datetime, topic, payload, message)
+    (a single message, or the chunks of a wave file).
+
+    Only the next item of each iterator is kept in a heap, so memory only
+    depends on the count of wave files overlapping in time.
+    """
+
+    heap = []
+    order = 0
+
+    def push(items):
+        nonlocal order
+        item = next(items, None)
+        if item is not None:
+            heapq.heappush(heap, (item[0], order, item, items))
+            order += 1
+
+    for myDate, items in records:
+        ## Items before this record are ready
+        while heap and heap[0][0] <= myDate:
+            itemDate, itemOrder, item, nextItems = heapq.heappop(heap)
+            yield item
+            push(nextItems)
+        push(iter(items))
+
+    while heap:
+        itemDate, itemOrder, item, nextItems = heapq.heappop(heap)
+        yield item
+        push(nextItems)
+
+
+
+class Pacer:
+
+    def __init__(self, speed=1.0):
+        """Wait to keep the timing of messages.
+        Args:
+            speed (float) : 1 = real time, 10 = 10 times faster,
+                            0 = no wait (as fast as possible).
+        """
+        self.speed = speed
+
+        self.__first = None
+        self.__start = None
+
+
+
+    def wait(self, logTime):
+        """Wait until the time of a message saved at logTime """
+
+        if self.speed <= 0:
+            return
+
+        if self.__first is None:
+            self.__first = logTime
+            self.__start = time.monotonic()
+            return
+
+        ## The schedule is relative to the first message, so delays don't add up
+        delay = self.__start + (logTime - self.__first).total_seconds() / self.speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
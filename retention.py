@@ -0,0 +1,304 @@
+# coding: utf8
+
+import os
+import gzip
+import json
+import shutil
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from journal import Journal, SEGMENT_EXT, INDEX_EXT, COMPRESSED_EXT
+from sqlitestore import SqliteStore
+from textindex import TextIndex
+from message import loads
+
+
+## Folder (in the archive folder) where json files are compacted
+COMPACT_FOLDER = ".compact"
+
+## Files modified since less than this count of seconds may be still written
+RECENT = 300
+
+## Options of the retention task (same names as the args of Retention)
+RetentionOptions = namedtuple('RetentionOptions', 'maxAge maxBytes maxWavBytes maxJsonBytes compact compress interval',
+                              defaults=(0, 0, 0, 0, False, False, 600))
+
+
+class Retention:
+
+    def __init__(self, folder, logger, maxAge=0, maxBytes=0, maxWavBytes=0, maxJsonBytes=0,
+                 compact=False, compress=False, interval=600, segmentSize=16*1024*1024):
+        """Background task limiting the archive folder, while recording.
+        Args:
+            folder (str)       : Archive folder (segments, database, json and wave files).
+            logger (class:logging.Logger): Logger object for logging messages.
+            maxAge (int)       : Messages and files older than maxAge days are deleted (0 = no limit).
+            maxBytes (int)     : Max total size of files, the oldest are deleted first (0 = no limit).
+            maxWavBytes (int)  : Max size of wave files (0 = no limit).
+            maxJsonBytes (int) : Max size of messages : segments and json files (0 = no limit).
+            compact (bool)     : Json files of previous versions are compacted into segments.
+            compress (bool)    : Compacted segments are compressed with gzip.
+            interval (int)     : Seconds between 2 runs of the task.
+            segmentSize (int)  : Max size (bytes) of a compacted segment.
+
+        The task runs in a thread of low priority. The segment being written
+        and recent files are never deleted. The SQLite database is only
+        limited by maxAge, the index by maxAge and by the deleted segments.
+        """
+        self.folder       = folder
+        self.logger       = logger
+        self.maxAge       = maxAge
+        self.maxBytes     = maxBytes
+        self.maxWavBytes  = maxWavBytes
+        self.maxJsonBytes = maxJsonBytes
+        self.compact      = compact
+        self.compress     = compress
+        self.interval     = interval
+        self.segmentSize  = segmentSize
+        self.__dateFileFormat = '%Y%m%d%H%M%S%f'
+
+        self.__stopped = threading.Event()
+        self.__thread  = None
+
+
+
+    def enabled(self):
+        """Return True if there is something to do """
+        return bool(self.maxAge or self.maxBytes or self.maxWavBytes or self.maxJsonBytes or self.compact)
+
+
+
+    def start(self):
+        """Start the background task """
+
+        if self.enabled() and self.__thread is None:
+            self.__stopped.clear()
+            self.__thread = threading.Thread(target=self.__run, name="rhasspy-watch-retention", daemon=True)
+            self.__thread.start()
+
+
+
+    def stop(self):
+        """Stop the background task (after the file in progress) """
+
+        if self.__thread is not None:
+            self.__stopped.set()
+            self.__thread.join()
+            self.__thread = None
+
+
+
+    def __run(self):
+        """Loop of the retention thread """
+
+        ## Low priority for the disk and CPU work of this thread (Linux)
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+
+        while not self.__stopped.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                self.logger.exception("ERROR : Failed to apply retention")
+            self.__stopped.wait(self.interval)
+
+
+
+    def run_once(self):
+        """Compact json files, then delete old files and the oldest files over the limits """
+
+        if self.compact:
+            self.compact_json()
+
+        files = self.files()
+
+        if self.maxAge > 0:
+            limit = datetime.now() - timedelta(days=self.maxAge)
+            files = self.__delete([f for f in files if f[0] < limit], files, "older than {0} days".format(self.maxAge))[0]
+
+            deleted = SqliteStore(self.folder, self.logger).delete_before(limit)
+            if deleted:
+                self.logger.info("Retention : %s messages deleted from database", deleted)
+            TextIndex(self.folder, self.logger).delete_before(limit)
+
+        for kind, maxBytes in (("wav", self.maxWavBytes), ("json", self.maxJsonBytes), (None, self.maxBytes)):
+            if maxBytes > 0:
+                files, deleted = self.__delete(self.__over(files, kind, maxBytes), files, "over {0} bytes".format(maxBytes))
+
+                ## The index is counted in the size of the folder : entries
+                ## of deleted messages are deleted too (their pages are reused)
+                ends = [f[0] for f in deleted if f[2] == "json"]
+                if ends:
+                    TextIndex(self.folder, self.logger).delete_before(max(ends))
+
+
+
+    def files(self):
+        """Return the files which can be deleted, as sorted [(end datetime, start datetime, kind, size, [paths])].
+        A segment ends when the next one starts, with its index.
+        """
+
+        now = time.time()
+        segments = []
+        files = []
+
+        for filename in os.listdir(self.folder):
+            path = os.path.join(self.folder, filename)
+            name, extension = os.path.splitext(filename)
+            if extension == COMPRESSED_EXT:
+                name, extension = os.path.splitext(name)
+            if extension not in (".json", ".wav", SEGMENT_EXT):
+                continue
+
+            try:
+                start = datetime.strptime(name.split("_")[0], self.__dateFileFormat)
+                stat = os.stat(path)
+            except (ValueError, OSError):
+                continue
+
+            if extension == SEGMENT_EXT:
+                segments.append((start, path, stat.st_size))
+            elif now - stat.st_mtime >= RECENT:
+                files.append((start, start, "wav" if extension == ".wav" else "json", stat.st_size, [path]))
+
+        ## The last segment is the one being written
+        segments.sort()
+        for (start, path, size), (nextStart, nextPath, nextSize) in zip(segments, segments[1:]):
+            index = os.path.join(self.folder, os.path.basename(path).split('.')[0] + INDEX_EXT)
+            if os.path.exists(index):
+                size += os.path.getsize(index)
+            files.append((nextStart, start, "json", size, [path, index]))
+
+        files.sort()
+        return files
+
+
+
+    def __over(self, files, kind, maxBytes):
+        """Return the oldest files of kind (None = all) to delete to stay under maxBytes """
+
+        selected = [f for f in files if kind is None or f[2] == kind]
+
+        if kind is None:
+            ## Other files (current segment, database, recent files) are counted too
+            total = 0
+            for filename in os.listdir(self.folder):
+                try:
+                    total += os.path.getsize(os.path.join(self.folder, filename))
+                except OSError:
+                    pass
+        else:
+            total = sum(f[3] for f in selected)
+
+        over = []
+        for f in selected:
+            if total <= maxBytes:
+                break
+            over.append(f)
+            total -= f[3]
+        return over
+
+
+
+    def __delete(self, candidates, files, reason):
+        """Delete the files of candidates, oldest first. Return the remaining
+        files and the deleted ones. Stop on the first file which can't be
+        deleted (the next run tries again) or when the task is stopped.
+        """
+
+        deleted = []
+        for candidate in candidates:
+            if self.__stopped.is_set():
+                break
+            try:
+                for path in candidate[4]:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            except OSError as error:
+                self.logger.warning("Retention : failed to delete %s : %s", path, error)
+                break
+            deleted.append(candidate)
+
+        if not deleted:
+            return files, deleted
+
+        self.logger.info("Retention : %s files %s deleted", len(deleted), reason)
+        deletedIds = set(id(f) for f in deleted)
+        return [f for f in files if id(f) not in deletedIds], deleted
+
+
+
+    def compact_json(self):
+        """Append json files of previous versions, older than the first
+        segment, to new segments (compressed if wanted), then delete them.
+
+        Segments are written in a temporary folder and moved when complete,
+        so a search never reads a partial segment.
+        """
+
+        segments = Journal(self.folder, logger=self.logger).segments()
+        firstSegment = segments[0][0] if segments else datetime.max
+
+        ## Json files which are not named with a datetime are not messages
+        names = []
+        for filename in sorted(os.listdir(self.folder)):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                if datetime.strptime(os.path.splitext(filename)[0], self.__dateFileFormat) < firstSegment:
+                    names.append(filename)
+            except ValueError:
+                continue
+        if not names:
+            return
+
+        ## Segments of an interrupted compaction are written again
+        compactFolder = os.path.join(self.folder, COMPACT_FOLDER)
+        shutil.rmtree(compactFolder, ignore_errors=True)
+        os.makedirs(compactFolder)
+
+        ## A new segment by day at most, so segment names look like journal ones
+        journal = Journal(compactFolder, self.segmentSize, 86400, self.logger)
+        compacted = []
+        for filename in names:
+            if self.__stopped.is_set():
+                journal.close()
+                shutil.rmtree(compactFolder, ignore_errors=True)
+                return
+
+            try:
+                with open(os.path.join(self.folder, filename), 'rb') as json_file:
+                    payload = loads(json_file.read())
+            except ValueError:
+                self.logger.warning("Invalid json file not compacted : %s", filename)
+                continue
+            compacted.append(filename)
+
+            ## The 'topic' element was added to the payload when the file was saved
+            topic = payload.pop('topic', "")
+            logTime = datetime.strptime(os.path.splitext(filename)[0], self.__dateFileFormat)
+            journal.append(logTime, topic, json.dumps(payload).encode('utf8'))
+        journal.close()
+
+        for filename in sorted(os.listdir(compactFolder)):
+            path = os.path.join(compactFolder, filename)
+            if self.compress and filename.endswith(SEGMENT_EXT):
+                with open(path, 'rb') as f_in:
+                    with gzip.open(path + COMPRESSED_EXT, 'wb') as f_out:
+                        shutil.copyfileobj(f_in, f_out)
+                os.remove(path)
+
+        ## Indexes first : a segment is read as soon as it's in the folder
+        for filename in sorted(os.listdir(compactFolder), key=lambda filename: not filename.endswith(INDEX_EXT)):
+            os.replace(os.path.join(compactFolder, filename), os.path.join(self.folder, filename))
+        os.rmdir(compactFolder)
+
+        for filename in compacted:
+            os.remove(os.path.join(self.folder, filename))
+
+        self.logger.info("Retention : %s json files compacted", len(compacted))
@@ -6,71 +6,134 @@ It's a snips-watch like but, with some options (usefull for me).
 You will be able to :
     - Watch in live and in human readable text all the messages
       on Rhasspy MQTT Topic
-    - Record all messages in json file (or wav file)
+    - Record all messages in a journal (or wav file)
     - Query between 2 date all messages received with the same
       display as in live session.
 
 This tool will be very usefull if you want to analyze and optimize
 your intents, you hardware audio (recording for example) etc.
 
-The choice to use files instead of database to save the messages 
-was made for reasons of simplicity and speed of writing the script. 
-And secondly, because the tool is only started a few days,
-long enough to analyze a malfunction. The count of generated 
-files should not be a problem. 
-
-However, I do not recommend using it for too long or the number 
-of files may be very large.
+Messages are appended to segment files (one file per hour or per
+16MB by default) instead of one json file per message. Json files
+saved by previous versions are still read in search mode.
 
 """
 import os
 import argparse
-import json
+import signal
 from rhasspymqttclient import RhasspyMQTTClient 
+from brokers import parse_brokers
+from subscriptions import SubscriptionPlan
+from sessions import SessionCorrelator
+from histograms import LatencyStats
+from metrics import MetricsServer
+from profiler import Profiler
+from parallelsearch import parallel_search
+from writer import WriterOptions
+from shards import AudioOptions
+from silencegate import TrimOptions
+from outputsink import OutputOptions
+from retention import RetentionOptions
 from datetime import datetime
 from logger import get_logger   
 from dateutil import parser as dateparser
 
 def on_message(client, userdata, msg, logTime):
     
+    ## msg is a Message, its payload is already decoded
+    strLogTime = logTime.strftime(TIMELOGFORMAT)
+
+    ## process the output of message
+    if (not noStandardOut) or (outputFile != ""):
+        ## translate message in wanted format
+        message = mqtt.translate_message(msg.payload,msg.topic,strLogTime,outputFormatSelected,msg.broker)
+        ## show and/or save the message
+        mqtt.show_message(message,outputFile,noStandardOut)
+
+    ## Timeline of dialogues finished by this message
+    if correlator is not None:
+        show_dialogues(correlator.feed(msg))
+
+    ## Distributions of latency and confidence, shown every statsInterval seconds
+    if latencyStats is not None:
+        on_stats_message(client, userdata, msg, logTime)
+        global lastSummary
+        if lastSummary is None:
+            lastSummary = logTime
+        elif (logTime - lastSummary).total_seconds() >= statsInterval:
+            show_summary(logTime)
+            lastSummary = logTime
+
+
+def on_stats_message(client, userdata, msg, logTime):
+    latencyStats.feed(msg)
+
+
+def show_summary(logTime, reset=True):
+
     strLogTime = logTime.strftime(TIMELOGFORMAT)
+    for line in latencyStats.summary(reset):
+        mqtt.show_message("[{0}] {1}".format(strLogTime, line),outputFile,noStandardOut)
+
 
-    if "hermes/audioServer/" not in msg.topic: 
-        msg.payload = json.loads(msg.payload.decode('utf8'))
-        ## process the output of message
-        if (not noStandardOut) or (outputFile != ""):
-            ## translate message in wanted format
-            message = mqtt.translate_message(msg.payload,msg.topic,strLogTime,outputFormatSelected)
-            ## show and/or save the message
-            mqtt.show_message(message,outputFile,noStandardOut)
+def show_dialogues(dialogues):
+
+    for dialogue in dialogues:
+        ## Shown at the datetime of its last stage
+        text = "[{0}] {1}".format(dialogue.end.strftime(TIMELOGFORMAT), dialogue.format())
+        mqtt.show_message(text,outputFile,noStandardOut)
 
 
 def on_connect(client, userdata, flags, result_code):
     
-    logger.info  ("Connected to MQTT server %s:%s ",host,port)
+    ## userdata is the broker of client
+    logger.info  ("Connected to MQTT server %s (%s:%s) ",userdata.name,userdata.host,userdata.port)
     logger.debug ("Subscribing to topics...")
 
-    ## Subscribing to interesting topic
-    mqtt.subscribe("hermes/asr/#")
-    mqtt.subscribe("hermes/hotword/#")
-    mqtt.subscribe("hermes/nlu/#")
-    mqtt.subscribe("hermes/intent/#")
-    mqtt.subscribe("hermes/tts/#")
-    mqtt.subscribe("hermes/dialogueManager/#")
-    mqtt.subscribe("hermes/audioServer/#")
+    ## Subscribing to interesting topic (depends on mode and filters),
+    ## on the broker which is connected
+    for topic in mqtt.subscriptionPlan.topics:
+        logger.debug("Subscribing to %s", topic)
+        client.subscribe(topic)
         
 
 
-def on_saved_wav (filename,siteId, flux, logTime):       
+def on_replay_connect(client, userdata, flags, result_code):
+
+    ## Nothing to subscribe, messages are only published
+    logger.info("Connected to MQTT server %s:%s ",userdata.host,userdata.port)
+
+
+
+def on_sigterm(signum, frame):
+    ## Stop like on CTRL-C, so outputs are flushed and files closed
+    raise KeyboardInterrupt()
+
+
+def on_sigusr1(signum, frame):
+    ## Report of the profiler on demand (kill -USR1 <pid>)
+    profiler.report()
+
+
+
+def on_saved_wav (filename,siteId, flux, logTime, stats=None):       
 
     strLogTime = logTime.strftime(TIMELOGFORMAT)
 
-    text = "[Audio] {0} wav file saved for site {1}. name = {2}".format(flux, siteId, filename)
-    
-    logText = "[{0}] {1}".format(strLogTime,text)
+    ## stats : signal statistics of the wave file (None if unknown)
+    logText = mqtt.translate_wav(filename, siteId, flux, strLogTime, stats)
 
     mqtt.show_message(logText,outputFile,noStandardOut)
 
+    ## In search mode, wave files are in the thread of messages (live, they
+    ## are saved by the audio threads)
+    if (latencyStats is not None) and (args.mode == 'search'):
+        on_stats_wav(filename, siteId, flux, logTime, stats)
+
+
+def on_stats_wav(filename, siteId, flux, logTime, stats=None):
+    latencyStats.feed_wav(siteId, flux, stats)
+
 
 ############################################################
 # START
@@ -101,17 +164,62 @@ logger.info(" ****************** Rhasspy-watch is started **********************
 parser = argparse.ArgumentParser()
 parser.add_argument("--host",          help="host : MQTT hostname or IP", default=os.getenv('RW_HOST',"rhasspy-master"))
 parser.add_argument("--port",          help="port : MQTT server tcp port", default=os.getenv('RW_PORT',"1883"))
+parser.add_argument("--brokers",       help="brokers watched together, instead of host and port. ex: master1=rhasspy-1,master2=rhasspy-2:1884", default=os.getenv('RW_BROKERS',""))
 parser.add_argument("--username",      help="username : authentication on MQTT", default=os.getenv('RW_USERNAME',""))
 parser.add_argument("--password",      help="passwrd : authentication on MQTT", default=os.getenv('RW_PASSWORD',""))
 parser.add_argument("--tls",           help="tls : use TLS connection to MQTT broker", default=os.getenv('RW_TLS',False))
 parser.add_argument("--cacerts",       help="cacerts : CA path to verify the MQTT broker's TLS certificate", default=os.getenv('RW_CACERTS', None))
-parser.add_argument("--mode",          help="mqtt : (live) get logs from json files / mqtt_db : like mqtt but with MQTT message recording / search : For searching message in historic", default=os.getenv('RW_MODE',"mqtt"))
+parser.add_argument("--mode",          help="mqtt : (live) get logs from json files / mqtt_db : like mqtt but with MQTT message recording / search : For searching message in historic / stats : latency and confidence distributions in historic / replay : publish again messages of historic / follow : live messages recorded by a mqtt_db instance, without MQTT connection", default=os.getenv('RW_MODE',"mqtt"))
 parser.add_argument("--outputFormat",  help="human : return human text / raw : return payload as raw", default=os.getenv('RW_OUTFORMAT',"human"))
 parser.add_argument("--datetime_start",help="if search mode, the start date for search. ex: 2020-04-26 23:30:00", default=os.getenv('RW_DATESTART',"2020-04-10 01:43:26"))
 parser.add_argument("--datetime_stop", help="if search mode, the stop date for search. ex: 2020-04-27 01:00:00", default=os.getenv('RW_DATESTOP',"2020-06-10 01:50:00"))
 parser.add_argument("--outputFile",    help="file where output is saved", default=os.getenv('RW_OUTFILE', ""))
 parser.add_argument("--jsonfolder",    help="folder where payloads are saved as json file", default=os.getenv('RW_JSONFOLDER',os.path.join(scriptFolder,'./archives')))
 parser.add_argument("--noStandardOut", help="human view is NOT sent to standard output", default=os.getenv('RW_NOSTDOUT',False))
+parser.add_argument("--segmentSize",   help="max size (bytes) of a journal segment before a new one is started", default=os.getenv('RW_SEGSIZE',16*1024*1024))
+parser.add_argument("--segmentTime",   help="max duration (seconds) of a journal segment before a new one is started", default=os.getenv('RW_SEGTIME',3600))
+parser.add_argument("--writerQueueSize", help="max count of writes waiting for the writer thread", default=os.getenv('RW_WRITERQUEUE',10000))
+parser.add_argument("--writerPolicy",  help="block / drop-oldest / drop-audio-first : what to do when the writer queue is full", default=os.getenv('RW_WRITERPOLICY',"block"))
+parser.add_argument("--audioWorkers",  help="count of threads writing wave files, sites are shared between them", default=os.getenv('RW_AUDIOWORKERS',1))
+parser.add_argument("--audioTimeout",  help="a wave file without new audio since audioTimeout seconds is closed", default=os.getenv('RW_AUDIOTIMEOUT',30))
+parser.add_argument("--preroll",       help="seconds of audio saved before the hotword or the start of ASR", default=os.getenv('RW_PREROLL',1.0))
+parser.add_argument("--captureTimeout",help="max duration (seconds) of a record wave file", default=os.getenv('RW_CAPTURETIMEOUT',30))
+parser.add_argument("--trimSilence",   help="silence before and after the voice is trimmed from record wave files", default=os.getenv('RW_TRIMSILENCE',False))
+parser.add_argument("--trimThreshold", help="with trimSilence, audio below trimThreshold dBFS is silence", default=os.getenv('RW_TRIMTHRESHOLD',-50.0))
+parser.add_argument("--trimPrePadding",  help="with trimSilence, seconds of silence kept before the voice", default=os.getenv('RW_TRIMPREPADDING',0.3))
+parser.add_argument("--trimPostPadding", help="with trimSilence, seconds of silence kept after the voice", default=os.getenv('RW_TRIMPOSTPADDING',0.5))
+parser.add_argument("--trimMaxGap",    help="with trimSilence, silences longer than trimMaxGap seconds inside the voice are trimmed too (0 = kept)", default=os.getenv('RW_TRIMMAXGAP',0))
+parser.add_argument("--wavGzip",       help="wave files are compressed with gzip (.wav.gz) when they are closed", default=os.getenv('RW_WAVGZIP',False))
+parser.add_argument("--outputFlushLines",    help="lines are written to output by blocks of outputFlushLines...", default=os.getenv('RW_OUTFLUSHLINES',100))
+parser.add_argument("--outputFlushInterval", help="...or at least every outputFlushInterval seconds", default=os.getenv('RW_OUTFLUSHINTERVAL',1.0))
+parser.add_argument("--outputRotateSize",    help="output file is rotated when it reaches this size in bytes (0 = never)", default=os.getenv('RW_OUTROTATESIZE',0))
+parser.add_argument("--outputRotateTime",    help="output file is rotated every outputRotateTime seconds (0 = never)", default=os.getenv('RW_OUTROTATETIME',0))
+parser.add_argument("--outputGzip",    help="rotated output files are compressed with gzip", default=os.getenv('RW_OUTGZIP',False))
+parser.add_argument("--retentionAge",  help="if mqtt_db mode, messages and files older than retentionAge days are deleted (0 = no limit)", default=os.getenv('RW_RETENTIONAGE',0))
+parser.add_argument("--retentionSize", help="if mqtt_db mode, max size in bytes of the json folder, oldest files are deleted first (0 = no limit)", default=os.getenv('RW_RETENTIONSIZE',0))
+parser.add_argument("--retentionWavSize",  help="if mqtt_db mode, max size in bytes of wave files (0 = no limit)", default=os.getenv('RW_RETENTIONWAVSIZE',0))
+parser.add_argument("--retentionJsonSize", help="if mqtt_db mode, max size in bytes of segments and json files (0 = no limit)", default=os.getenv('RW_RETENTIONJSONSIZE',0))
+parser.add_argument("--retentionInterval", help="seconds between 2 runs of the retention task", default=os.getenv('RW_RETENTIONINTERVAL',600))
+parser.add_argument("--compact",       help="if mqtt_db mode, json files of previous versions are compacted into segments", default=os.getenv('RW_COMPACT',False))
+parser.add_argument("--compactGzip",   help="compacted segments are compressed with gzip", default=os.getenv('RW_COMPACTGZIP',False))
+parser.add_argument("--sites",         help="sites to watch (ex: kitchen,living) or to ignore (ex: -bedroom). Empty = all sites", default=os.getenv('RW_SITES',""))
+parser.add_argument("--topics",        help="topic families (hotword,asr,nlu,intent,tts,dialogueManager,audioServer) or topic filters to watch, or to ignore (ex: -tts). Empty = all", default=os.getenv('RW_TOPICS',""))
+parser.add_argument("--storage",       help="journal : messages are saved in segment files / sqlite : messages are saved in a SQLite database", default=os.getenv('RW_STORAGE',"journal"))
+parser.add_argument("--siteId",        help="if search mode, only messages of this site", default=os.getenv('RW_SITEID',""))
+parser.add_argument("--topic",         help="if search mode, only messages of this topic (MQTT wildcards allowed). ex: hermes/intent/#", default=os.getenv('RW_TOPIC',""))
+parser.add_argument("--sessions",      help="show the timeline (latency of each stage in ms) of each dialogue session", default=os.getenv('RW_SESSIONS',False))
+parser.add_argument("--statsInterval", help="latency and confidence distributions are shown every statsInterval seconds (0 = never)", default=os.getenv('RW_STATSINTERVAL',0))
+parser.add_argument("--metricsPort",   help="if live mode, TCP port of the metrics HTTP endpoint (Prometheus format). 0 = no endpoint", default=os.getenv('RW_METRICSPORT',0))
+parser.add_argument("--metricsHost",   help="address of the metrics HTTP endpoint", default=os.getenv('RW_METRICSHOST',"127.0.0.1"))
+parser.add_argument("--profile",       help="measure the hot paths, report at exit or on SIGUSR1", default=os.getenv('RW_PROFILE',False))
+parser.add_argument("--profileFile",   help="if profile, cProfile stats are dumped in this file at exit or on SIGUSR1", default=os.getenv('RW_PROFILEFILE',""))
+parser.add_argument("--profileMemory", help="if profile, the profileMemory biggest allocations (tracemalloc) are logged at exit or on SIGUSR1", default=os.getenv('RW_PROFILEMEMORY',0))
+parser.add_argument("--speed",         help="if replay mode, 1 = timing of messages kept, 10 = 10 times faster, 0 = as fast as possible", default=os.getenv('RW_SPEED',1.0))
+parser.add_argument("--cursorFile",    help="if follow mode, file where the position in the journal is saved, to continue from there on next start (empty = from the end)", default=os.getenv('RW_CURSORFILE',""))
+parser.add_argument("--pollInterval",  help="if follow mode, seconds between 2 reads of the journal when inotify is not available", default=os.getenv('RW_POLLINTERVAL',0.2))
+parser.add_argument("--searchWorkers", help="if search mode, count of processes searching chunks of the date range (1 = no parallel search)", default=os.getenv('RW_SEARCHWORKERS',1))
+parser.add_argument("--query",         help="if search mode, only utterances and intents matching all terms. ex: \"lumière intent:LightOn room=cuisine\"", default=os.getenv('RW_QUERY',""))
+parser.add_argument("--sessionId",     help="if search mode, only messages of this session", default=os.getenv('RW_SESSIONID',""))
 args = parser.parse_args()
 
 ## Set the json folder where json files are saved or read
@@ -142,6 +250,10 @@ logger.info("hostname : %s", host)
 port = int(args.port)
 logger.info("TCP port : %s", str(port))
 
+## Set the brokers watched together (host and port if empty)
+brokers = parse_brokers(str(args.brokers), port)
+logger.info("Brokers : %s", ", ".join("{0} ({1}:{2})".format(broker.name, broker.host, broker.port) for broker in brokers))
+
 ## Set the username for authent
 username = str(args.username)
 logger.info("username : %s", username)
@@ -157,12 +269,125 @@ logger.info("TLS : %s", tls)
 cacerts = args.cacerts
 logger.info("CA path : %s", cacerts)
 
+## Set the rotation of journal segments
+segmentSize = int(args.segmentSize)
+logger.info("Segment size : %s", str(segmentSize))
+segmentTime = int(args.segmentTime)
+logger.info("Segment time : %s", str(segmentTime))
+
+## Set the queue of the background writer
+writerQueueSize = int(args.writerQueueSize)
+logger.info("Writer queue size : %s", str(writerQueueSize))
+writerPolicy = str(args.writerPolicy)
+logger.info("Writer policy : %s", writerPolicy)
+
+## Set the threads writing wave files
+audioWorkers = int(args.audioWorkers)
+logger.info("Audio workers : %s", str(audioWorkers))
+
+## Set the timeout of wave files
+audioTimeout = int(args.audioTimeout)
+logger.info("Audio timeout : %s", str(audioTimeout))
+preroll = float(args.preroll)
+logger.info("Pre-roll : %s", str(preroll))
+captureTimeout = int(args.captureTimeout)
+logger.info("Capture timeout : %s", str(captureTimeout))
+
+## Set the trim of silence and the compression of wave files
+trimSilence = args.trimSilence
+trimThreshold = float(args.trimThreshold)
+trimPrePadding = float(args.trimPrePadding)
+trimPostPadding = float(args.trimPostPadding)
+trimMaxGap = float(args.trimMaxGap)
+logger.info("Trim of silence : %s (threshold : %s dBFS, padding : %s / %s seconds, max gap : %s seconds)",
+            trimSilence, str(trimThreshold), str(trimPrePadding), str(trimPostPadding), str(trimMaxGap))
+wavGzip = args.wavGzip
+logger.info("Wave files gzip : %s", wavGzip)
+
+## Set the buffering and rotation of outputs
+outputFlushLines = int(args.outputFlushLines)
+outputFlushInterval = float(args.outputFlushInterval)
+logger.info("Output flush : %s lines or %s seconds", str(outputFlushLines), str(outputFlushInterval))
+outputRotateSize = int(args.outputRotateSize)
+outputRotateTime = int(args.outputRotateTime)
+outputGzip = args.outputGzip
+logger.info("Output rotation : %s bytes or %s seconds (gzip : %s)", str(outputRotateSize), str(outputRotateTime), outputGzip)
+
+## Set the storage of messages
+storage = str(args.storage)
+logger.info("Storage : %s", storage)
+
+## Follow mode tails the journal segments, a SQLite storage has none
+if (args.mode == 'follow') and (storage == 'sqlite'):
+    parser.error("--mode follow reads the journal segments written by a 'mqtt_db' instance, "
+                 "it can't follow messages saved with --storage sqlite")
+
+## Set the retention of the json folder
+retentionAge = int(args.retentionAge)
+retentionSize = int(args.retentionSize)
+retentionWavSize = int(args.retentionWavSize)
+retentionJsonSize = int(args.retentionJsonSize)
+retentionInterval = int(args.retentionInterval)
+logger.info("Retention : %s days, %s bytes (wav : %s bytes, json : %s bytes), every %s seconds",
+            str(retentionAge), str(retentionSize), str(retentionWavSize), str(retentionJsonSize), str(retentionInterval))
+compact = args.compact
+compactGzip = args.compactGzip
+logger.info("Compaction of json files : %s (gzip : %s)", compact, compactGzip)
+
+## Set the correlation of dialogue sessions
+sessions = args.sessions
+logger.info("Sessions : %s", sessions)
+correlator = SessionCorrelator() if sessions else None
+
+## Set the summary of latency and confidence distributions
+statsInterval = int(args.statsInterval)
+logger.info("Stats interval : %s", str(statsInterval))
+latencyStats = LatencyStats() if (statsInterval > 0) or (args.mode == 'stats') else None
+lastSummary = None
+
+## Set the metrics endpoint
+metricsPort = int(args.metricsPort)
+metricsHost = str(args.metricsHost)
+logger.info("Metrics endpoint : %s:%s", metricsHost, str(metricsPort))
+
+## Set the profiling
+profile = args.profile
+profileFile = str(args.profileFile)
+profileMemory = int(args.profileMemory)
+logger.info("Profile : %s (cProfile file : '%s', memory top : %s)", profile, profileFile, str(profileMemory))
+
+## Options of the client, grouped by the part they configure
+writer = WriterOptions(queueSize=writerQueueSize, policy=writerPolicy, audioWorkers=audioWorkers)
+audio = AudioOptions(idleTimeout=audioTimeout, preroll=preroll, captureTimeout=captureTimeout, compress=wavGzip)
+trim = TrimOptions(threshold=trimThreshold, prePadding=trimPrePadding, postPadding=trimPostPadding,
+                   maxGap=trimMaxGap) if trimSilence else None
+output = OutputOptions(flushLines=outputFlushLines, flushInterval=outputFlushInterval, rotateSize=outputRotateSize,
+                       rotateTime=outputRotateTime, gzipRotated=outputGzip)
+retention = RetentionOptions(maxAge=retentionAge, maxBytes=retentionSize, maxWavBytes=retentionWavSize,
+                             maxJsonBytes=retentionJsonSize, compact=compact, compress=compactGzip,
+                             interval=retentionInterval)
+
 ## Create the custom MQTT object
-mqtt = RhasspyMQTTClient(host, port, username, password, tls, cacerts, False, jsonfolder, logger )
+mqtt = RhasspyMQTTClient(host=host, port=port, username=username, password=password, tls=tls, cacerts=cacerts,
+                         recording=False, jsonfolder=jsonfolder, logger=logger,
+                         storage=storage, segmentSize=segmentSize, segmentTime=segmentTime, brokers=brokers,
+                         writer=writer, audio=audio, trim=trim, output=output, retention=retention)
 mqtt.on_connect = on_connect
 mqtt.on_message = on_message
 mqtt.on_saved_wav = on_saved_wav
 
+## On SIGTERM (docker stop...), stop cleanly
+signal.signal(signal.SIGTERM, on_sigterm)
+
+## Timers of the hot paths
+profiler = None
+if profile:
+    profiler = Profiler(logger, profileFile, profileMemory)
+    mqtt.instrument(profiler)
+    profiler.start()
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, on_sigusr1)
+
 ## If Live MQTT listening is required
 if (args.mode == 'mqtt') or (args.mode == 'mqtt_db'):
     logger.info("Mode : Listen live MQTT topics")
@@ -177,19 +402,132 @@ if (args.mode == 'mqtt') or (args.mode == 'mqtt_db'):
         recording = True
         os.makedirs(jsonfolder, exist_ok=True) 
 
+    ## Topics to subscribe : no audio if not recording, audio by site...
+    mqtt.subscriptionPlan = SubscriptionPlan(recording, str(args.sites), str(args.topics), logger)
+    logger.info("Topics : %s", ", ".join(mqtt.subscriptionPlan.topics))
+
+    ## Metrics of the live session
+    metricsServer = None
+    if metricsPort > 0:
+        metricsServer = MetricsServer(metricsHost, metricsPort, mqtt.metrics, logger)
+        metricsServer.start()
+
     ## Start to listen MQTT
     mqtt.recording = recording
-    mqtt.connect()
+    try:
+        mqtt.connect()
+    except KeyboardInterrupt:
+        logger.info("Interrupted by user")
+    finally:
+        if metricsServer is not None:
+            metricsServer.stop()
+        mqtt.close()
     
 elif (args.mode == 'search'):
     logger.info("Mode : Query on DB")
     recording = False
     
-    logger.info("Start from : {0}".format(args.datetime_start) )
-    logger.info("Stop at : {0}".format(args.datetime_stop) )
+    logger.info("Start from : %s", args.datetime_start)
+    logger.info("Stop at : %s", args.datetime_stop)
     datestart = dateparser.parse(args.datetime_start)
     datestop = dateparser.parse(args.datetime_stop)
+
+    logger.info("Filters : siteId '%s', topic '%s', sessionId '%s'", args.siteId, args.topic, args.sessionId)
+
+    ## Sessions and stats need all messages in the main process
+    searchWorkers = int(args.searchWorkers)
+    logger.info("Search workers : %s", str(searchWorkers))
     
-    mqtt.search_message(datestart,datestop,"",jsonfolder,outputFormatSelected,outputFile)
+    ## Query on the index of utterances and intents
+    query = str(args.query)
+    logger.info("Query : '%s'", query)
+
+    try:
+        if query:
+            count = mqtt.query_message(datestart,datestop,query,jsonfolder,str(args.siteId),str(args.topic),str(args.sessionId))
+            logger.info("Query : %s messages found", count)
+        elif (searchWorkers > 1) and (correlator is None) and (latencyStats is None):
+            ## Messages are translated by the workers, shown in order
+            for text in parallel_search(datestart,datestop,jsonfolder,outputFormatSelected,TIMELOGFORMAT,
+                                        str(args.siteId),str(args.topic),str(args.sessionId),searchWorkers,logger):
+                mqtt.show_message(text,outputFile,noStandardOut)
+        else:
+            mqtt.search_message(datestart,datestop,str(args.siteId),jsonfolder,outputFormatSelected,outputFile,
+                                str(args.topic),str(args.sessionId))
+
+        ## Dialogues not ended in the search period
+        if correlator is not None:
+            show_dialogues(correlator.close())
+    except KeyboardInterrupt:
+        logger.info("Interrupted by user")
+    finally:
+        mqtt.close()
+
+elif (args.mode == 'stats'):
+    logger.info("Mode : Distributions on DB")
+    recording = False
+
+    logger.info("Start from : %s", args.datetime_start)
+    logger.info("Stop at : %s", args.datetime_stop)
+    datestart = dateparser.parse(args.datetime_start)
+    datestop = dateparser.parse(args.datetime_stop)
+
+    logger.info("Filters : siteId '%s', topic '%s', sessionId '%s'", args.siteId, args.topic, args.sessionId)
+
+    ## Messages are only counted (one pass), not shown
+    mqtt.on_message = on_stats_message
+    mqtt.on_saved_wav = on_stats_wav
+
+    try:
+        mqtt.search_message(datestart,datestop,str(args.siteId),jsonfolder,outputFormatSelected,outputFile,
+                            str(args.topic),str(args.sessionId))
+        latencyStats.close()
+        show_summary(datestop, False)
+    except KeyboardInterrupt:
+        logger.info("Interrupted by user")
+    finally:
+        mqtt.close()
+
+elif (args.mode == 'replay'):
+    logger.info("Mode : Replay messages of DB")
+    recording = False
+
+    logger.info("Start from : %s", args.datetime_start)
+    logger.info("Stop at : %s", args.datetime_stop)
+    datestart = dateparser.parse(args.datetime_start)
+    datestop = dateparser.parse(args.datetime_stop)
+
+    speed = float(args.speed)
+    logger.info("Speed : %s", str(speed))
+    logger.info("Filters : siteId '%s', topic '%s', sessionId '%s'", args.siteId, args.topic, args.sessionId)
+
+    mqtt.on_connect = on_replay_connect
+
+    try:
+        count = mqtt.replay(datestart,datestop,jsonfolder,speed,str(args.siteId),str(args.topic),str(args.sessionId))
+        logger.info("%s messages published", count)
+    except KeyboardInterrupt:
+        logger.info("Interrupted by user")
+    finally:
+        mqtt.close()
+
+elif (args.mode == 'follow'):
+    logger.info("Mode : Follow messages recorded in DB")
+    recording = False
+
+    cursorFile = str(args.cursorFile)
+    pollInterval = float(args.pollInterval)
+    logger.info("Cursor file : '%s', poll interval : %s", cursorFile, str(pollInterval))
+    logger.info("Filters : siteId '%s', topic '%s', sessionId '%s'", args.siteId, args.topic, args.sessionId)
+
+    try:
+        mqtt.follow(jsonfolder,cursorFile,pollInterval,str(args.siteId),str(args.topic),str(args.sessionId))
+    except KeyboardInterrupt:
+        logger.info("Interrupted by user")
+    finally:
+        mqtt.close()
+
+if profiler is not None:
+    profiler.stop()
 
 logger.info(" ****************** Rhasspy-watch is stopped ***************************")
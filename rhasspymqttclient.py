@@ -1,20 +1,37 @@
 # coding: utf8
 
 from paho.mqtt.client import Client
-from paho.mqtt.client import MQTTMessage
 import os
 from datetime import datetime
-import json
-import wave
-import io
 import re
-from termcolor import colored
-import codecs
+import heapq
+import threading
+import time
+import json
+from bisect import bisect_left
+from journal import Journal, SEGMENT_EXT, COMPRESSED_EXT
+from sqlitestore import SqliteStore
+from paho.mqtt.client import topic_matches_sub
+from writer import BackgroundWriter, WriterOptions
+from shards import AudioShards, AudioOptions
+from wavsink import WAV_EXT, wav_name, open_wav
+from message import Message, loads
+from outputsink import OutputSink, OutputOptions
+from metrics import Counters
+from replay import wave_chunks, lookahead, Pacer
+from follow import Follower
+from retention import Retention, RetentionOptions
+from brokers import Broker, site_key
+from textindex import TextIndex
+from audiostats import format_stats
+import humantext
 
 
 class RhasspyMQTTClient:
 
-    def __init__(self, host="", port=1883, username="", password="", tls=False, cacerts=None, recording=False, jsonfolder="", logger=None):
+    def __init__(self, host="", port=1883, username="", password="", tls=False, cacerts=None, recording=False, jsonfolder="", logger=None,
+                 *, storage='journal', segmentSize=16*1024*1024, segmentTime=3600, brokers=None,
+                 writer=WriterOptions(), audio=AudioOptions(), trim=None, output=OutputOptions(), retention=RetentionOptions()):
         """The __init__ function of custom MQTT Class.
         Args:
             host (str)               : MQTT Server name or IP.
@@ -24,8 +41,19 @@ class RhasspyMQTTClient:
             password (str)(option)   : Password to connect MQTT server.
             tls (bool)               : Use TLS to connect to MQTT server.
             cacerts (str)            : CA path to verify the MQTT server's TLS certificate, or None for the system's default CA system.
-            recording (bool)          : save all messages as json file (and wave).
+            recording (bool)          : save all messages in storage (and wave).
             jsonfolder (str)         : Folder where messages are saved
+
+        Other options are keyword only, grouped by the part they configure :
+            storage (str)            : Where messages are saved : 'journal' (segment files) or 'sqlite'.
+            segmentSize (int)        : Max size (bytes) of a journal segment.
+            segmentTime (int)        : Max duration (seconds) of a journal segment.
+            brokers (list)           : class:brokers.Broker to watch together, instead of host and port.
+            writer (tuple)           : Queues of the writer threads (see class:writer.WriterOptions).
+            audio (tuple)            : Wave files (see class:shards.AudioOptions).
+            trim (tuple)             : Silence trim of record wave files (see class:silencegate.TrimOptions), None = no trim.
+            output (tuple)           : Buffering and rotation of outputs (see class:outputsink.OutputOptions).
+            retention (tuple)        : Retention and compaction of the json folder (see class:retention.RetentionOptions).
         """ 
         ## Properties
         self.host       = host
@@ -39,110 +67,320 @@ class RhasspyMQTTClient:
         self.logger     = logger
         self.__dateFileFormat = '%Y%m%d%H%M%S%f'
 
-        ## Dict who contains pair key/value by site
-        ## Key is site name / Value is array of wave bytes received
-        self.__audioFrames = {}
-        self.__playBytes   = {}
+        ## SubscriptionPlan : sites and topics filtered by the client (None = no filter)
+        self.subscriptionPlan = None
 
-        ## Paho Mqtt Client
-        self.__mqtt = Client()
-        self.__mqtt.message_callback_add("hermes/audioServer/#",self.on_audio)
+        ## Counters of the writer thread (see metrics method), and of
+        ## messages not received from a broker
+        self.counters = Counters()
 
-        ## override some methods
-        self.__mqtt.on_connect = self.on_cnx ### GRRRR
-        self.__mqtt.on_message = self.on_msg
+        ## Brokers watched, each one with its own paho client and network
+        ## thread. The name of the broker is attached to messages only when
+        ## several brokers are watched
+        self.brokers = brokers if brokers else [Broker(host, host, port)]
+        self.__multiBroker = len(self.brokers) > 1
 
+        ## Callbacks of brokers are serialized : messages get their datetime
+        ## and are recorded and shown in the same order
+        self.__dispatchLock = threading.Lock()
 
+        ## Storage where messages (not audio) are appended
+        if storage == 'sqlite':
+            self.__storage = SqliteStore(jsonfolder, logger)
+        elif storage == 'journal':
+            self.__storage = Journal(jsonfolder, segmentSize, segmentTime, logger)
+        else:
+            raise ValueError("Unknown storage : {0}".format(storage))
 
-    def __saveJson(self,payload,topic,logTime):
-        """Save each MQTT message (not audio) as a json file """
-        
-        self.logger.debug('enter in show_message method.')
+        ## Inverted index of utterances and intents, written with the storage
+        self.__index = TextIndex(jsonfolder, logger)
 
-        strFileTime = logTime.strftime(self.__dateFileFormat)
+        ## Journal and wave files are written by background threads,
+        ## MQTT callbacks only enqueue the writes
+        self.__writer = BackgroundWriter(writer.queueSize, writer.policy, logger)
+        self.__writer.on_tick = self.__on_tick
 
-        ## Get payloada nd save topic info in json    
-        payload.update({"topic":topic})
+        ## Wave files written chunk by chunk, by site and flux, by
+        ## audioWorkers threads. Each site is always written by the same thread.
+        ## Silence of record files is trimmed while they are written
+        self.__shards = AudioShards(jsonfolder, logger, count=writer.audioWorkers, maxsize=writer.queueSize,
+                                    policy=writer.policy, trim=trim, **audio._asdict())
+        self.__shards.on_saved_wav = self.__on_sink_saved
 
-        ## Dump the payload to json file
-        with open(os.path.join(self.jsonfolder,strFileTime + ".json"), 'w') as outfile:
-            json.dump(payload, outfile)
-  
-        self.logger.debug("payload saved in %s.json file",strFileTime)
+        ## Retention and compaction of the json folder, while recording
+        self.__retention = Retention(jsonfolder, logger, segmentSize=segmentSize, **retention._asdict())
 
+        ## Outputs of show_message (stdout and output file), opened on first use
+        self.__outputOptions = output
+        self.__outputs = {}
+        self.__outputsLock = threading.Lock()
 
+        ## Sorted names of files by folder, listed once (a parallel search
+        ## reads the folder for each chunk of dates)
+        self.__listings = {}
 
-    def __saveWave(self,siteId,logTime,arrBytesWav,flux):
-        """save all audio messages as wave files """
 
-        self.logger.debug('enter in __saveWave private method.')
+        ## Paho Mqtt Client of each broker (userdata is the broker)
+        for broker in self.brokers:
+            broker.client = Client(userdata=broker)
+            broker.client.message_callback_add("hermes/audioServer/#",self.on_audio)
 
-        strFileTime = logTime.strftime(self.__dateFileFormat)
- 
-        ## Generate the wave file name with name, siteId and flux
-        wave_filename = os.path.join (self.jsonfolder,strFileTime + "_" + siteId + "_" + flux + ".wav")
-        self.logger.debug("Saving array of waves in %s.wav ",strFileTime)
+            ## override some methods
+            broker.client.on_connect = self.on_cnx ### GRRRR
+            broker.client.on_message = self.on_msg
+
+        ## The first broker is the one of replay
+        self.__mqtt = self.brokers[0].client
 
-        ## open the wave file with write access
-        output = wave.open(wave_filename,'wb') 
+
+
+    def __saveJson(self,message):
+        """Append each MQTT message (not audio) to the storage """
         
-        try:
-            ## set wave file parameters from first wave element in array
-            with io.BytesIO(arrBytesWav[0]) as wav_buffer:       
-                with wave.open(wav_buffer,'rb') as w:                    
-                    output.setparams(w.getparams())
+        self.logger.debug('enter in __saveJson private method.')
+
+        ## The raw payload is saved, with its topic and its datetime
+        location = self.__storage.append_message(message)
+        self.counters.increment('records')
+
+        ## Utterances and intents are indexed with their location
+        siteId = message.payload.get('siteId') if isinstance(message.payload, dict) else None
+        self.__index.add_message(message, site_key(siteId, message.broker) if siteId else None, location)
+
+
+
+    def __saveWave(self,siteId,logTime,wav,flux):
+        """Append an audio message (a wave chunk) to the wave file of site and flux """
+
+        self.logger.debug('enter in __saveWave private method.')
+
+        self.__shards.sinks_of(siteId).write(siteId, flux, wav, logTime)
+
 
-            try:
-                ## Extract each frames from all wave elements in arrBytesWav
-                ## to add them to output wave file
-                for wav in arrBytesWav :
-                    with io.BytesIO(wav) as wav_buffer:
-                        with wave.open(wav_buffer,'rb') as w:
-                            output.writeframes(w.readframes(w.getnframes()))
-                
-                output.close()    
 
-                self.logger.debug("%s.wav saved successfully ",strFileTime)
+    def __startWave(self,siteId,logTime):
+        """Start to save record audio of site, with the pre-roll """
 
-                self.on_saved_wav (strFileTime + "_" + siteId + "_" + flux + ".wav", siteId, flux, logTime)
-            except:
-                self.logger.warning("ERROR : Failed to extract frames from array",strFileTime)
-                output.close()    
-        except:
-            self.logger.warning("ERROR : Failed to get wave param in first frames ",strFileTime)    
-            output.close()    
+        self.logger.debug('enter in __startWave private method.')
+
+        self.__shards.sinks_of(siteId).start_capture(siteId, logTime)
+
+
+
+    def __closeWave(self,siteId,logTime,flux,wav=None):
+        """Close the wave file of site and flux. If no wave file is opened,
+        wav (a complete wave if not None) is saved instead """
+
+        self.logger.debug('enter in __closeWave private method.')
+
+        sinks = self.__shards.sinks_of(siteId)
+
+        if flux == 'record':
+            sinks.stop_capture(siteId, logTime)
+            return
+
+        if (wav is not None) and not sinks.is_open(siteId, flux):
+            sinks.write(siteId, flux, wav, logTime)
+
+        sinks.close(siteId, flux, logTime)
+
+
+
+    def __on_tick(self):
+        """Periodic tasks of the writer thread """
+
+        self.__storage.flush()
+        self.__index.flush()
+
+
+
+    ## on_saved_wav is overridden after the creation of sinks.
+    ## Called from the audio threads
+    def __on_sink_saved(self, filename, siteId, flux, logTime, stats=None):
+        self.counters.increment('wavFiles')
+
+        ## The index is only written by the writer of messages. Statistics
+        ## are saved in the index, not in the storage : they are known when
+        ## the file is closed, after messages with later datetimes
+        self.__writer.put('control', self.__index.add_wav, filename, siteId, flux, logTime, stats)
+        self.on_saved_wav(filename, siteId, flux, logTime, stats)
 
 
     def connect(self):
-        """Connect to the MQTT broker defined in the configuration. """
+        """Connect to the MQTT broker(s) defined in the configuration. """
 
         self.logger.debug('enter in connect method.')
 
+        if self.recording:
+            self.start_writers()
+            self.__retention.start()
+
+        if not self.__multiBroker:
+            broker = self.brokers[0]
+            self.__configure(broker.client)
+            self.logger.info('Connecting to MQTT broker %s:%s...', str(broker.host), str(broker.port))
+            broker.client.connect(broker.host, broker.port)
+            broker.client.loop_forever()
+            return
+
+        ## Each broker connects and reconnects (with its own backoff) in
+        ## its own network thread, a broker down does not stall the others
+        for broker in self.brokers:
+            self.__configure(broker.client)
+            self.logger.info('Connecting to MQTT broker %s (%s:%s)...', broker.name, str(broker.host), str(broker.port))
+            broker.client.reconnect_delay_set(1, 120)
+            broker.client.connect_async(broker.host, broker.port)
+            broker.client.loop_start()
+
+        try:
+            while True:
+                time.sleep(1)
+        finally:
+            for broker in self.brokers:
+                broker.client.disconnect()
+                broker.client.loop_stop()
+
+
+
+    def __configure(self, client):
+        """Set authentication and TLS of a MQTT client """
+
         if self.username != "":
             self.logger.debug('Setting username and password for MQTT broker.')
-            self.__mqtt.username_pw_set(self.username, self.password)
+            client.username_pw_set(self.username, self.password)
 
         if self.tls:
             self.logger.debug('Setting TLS for MQTT broker.')
-            self.__mqtt.tls_set(ca_certs=self.cacerts)
+            client.tls_set(ca_certs=self.cacerts)
 
-        self.logger.info('Connecting to MQTT broker %s:%s...', str(self.host), str(self.port))
-        
-        self.__mqtt.connect(self.host, self.port)
-        self.__mqtt.loop_forever()
+
+    def close(self):
+        """Write pending messages and close the storage before leaving """
+
+        self.logger.debug('enter in close method.')
+
+        self.__retention.stop()
+        self.__shards.stop()
+        self.__writer.stop()
+        self.__storage.close()
+        self.__index.close()
+
+        for output in self.__outputs.values():
+            output.close()
+        self.__outputs = {}
+
+        if self.recording:
+            self.logger.info("Writer stats : %s", self.writer_stats())
+            for i, stats in enumerate(self.audio_stats()):
+                self.logger.info("Audio writer %s stats : %s", i, stats)
+
+
+
+    def start_writers(self):
+        """Start the threads writing messages and wave files """
+
+        self.__writer.start()
+        self.__shards.start()
+
+
+
+    def writer_stats(self):
+        """Return the counters of the background writer (queue depth,
+        write latency, dropped writes...) """
+        return self.__writer.stats()
+
+
+
+    def audio_stats(self):
+        """Return the counters of each audio writer (backlog of its sites,
+        write latency, dropped writes...) """
+        return self.__shards.stats()
+
+
+
+    def metrics(self):
+        """Return the metrics (for class:metrics.MetricsServer) : messages,
+        bytes, audio buffered, writes, errors and connections """
+
+        counters = self.counters.snapshot()
+
+        ## Writer of messages, and audio writers
+        writers = [({"writer": "messages"}, self.__writer.stats())]
+        writers += [({"writer": "audio-{0}".format(i)}, stats) for i, stats in enumerate(self.__shards.stats())]
+
+        ## Counters of MQTT callbacks, by broker
+        brokerCounters = [(broker.name, broker.counters.snapshot()) for broker in self.brokers]
+        brokers = brokerCounters + [(None, counters)]
+        messages = [(dict(family=name, **({"broker": brokerName} if brokerName else {})), count)
+                    for brokerName, snapshot in brokers for name, count in snapshot["messages"].items()]
+        payloadBytes = [(dict(family=name, **({"broker": brokerName} if brokerName else {})), count)
+                        for brokerName, snapshot in brokers for name, count in snapshot["bytes"].items()]
+
+        ## Audio in open wave files (by site and flux) and in pre-roll buffers
+        audio = [({"siteId": siteId, "flux": flux}, size) for (siteId, flux), size in self.__shards.sizes().items()]
+        audio += [({"siteId": siteId, "flux": "preroll"}, size) for siteId, size in self.__shards.buffered().items()]
+
+        return [("rhasspy_watch_messages_total", "counter", "MQTT messages received by topic family",
+                 messages),
+                ("rhasspy_watch_bytes_total", "counter", "Payload bytes received by topic family",
+                 payloadBytes),
+                ("rhasspy_watch_parse_errors_total", "counter", "Messages with an invalid json payload",
+                 [({"broker": brokerName}, snapshot["parseErrors"]) for brokerName, snapshot in brokerCounters]),
+                ("rhasspy_watch_mqtt_reconnects_total", "counter", "Connections to the MQTT broker after the first one",
+                 [({"broker": brokerName}, max(snapshot["connects"] - 1, 0)) for brokerName, snapshot in brokerCounters]),
+                ("rhasspy_watch_audio_buffered_bytes", "gauge", "Audio bytes of open wave files and pre-roll buffers",
+                 audio),
+                ("rhasspy_watch_records_total", "counter", "Messages saved in the storage",
+                 [({}, counters["records"])]),
+                ("rhasspy_watch_wav_files_total", "counter", "Wave files saved",
+                 [({}, counters["wavFiles"])]),
+                ("rhasspy_watch_writer_queue_depth", "gauge", "Writes waiting for the writer thread",
+                 [(labels, writer["depth"]) for labels, writer in writers]),
+                ("rhasspy_watch_writer_dropped_total", "counter", "Writes dropped because the writer queue was full",
+                 [(labels, writer["dropped"]) for labels, writer in writers]),
+                ("rhasspy_watch_writer_errors_total", "counter", "Writes failed",
+                 [(labels, writer["errors"]) for labels, writer in writers]),
+                ("rhasspy_watch_writes_total", "counter", "Writes done by the writer threads (journal, database, wave files)",
+                 [(labels, writer["written"]) for labels, writer in writers]),
+                ("rhasspy_watch_write_seconds_total", "counter", "Total duration of writes",
+                 [(labels, writer["latencyAverage"] * writer["written"]) for labels, writer in writers]),
+                ("rhasspy_watch_write_seconds_max", "gauge", "Max duration of a write",
+                 [(labels, writer["latencyMax"]) for labels, writer in writers])]
  
 
 
-    def translate_message(self,payload, topic, strLogTime, outputFormat):
+    def instrument(self, profiler):
+        """Measure the hot paths with timers of profiler (class:profiler.Profiler).
+        Wrapped methods replace the methods of this object (and the
+        callbacks of paho MQTT client). """
+
+        self.on_msg         = profiler.wrap("on_msg", self.on_msg)
+        self.on_audio       = profiler.wrap("on_audio", self.on_audio)
+        self.get_humanText  = profiler.wrap("get_humanText", self.get_humanText)
+        self.search_message = profiler.wrap("search_message", self.search_message)
+        self.__saveJson     = profiler.wrap("saveJson", self.__saveJson)
+        self.__saveWave     = profiler.wrap("saveWave", self.__saveWave)
+
+        for broker in self.brokers:
+            broker.client.on_message = self.on_msg
+            broker.client.message_callback_add("hermes/audioServer/#",self.on_audio)
+
+
+
+    def translate_message(self,payload, topic, strLogTime, outputFormat, broker=None):
         """ 2 possibilities (actually) for output text
             - In human readable text
             - In json text format with dump of payload
 
             This method returns text in desired format
+            (with the name of the broker, if any)
         """
 
         self.logger.debug('enter in translate_message method.')
 
+        if broker:
+            strLogTime = "{0}] [{1}".format(strLogTime, broker)
+
         if (outputFormat == "raw"):
             text = "{0}".format(payload)
             logText = "[{0}] {1} - {2}".format(strLogTime,topic, text)
@@ -154,6 +392,17 @@ class RhasspyMQTTClient:
         
 
 
+    def translate_wav(self, filename, siteId, flux, strLogTime, stats=None):
+        """ Text displayed for a saved wave file (with its signal
+            statistics, if they are known) """
+
+        text = "[Audio] {0} wav file saved for site {1}. name = {2}".format(flux, siteId, filename)
+        if stats is not None:
+            text += humantext.WITH_STATS + format_stats(stats)
+        return "[{0}] {1}".format(strLogTime,text)
+
+
+
     def show_message(self,text, outputFile, noStandardOut):
         """ this methods is used to manage the MQTT message display
             - noStandardOut : If true, nothing write to stdout
@@ -163,12 +412,25 @@ class RhasspyMQTTClient:
         self.logger.debug('enter in show_message method.')
 
         if not noStandardOut:
-            print(text)
+            self.__output("").write(text)
         
         if outputFile != "":
-            with codecs.open(outputFile, 'a', encoding='utf8') as f:
-                f.write(text+"\n")
-                f.close()
+            self.__output(outputFile).write(text)
+
+
+
+    def __output(self, outputFile):
+        """Return the buffered output of the file ("" for stdout) """
+
+        output = self.__outputs.get(outputFile)
+        if output is None:
+            ## Wave files are shown from the writer thread
+            with self.__outputsLock:
+                output = self.__outputs.get(outputFile)
+                if output is None:
+                    output = OutputSink(outputFile, logger=self.logger, **self.__outputOptions._asdict())
+                    self.__outputs[outputFile] = output
+        return output
 
 
 
@@ -179,224 +441,83 @@ class RhasspyMQTTClient:
         """
 
         self.logger.debug('enter in get_humanText method.')
-        self.logger.debug('Topic : {0}'.format(topic))
-
-
-        ########################
-        #       HOTWORD        #
-        ########################
-        if "hermes/hotword/toggleOn" in topic:
-            text = colored("[hotword]",'magenta') + \
-                " was asked to toggle itself 'on' on site {0}"\
-                .format (colored(payload['siteId'],'white',attrs=['bold']))
-
-        elif "hermes/hotword/toggleOff" in topic:
-            text = colored("[hotword]",'magenta') + \
-                " was asked to toggle itself 'off' on site {0}"\
-                .format (colored(payload['siteId'],'white',attrs=['bold']))
-
-        elif ("hermes/hotword/" in topic) and ("/detected" in topic):
-            text = colored("[hotword]",'yellow') + \
-                " detected on site {0}, for model {1}"\
-                .format(colored(payload['siteId'],'white',attrs=['bold']),
-                        payload['modelId'])  
-
-
-        ########################
-        #         ASR          #
-        ########################
-        elif "hermes/asr/stopListening" in topic:
-            text = colored("[Asr]",'magenta') + \
-                " was asked to stop listening on site {0}"\
-                .format (colored(payload['siteId'],'white',attrs=['bold']))
-            
-        elif ("hermes/asr/startListening" in topic):
-            text = colored("[Asr]",'magenta') + \
-                " was asked to listen on site {0}"\
-                .format (colored(payload['siteId'],'white',attrs=['bold']))
-
-        elif ("hermes/asr/textCaptured" in topic):
-            text = colored("[Asr]",'yellow') + \
-                " captured text '{0}' in {1}s on site {2}"\
-                .format(colored(payload['text'],'green',attrs=['bold']),
-                        payload['seconds'],
-                        colored(payload['siteId'],'white',attrs=['bold']))
-
-        elif "hermes/asr/toggleOn" in topic:
-            text = colored("[Asr]",'magenta') + \
-                " was asked to toggle itself 'on' on site {0}"\
-                .format (colored(payload['siteId'],'white',attrs=['bold']))
-
-        elif "hermes/asr/toggleOff" in topic:
-            text = colored("[Asr]",'magenta') + \
-                " was asked to toggle itself 'off' on site {0}"\
-                .format (colored(payload['siteId'],'white',attrs=['bold']))
-
-
-        ########################
-        #   DIALOGUE MANAGER   #
-        ########################
-        elif ("hermes/dialogueManager/sessionStarted" in topic):
-            text = colored("[Dialogue]",'yellow') \
-                + " session with id {0} was started on site {1}."\
-                .format(payload['sessionId'],
-                        colored(payload['siteId'],'white',attrs=['bold']))
-
-        elif ("hermes/dialogueManager/sessionEnded" in topic):
-            text = colored("[Dialogue]",'yellow') + \
-                " session with id {0} was ended on site {1}. Reason: {2}"\
-                .format(payload['sessionId'],
-                        colored(payload['siteId'],'white',attrs=['bold']),
-                        payload['termination']['reason'])
-            if 'customData' in payload.keys():
-                if payload['customData'] is not None:
-                    text = text + "\n           with customData : "
-                    text = text + "\n               {0} "\
-                        .format(colored(payload['customData'],'cyan', attrs=['bold']))    
-
-        elif ("hermes/dialogueManager/endSession" in topic):
-            text = colored("[Dialogue]",'magenta') + \
-                " was ask to end session with id {0} by saying '{1}'"\
-                .format(payload['sessionId'],
-                        (payload['text']))
-
-        elif ("hermes/dialogueManager/continueSession" in topic):
-            text = colored("[Dialogue]",'magenta') + \
-                " was ask to continue session with id {0} by saying '{1}'"\
-                .format(payload['sessionId'],
-                        (payload['text']))
-            if 'customData' in payload.keys():
-                if payload['customData'] is not None:
-                    text = text + "\n           with customData : "
-                    text = text + "\n               {0}"\
-                            .format(colored(payload['customData'],'cyan', attrs=['bold']))    
-
-        elif ("hermes/dialogueManager/intentNotRecognized" in topic):
-            text = colored("[Dialogue]",'red') + \
-                " Intent NOT recognized for session with id {0} by saying '{1}'"\
-                .format(payload['sessionId'],
-                        (payload['input']))
-            if 'customData' in payload.keys():
-                if payload['customData'] is not None:
-                        text = text + "\n           with customData : "
-                        text = text + "\n               {0}"\
-                                .format(colored(payload['customData'],'cyan', attrs=['bold']))    
-
-
-        ########################
-        #         NLU          #
-        ########################
-        elif ("hermes/nlu/query" in topic):
-            text = colored("[Nlu]",'magenta') + \
-                " was asked to parse input '{0}'"\
-                .format(payload['input'])
-
-        elif ("hermes/nlu/intentNotRecognized" in topic):
-            text = colored("[Nlu]",'yellow') + \
-                " Intent not recognized for {0}"\
-                .format(colored(payload['input'],'red', attrs=['bold']))
-
-        elif ("hermes/nlu/intentParsed" in topic):
-            text = colored("[Nlu]",'yellow') + \
-                " Detected intent {0} with confidence score {1} for input '{2}'"\
-                .format(colored(payload["intent"]["intentName"],'green', attrs=['bold']),
-                        payload["intent"]["confidenceScore"],
-                        payload['input'])
-
-
-        ########################
-        #       INTENT         #
-        ########################
-        elif ("hermes/intent/" in topic):
-
-            text = colored("[Nlu]",'yellow') + \
-                " Intent {0} with confidence score {1} on site {2} "\
-                .format(colored(payload["intent"]["intentName"],'green', attrs=['bold']),
-                        payload["intent"]["confidenceScore"],
-                        colored(payload['siteId'],'white',attrs=['bold']))
-
-            """
-            In snips, in slot, the word is "confidenceScore"
-            In rhasspy, in slot, the word is "confidence"
-
-            """        
-            if len(payload['slots']) > 0:
-
-                text = text + "\n           with slots : "
-                for slot in payload['slots']:
-
-                    confidence = "N/A"
-                    if "confidenceScore" in slot.keys():
-                        confidence = slot['confidenceScore']
-                    else:
-                        confidence = slot['confidence']
-
-                    text = text + "\n               {0} => {1} (confidenceScore={2})"\
-                        .format(colored(slot['slotName'],'cyan', attrs=['bold']),
-                                slot['value']['value'],
-                                confidence)    
-
-            if 'customData' in payload.keys():
-                if payload['customData'] is not None:
-                    text = text + "\n           with customData : "
-                    text = text + "\n               {0} "\
-                        .format(colored(payload['customData'],'cyan', attrs=['bold']))    
-
-
-        ########################
-        #         TTS          #
-        ########################
-        elif ("hermes/tts/say" == topic):
-            text = colored("[Tts]",'yellow') + \
-                " was asked to say '{0}' in {1} on site {2}".\
-                format(colored(payload['text'],'green', attrs=['bold']),
-                    payload['lang'],
-                    colored(payload['siteId'],'white',attrs=['bold']))
-        
-        elif ("hermes/tts/sayFinished" in topic):
-            text = colored("[Tts]",'cyan') + \
-                " finished speaking with id '{0}'"\
-                .format(payload['sessionId'])
+        self.logger.debug('Topic : %s', topic)
 
+        ## The renderer of each topic is defined in humantext module
+        renderer = humantext.DISPATCHER.resolve(topic)
 
-        ########################
-        #    AUDIO SERVER      #
-        ########################
-        elif ("hermes/audioServer" in topic):
-            text = colored("[audioServer]",'cyan') + \
-                " audio on topic {0}".format(topic)
+        if renderer is None:
+            self.logger.warning('Unknow topic : %s', topic)
+            renderer = humantext.unknown
 
-
-        ########################
-        #       UNKNOWN        #
-        ########################
-        else:
-            self.logger.warning('Unknow topic : {0}'.format(topic))
-            text = colored("[UNKNOWN]",'red') + \
-                " message on topic {0}".format(topic)
-        
-        return text 
+        return renderer(payload, topic)
 
 
     
-    def search_message(self, datestart,datestop,siteId,jsonfolder,searchoutputFormat,outputFile):
-        """ This method allow to query all MQTT messages saved as file """
+    def __legacy_files(self, datestart, datestop, jsonfolder):
+        """ Generator of (datetime, extension, filename) for each json and wav
+            file saved between datestart and datestop, sorted by datetime
+        """
 
-        self.logger.debug('enter in search_message method.')
+        ## Get list of all files sorted by name (so by datetime)
+        allFiles = self.__listings.get(jsonfolder)
+        if allFiles is None:
+            allFiles = self.__listings[jsonfolder] = sorted(os.listdir(jsonfolder))
 
-        ## Get list of all json files sorted by name (so by datetime)
-        allJsonFiles = os.listdir(jsonfolder)
-        allJsonFiles.sort()
-        
-        ## For each file, check if it's between the start and stop search date
-        for filename in allJsonFiles:
-            
-            ## Get extension and name of file
-            filenameWithoutExt, extension = (os.path.basename(filename)).split(".")
+        ## Names start with the datetime in a fixed width format, so the
+        ## comparison of strings is the comparison of datetimes
+        strStart = datestart.strftime(self.__dateFileFormat)
+        strStop  = datestop.strftime(self.__dateFileFormat)
+
+        for filename in allFiles[bisect_left(allFiles, strStart):]:
+
+            ## Get extension and name of file (wave files may be compressed)
+            filenameWithoutExt, extension = os.path.splitext(filename)
+            if (extension == COMPRESSED_EXT) and filenameWithoutExt.endswith(WAV_EXT):
+                filenameWithoutExt, extension = os.path.splitext(filenameWithoutExt)
+            strDate = filenameWithoutExt.split("_")[0]
+
+            ## Files are sorted, so no need to go further
+            if strDate > strStop:
+                break
+
+            ## Journal segments are read by the journal itself
+            if extension not in (".json", ".wav"):
+                continue
 
             self.logger.debug('filename %s - ext %s',filenameWithoutExt,extension)
 
-            if extension == "wav":
+            ## As script knows the format, it can retrieve the date as datetime type
+            yield (datetime.strptime(strDate,self.__dateFileFormat), extension, filename)
+
+
+
+    def __archive(self, datestart, datestop, jsonfolder, siteId=None, topic=None, sessionId=None):
+        """ Generator of (datetime, extension, item) for messages and wave files
+            saved between datestart and datestop, sorted by datetime and filtered.
+            item is a class:message.Message, or (filename, siteId, flux, stats) for a wave file
+            (stats : dict of statistics of the wave file saved in the index, or None).
+        """
+
+        ## Statistics of the wave files of the date range, read at once
+        wavStats = TextIndex(jsonfolder, self.logger).wav_stats(datestart, datestop)
+
+        journal = Journal(jsonfolder, logger=self.logger)
+        records = ((myDate, SEGMENT_EXT, record)
+                   for myDate, *record in journal.read(datestart, datestop))
+
+        database = SqliteStore(jsonfolder, logger=self.logger)
+        rows = ((myDate, ".db", row)
+                for myDate, *row in database.read(datestart, datestop, siteId, topic, sessionId))
+
+        ## Files, journal records and database rows are all sorted by datetime,
+        ## they are merged to keep the order of messages
+        for myDate, extension, item in heapq.merge(self.__legacy_files(datestart, datestop, jsonfolder),
+                                                   records,
+                                                   rows,
+                                                   key=lambda record: record[0]):
+
+            if extension == ".wav":
                 """ If extension is .wav, so in name, there are :
                     myDate = date time when the wav was saved
                     siteId = The site of Rhasspy/snips
@@ -405,94 +526,306 @@ class RhasspyMQTTClient:
                         output : record from the siteId
 
                     Ex wave filename : 20200429195055646804_bureau_play.wav
+                    (siteId is <site>@<broker> when several brokers are watched,
+                    the file is a .wav.gz when it is compressed)
                 """
+                filename = item
 
                 ## Get date, siteId, flux
-                strDate, siteId, flux = filenameWithoutExt.split("_")
-                myDate = datetime.strptime(strDate,self.__dateFileFormat)
+                strDate, wavSiteId, flux = wav_name(filename)
+                self.logger.debug('WAV : strDate : %s - siteId : %s - flux : %s',strDate,wavSiteId, flux)
 
-                
-                ## We check if file date is between start and stop search date 
-                if datestart <= myDate <= datestop:               
-                    self.logger.debug('WAV : strDate : %s - siteId : %s - flux : %s',strDate,siteId, flux)
+                ## Wave files have no topic and no session
+                if topic or sessionId or (siteId and siteId != wavSiteId.split("@")[0]):
+                    continue
 
-                    ## If yes, call the on_saved_wav
-                    self.on_saved_wav (filename, siteId, flux, myDate)
-                
-            elif extension == "json":                
-                ## Get date
-                strDate = filenameWithoutExt.split("_")[0]
-                myDate = datetime.strptime(strDate,self.__dateFileFormat)
+                yield (myDate, extension, (filename, wavSiteId, flux, wavStats.get(filename)))
+                continue
 
-                ## As script knows the format, it can retrieve the date as datetime type
-                myDate = datetime.strptime(filenameWithoutExt,self.__dateFileFormat)
-                
-                ## We check if file date is between start and stop date search
-                if datestart <= myDate <= datestop:
-                    
-                    ## The file is concerned by search. Script open it and load json
-                    with open(os.path.join (jsonfolder,filename)) as json_file:
-                        payload = json.load(json_file)
+            if extension == ".json":
+                ## The file is concerned by search. Script open it and load json
+                with open(os.path.join (jsonfolder,item), 'rb') as json_file:
+                    payload = loads(json_file.read())
+
+                ## Remove the 'topic' json element imported when json file was saved
+                ## the 'topic' element is added to file only to retieve information
+                msgTopic = payload.pop('topic', None)
+                message = Message(msgTopic, payload, None, myDate)
+            else:
+                ## Record from the journal or the database : topic, raw payload
+                ## and broker (topic is checked before decoding the payload)
+                if topic and not topic_matches_sub(topic, item[0]):
+                    continue
+                message = Message.decode(item[0], item[1], myDate, item[2])
+
+            if not self.__accept(message, siteId, topic, sessionId):
+                continue
+
+            yield (myDate, extension, message)
+
+
+
+    def search_message(self, datestart,datestop,siteId,jsonfolder,searchoutputFormat,outputFile,topic=None,sessionId=None):
+        """ This method allow to query all MQTT messages saved in journal
+            segments, in SQLite database, and in json/wav files of previous versions.
+            Messages can be filtered by siteId, topic (with MQTT wildcards)
+            and sessionId. Filters are done by the database for SQLite.
+        """
+
+        self.logger.debug('enter in search_message method.')
+
+        for myDate, extension, item in self.__archive(datestart, datestop, jsonfolder, siteId, topic, sessionId):
+
+            if extension == ".wav":
+                ## call the on_saved_wav
+                filename, wavSiteId, flux, stats = item
+                self.on_saved_wav (filename, wavSiteId, flux, myDate, stats)
+                continue
+
+            ## call on_message method and pass the message
+            self.on_message(None, None, item, myDate)
+
+
+
+    def render_archive(self, datestart, datestop, jsonfolder, outputFormat, timeFormat, siteId=None, topic=None, sessionId=None):
+        """ Generator of the texts displayed by a search : messages translated
+            in outputFormat and saved wave files, with datetimes in timeFormat.
+            Used by the workers of parallel search.
+        """
+
+        for myDate, extension, item in self.__archive(datestart, datestop, jsonfolder, siteId, topic, sessionId):
+            strLogTime = myDate.strftime(timeFormat)
+            if extension == ".wav":
+                filename, wavSiteId, flux, stats = item
+                yield self.translate_wav(filename, wavSiteId, flux, strLogTime, stats)
+            else:
+                yield self.translate_message(item.payload, item.topic, strLogTime, outputFormat, item.broker)
+
+
+
+    def query_message(self, datestart, datestop, query, jsonfolder, siteId=None, topic=None, sessionId=None):
+        """ Show the messages matching query (see class:textindex.TextIndex)
+            saved between datestart and datestop, and their record wave file.
+            Only the matching messages are read from segments or database.
+            Messages can also be filtered by siteId, topic and sessionId.
+            Return the count of matching messages.
+        """
+
+        self.logger.debug('enter in query_message method.')
+
+        journal = Journal(jsonfolder, logger=self.logger)
+        database = SqliteStore(jsonfolder, logger=self.logger)
+        shownWavs = set()
+        count = 0
+
+        for myDate, msgTopic, location, offset, wav in TextIndex(jsonfolder, self.logger).query(datestart, datestop, query):
+
+            ## Segments may have been deleted by the retention task
+            try:
+                if location.endswith(SEGMENT_EXT) or location.endswith(COMPRESSED_EXT):
+                    record = journal.read_record(location, offset)
+                else:
+                    record = database.read_record(myDate, msgTopic)
+            except FileNotFoundError:
+                record = None
+            if record is None:
+                self.logger.debug("Indexed message not found : %s %s", location, offset)
+                continue
+
+            message = Message.decode(record[1], record[2], record[0], record[3])
+            if not self.__accept(message, siteId, topic, sessionId):
+                continue
+
+            ## The wave file of the utterance is shown once, before the
+            ## first message linked to it
+            if (wav is not None) and (wav not in shownWavs) and os.path.exists(os.path.join(jsonfolder, wav)):
+                shownWavs.add(wav)
+                strDate, wavSiteId, flux = wav_name(wav)
+                self.on_saved_wav(wav, wavSiteId, flux, datetime.strptime(strDate, self.__dateFileFormat))
+
+            self.on_message(None, None, message, myDate)
+            count += 1
+
+        return count
+
+
+
+    def follow(self, jsonfolder, cursorFile="", pollInterval=0.2, siteId=None, topic=None, sessionId=None):
+        """ Show the messages appended to the journal of jsonfolder by a
+            recording instance (mode mqtt_db), as they are written, without
+            connecting to the MQTT broker. The position in the journal is
+            saved in cursorFile (if not empty), to continue from there.
+            Messages can be filtered by siteId, topic and sessionId.
+        """
+
+        self.logger.debug('enter in follow method.')
+
+        records = Follower(jsonfolder, self.logger, cursorFile, pollInterval).records()
+        try:
+            for myDate, msgTopic, payload, broker in records:
+
+                ## topic is checked before decoding the payload
+                if topic and not topic_matches_sub(topic, msgTopic):
+                    continue
+                try:
+                    message = Message.decode(msgTopic, payload, myDate, broker)
+                except ValueError:
+                    continue
+
+                if self.__accept(message, siteId, topic, sessionId):
+                    self.on_message(None, None, message, myDate)
+        finally:
+            ## The cursor is saved
+            records.close()
+
+
+
+    def __replay_records(self, datestart, datestop, jsonfolder, siteId, topic, sessionId):
+        """ Generator of (datetime, items) for lookahead : a message, or the
+            audio chunks of a wave file """
+
+        for myDate, extension, item in self.__archive(datestart, datestop, jsonfolder, siteId, topic, sessionId):
+
+            if extension == ".wav":
+                filename, wavSiteId, flux, stats = item
+                path = os.path.join(jsonfolder, filename)
+
+                ## Audio of all brokers is sent to the replay broker
+                wavSiteId = wavSiteId.split("@")[0]
+
+                ## Record audio is sent again by chunks, play audio as a whole wave
+                if flux == "record":
+                    yield (myDate, wave_chunks(path, myDate, "hermes/audioServer/{0}/audioFrame".format(wavSiteId)))
+                else:
+                    with open_wav(path) as wav_file:
+                        payload = wav_file.read()
+                    playTopic = "hermes/audioServer/{0}/playBytes/{1}".format(wavSiteId, filename.split(".")[0])
+                    yield (myDate, [(myDate, playTopic, payload, None)])
+                continue
+
+            ## Json files of previous versions have no raw payload
+            raw = item.raw if item.raw is not None else json.dumps(item.payload).encode('utf8')
+            yield (myDate, [(myDate, item.topic, raw, item)])
+
+
+
+    def replay(self, datestart, datestop, jsonfolder, speed=1.0, siteId=None, topic=None, sessionId=None):
+        """ Publish again the messages (and audio of wave files) saved between
+            datestart and datestop to the MQTT broker, with the timing of
+            their datetimes divided by speed (0 = as fast as possible).
+            Archives are read as a stream, so memory does not depend on the
+            date range. Published messages are propagated to on_message.
+            Return the count of published messages.
+        """
+
+        self.logger.debug('enter in replay method.')
+
+        broker = self.brokers[0]
+        self.__configure(self.__mqtt)
+        self.logger.info('Connecting to MQTT broker %s:%s...', str(broker.host), str(broker.port))
+        self.__mqtt.connect(broker.host, broker.port)
+        self.__mqtt.loop_start()
+
+        ## Messages published before the connection would be lost
+        deadline = time.monotonic() + 30
+        while not self.__mqtt.is_connected():
+            if time.monotonic() > deadline:
+                self.__mqtt.loop_stop()
+                raise ConnectionError("No connection to MQTT broker {0}:{1}".format(broker.host, broker.port))
+            time.sleep(0.05)
+
+        pacer = Pacer(speed)
+        count = 0
+        try:
+            for logTime, msgTopic, payload, message in lookahead(self.__replay_records(datestart, datestop, jsonfolder,
+                                                                                       siteId, topic, sessionId)):
+                pacer.wait(logTime)
+                info = self.__mqtt.publish(msgTopic, payload)
+                count += 1
+
+                ## Publications are queued by paho : wait from time to time,
+                ## so the queue does not grow when replaying faster than the network
+                if count % 100 == 0:
+                    info.wait_for_publish()
+
+                if message is not None:
+                    self.on_message(None, None, message, logTime)
+
+            if count > 0:
+                info.wait_for_publish()
+        finally:
+            self.__mqtt.disconnect()
+            self.__mqtt.loop_stop()
 
-                    ## Remove the 'topic' json element imported when json file was saved
-                    ## the 'topic' element is added to file only to retieve information
-                    topic = bytes(payload['topic'],'utf-8')
-                    payload.pop('topic', None)
-                    
-                    ## Create a paho MQTT message 
-                    myMQTTmessage = MQTTMessage(mid=0,topic=topic)
-                    myMQTTmessage.payload = json.dumps(payload).encode('utf-8')
+        return count
 
-                    ## call on_message method and pass the MQTT message
-                    self.on_message(None, None, myMQTTmessage, myDate)
+
+
+    def __accept(self, message, siteId, topic, sessionId):
+        """ Return True if the message matches the search filters """
+
+        if topic and not topic_matches_sub(topic, message.topic):
+            return False
+
+        payload = message.payload
+        if not isinstance(payload, dict):
+            return not (siteId or sessionId)
+        if siteId and payload.get('siteId') != siteId:
+            return False
+        if sessionId and payload.get('sessionId') != sessionId:
+            return False
+        return True
 
 
 
     def on_audio (self, client, userdata, msg):
-        """ Specific method to intercept audio MQTT message and save data
-        in a array of bytearray.
-        The entire array will be dump in a wav file on specific MQTT message """
+        """ Specific method to intercept audio MQTT message and append
+        the audio chunk to the wave file of the site.
+        The wave file is closed on specific MQTT message """
         self.logger.debug('enter in on_audio method. (read audio stream)')
 
-        currentTime = datetime.now()
-       
-        if self.recording: 
-            siteId = ((msg.topic).split("/"))[2]
-            flux = ((msg.topic).split("/"))[3]
+        ## userdata is the broker of the message (None when called directly)
+        counters = userdata.counters if userdata is not None else self.counters
+        brokerName = userdata.name if self.__multiBroker and (userdata is not None) else None
+
+        with self.__dispatchLock:
+            currentTime = datetime.now()
+
+            counters.count(msg.topic, len(msg.payload))
 
-            ## If it's record stream
-            if flux == "audioFrame":
-                if siteId not in self.__audioFrames:
-                    self.__audioFrames[siteId] = []
+            if self.recording: 
+                siteId = ((msg.topic).split("/"))[2]
+                flux = ((msg.topic).split("/"))[3]
+
+                ## Sites can be excluded
+                if (self.subscriptionPlan is not None) and not self.subscriptionPlan.accept_site(siteId):
+                    return
+
+                ## Sites of several brokers may have the same name
+                siteId = site_key(siteId, brokerName)
+
+                ## If it's record stream
+                if flux == "audioFrame":
+                    self.__shards.put(siteId, 'audio', self.__saveWave, siteId,currentTime,msg.payload,'record')
                 
-                ## Add this piece of wave in an array of bytes
-                (self.__audioFrames[siteId]).append(bytearray(msg.payload))
-            
-            ## If it's a play stream
-            if flux == "playBytesStreaming":
-                if siteId not in self.__playBytes:
-                    self.__playBytes[siteId] = []
+                ## If it's a play stream
+                if flux == "playBytesStreaming":
+                    self.__shards.put(siteId, 'audio', self.__saveWave, siteId,currentTime,msg.payload,'play')
                 
-                (self.__playBytes[siteId]).append(bytearray(msg.payload))
-            
-            ## when topic contains "playBytes" or "streamFinished", it means
-            ## play stream has stopped on rhasspy. So the wav file can be saved. 
-            ## Use <IS_LAST_CHUNK> instead ?
-            if (flux == "playBytes") or (flux == "streamFinished"):
-                self.logger.debug("fin streaming on site %s",siteId)
-                if (siteId not in self.__playBytes) or (len(self.__playBytes[siteId]) == 0) :
-                    self.__playBytes[siteId] = []
-                    (self.__playBytes[siteId]).append(bytearray(msg.payload))
-                    
-                count_item = len(self.__playBytes[siteId]) 
-                self.logger.debug("count of item in array %s",str(count_item))
-
-                if len (self.__playBytes[siteId]) > 0:
-                    self.__saveWave(siteId,currentTime,self.__playBytes[siteId],'play')
-                    self.__playBytes[siteId] = []
-
-
-           
+                ## when topic contains "playBytes" or "streamFinished", it means
+                ## play stream has stopped on rhasspy. So the wav file can be closed. 
+                ## Use <IS_LAST_CHUNK> instead ?
+                ## "playBytes" payload is a complete wave, saved if nothing was streamed
+                if flux == "playBytes":
+                    self.logger.debug("fin streaming on site %s",siteId)
+                    self.__shards.put(siteId, 'control', self.__closeWave, siteId,currentTime,'play',msg.payload)
+
+                if flux == "streamFinished":
+                    self.logger.debug("fin streaming on site %s",siteId)
+                    self.__shards.put(siteId, 'control', self.__closeWave, siteId,currentTime,'play')
+
+
+
     def on_msg(self, client, userdata, msg):
         """The on_message callback of paho MQTT client is intercepted by this on_msg method 
         before the propagation of MQTT message.
@@ -500,42 +833,81 @@ class RhasspyMQTTClient:
             - Save payload to json if porperty recording is True
             - Save output wave file when specific message is received
             - Save input wave file when specific message is received
-            - propagate the MQTT message to on_message method of our custom MQTT class
+            - propagate the decoded message (class:message.Message) to on_message
+              method of our custom MQTT class
 
+        Messages of all brokers are processed one at a time, so they are
+        recorded and shown in the order of their datetimes.
         """
         self.logger.debug('enter in on_msg method.')
 
-        currentTime = datetime.now()
+        ## Audio messages are processed by on_audio
+        if "hermes/audioServer/" in msg.topic: 
+            return
 
-        ## If MQTT message has to be saved in file
-        if self.recording: 
-            
-            ## If message does not come from audioServer
-            ## the message is saved as json file
-            if "hermes/audioServer/" not in msg.topic: 
-                payload = json.loads(msg.payload.decode('utf8'))
-                self.__saveJson(payload,msg.topic,currentTime)
-
-            ## If "textCaptured" is in topic, it means ASR stop
-            ## to record from Rhasspy. So the wav file can be saved.
-            if "hermes/asr/textCaptured" in msg.topic:
-                self.__saveWave(payload['siteId'],currentTime,self.__audioFrames[payload['siteId']],'record')
-                self.__audioFrames[payload['siteId']] = []
+        ## userdata is the broker of the message (None when called directly)
+        counters = userdata.counters if userdata is not None else self.counters
+        brokerName = userdata.name if self.__multiBroker and (userdata is not None) else None
+
+        with self.__dispatchLock:
+            currentTime = datetime.now()
+
+            counters.count(msg.topic, len(msg.payload))
+
+            ## The payload is decoded once, the message is shared
+            ## by recording and display
+            try:
+                message = Message.decode(msg.topic, msg.payload, currentTime, brokerName)
+            except ValueError:
+                counters.increment('parseErrors')
+                self.logger.warning("ERROR : Invalid json payload on topic %s", msg.topic)
+                return
+
+            ## Valid json payloads are not always objects (ex: "on")
+            payloadSiteId = message.payload.get('siteId') if isinstance(message.payload, dict) else None
+
+            ## Filters that the broker can't apply
+            plan = self.subscriptionPlan
+            if plan is not None:
+                if not (plan.accept_topic(msg.topic) and plan.accept_site(payloadSiteId)):
+                    return
+
+            ## If MQTT message has to be saved in file
+            if self.recording: 
+                
+                ## The message is appended to the journal
+                self.__writer.put('json', self.__saveJson, message)
+
+                ## On hotword or when ASR starts to listen, the record
+                ## of audio starts (with the last seconds before)
+                if ((("hermes/hotword/" in msg.topic) and ("/detected" in msg.topic)) \
+                        or ("hermes/asr/startListening" in msg.topic)) and payloadSiteId:
+                    siteId = site_key(payloadSiteId, brokerName)
+                    self.__shards.put(siteId, 'control', self.__startWave, siteId,currentTime)
+
+                ## If "textCaptured" is in topic, it means ASR stop
+                ## to record from Rhasspy. So the wav file can be closed.
+                if ("hermes/asr/textCaptured" in msg.topic) and payloadSiteId:
+                    siteId = site_key(payloadSiteId, brokerName)
+                    self.__shards.put(siteId, 'control', self.__closeWave, siteId,currentTime,'record')
+                
             
-        
-        ## Propagate the message MQTT
-        self.on_message(client, userdata, msg,currentTime)
+            ## Propagate the message
+            self.on_message(client, userdata, message,currentTime)
 
 
     
     ## Not good enough in python to avoid this :/
     def on_cnx (self, client, userdata, flags, result_code):
+        counters = userdata.counters if userdata is not None else self.counters
+        counters.increment('connects')
         self.on_connect(client=client, userdata=userdata, flags=flags, result_code=result_code)
 
 
     def subscribe (self,topic):
-        """Method used to subscribe to private MQTT object topic """
-        self.__mqtt.subscribe(topic)
+        """Method used to subscribe to private MQTT object topic (on each broker) """
+        for broker in self.brokers:
+            broker.client.subscribe(topic)
 
 
     def on_message(self,client, userdata, msg, logTime):
@@ -546,6 +918,6 @@ class RhasspyMQTTClient:
         """Event method """
  
 
-    def on_saved_wav (self,filename ,siteId, flux, logTime):
+    def on_saved_wav (self,filename ,siteId, flux, logTime, stats=None):
         """Event method """
   
\ No newline at end of file
@@ -0,0 +1,112 @@
+# coding: utf8
+
+import io
+import struct
+import wave
+from collections import namedtuple
+
+
+## Same fields as the params of the wave module (so usable by setparams)
+WaveParams = namedtuple('WaveParams', 'nchannels sampwidth framerate nframes comptype compname')
+
+WAVE_FORMAT_PCM = 0x0001
+
+## fmt chunk : format, channels, rate, byte rate, block align, bits per sample
+FMT_CHUNK = struct.Struct('<HHIIHH')
+CHUNK_HEADER = struct.Struct('<4sI')
+
+
+def parse_header(buf):
+    """Parse the RIFF header of a PCM wave in buf.
+    Return (params, offset of data, length of data),
+    or None if the header is not a simple PCM wave header.
+    """
+
+    view = memoryview(buf)
+    if len(view) < 12 or view[0:4] != b'RIFF' or view[8:12] != b'WAVE':
+        return None
+
+    params = None
+    offset = 12
+    while offset + CHUNK_HEADER.size <= len(view):
+        chunkId, chunkSize = CHUNK_HEADER.unpack_from(view, offset)
+        offset += CHUNK_HEADER.size
+
+        if chunkId == b'fmt ':
+            if chunkSize < FMT_CHUNK.size:
+                return None
+            formatTag, nchannels, framerate, byteRate, blockAlign, bitsPerSample = FMT_CHUNK.unpack_from(view, offset)
+            if formatTag != WAVE_FORMAT_PCM or nchannels == 0 or bitsPerSample == 0:
+                return None
+            params = WaveParams(nchannels, (bitsPerSample + 7) // 8, framerate, 0, 'NONE', 'not compressed')
+
+        elif chunkId == b'data':
+            if params is None:
+                return None
+            return (params, offset, chunkSize)
+
+        ## Chunks are word aligned
+        offset += chunkSize + (chunkSize & 1)
+
+    return None
+
+
+
+class ChunkParser:
+
+    def __init__(self):
+        """Extract PCM frames of the wave chunks of a stream.
+
+        The header is fully parsed on the first chunk only. For next
+        chunks, the bytes from 'fmt ' to 'data' are compared with the
+        first chunk, and data is sliced (with a memoryview, no copy).
+        Unusual headers are read with the wave module.
+        """
+        self.params = None
+        self.__offset = 0
+        self.__format = None
+        self.__frameSize = 0
+
+
+
+    def __parse(self, buf):
+        """Parse a new header and keep it for next chunks """
+
+        header = parse_header(buf)
+        if header is None:
+            self.params = None
+            self.__format = None
+            return False
+
+        self.params, self.__offset, length = header
+        self.__format = bytes(buf[12:self.__offset - 4])
+        self.__frameSize = self.params.nchannels * self.params.sampwidth
+        return True
+
+
+
+    def pcm(self, buf):
+        """Return (params, pcm frames) of a wave chunk """
+
+        view = memoryview(buf)
+
+        if (self.__format is None) \
+                or (view[12:self.__offset - 4] != self.__format) \
+                or (view[0:4] != b'RIFF'):
+            if not self.__parse(view):
+                return self.__pcm_wave(buf)
+
+        length = struct.unpack_from('<I', view, self.__offset - 4)[0]
+        length = min(length, len(view) - self.__offset)
+        length -= length % self.__frameSize
+
+        return (self.params, view[self.__offset:self.__offset + length])
+
+
+
+    def __pcm_wave(self, buf):
+        """Return (params, pcm frames) of a wave chunk, read by the wave module """
+
+        with io.BytesIO(buf) as wav_buffer:
+            with wave.open(wav_buffer,'rb') as w:
+                return (WaveParams(*w.getparams()), w.readframes(w.getnframes()))
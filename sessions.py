@@ -0,0 +1,213 @@
+# coding: utf8
+
+from datetime import timedelta
+from termcolor import colored
+from humantext import TopicDispatcher, site
+
+
+## Stages of a dialogue, in their usual order
+STAGES = TopicDispatcher()
+STAGES.add("hermes/hotword/+/detected",             "hotword")
+STAGES.add("hermes/dialogueManager/sessionStarted", "sessionStarted")
+STAGES.add("hermes/asr/startListening",             "startListening")
+STAGES.add("hermes/asr/textCaptured",               "textCaptured")
+STAGES.add("hermes/nlu/intentParsed",               "intentParsed")
+STAGES.add("hermes/nlu/intentNotRecognized",        "intentNotRecognized")
+STAGES.add("hermes/dialogueManager/intentNotRecognized", "intentNotRecognized")
+STAGES.add("hermes/intent/#",                       "intent")
+STAGES.add("hermes/tts/say",                        "say")
+STAGES.add("hermes/tts/sayFinished",                "sayFinished")
+STAGES.add("hermes/dialogueManager/sessionEnded",   "sessionEnded")
+
+SESSION = colored("[Session]",'blue')
+
+
+def milliseconds(delta):
+    return int(delta / timedelta(milliseconds=1))
+
+
+
+class Dialogue:
+
+    def __init__(self, sessionId, siteId):
+        """Timeline of a dialogue session : first datetime of each stage """
+        self.sessionId = sessionId
+        self.siteId    = siteId
+        self.stages    = []
+        self.intentName = None
+
+
+    def add(self, stage, logTime):
+        """Add a stage (only its first occurrence is kept) """
+        for name, time in self.stages:
+            if name == stage:
+                return
+        self.stages.append((stage, logTime))
+
+
+    @property
+    def start(self):
+        return self.stages[0][1]
+
+
+    @property
+    def end(self):
+        return self.stages[-1][1]
+
+
+    @property
+    def ended(self):
+        """True if the session was ended (not expired) """
+        return any(name == "sessionEnded" for name, time in self.stages)
+
+
+    def latencies(self):
+        """Return [(stage, ms since the previous stage)] """
+        result = []
+        previous = self.start
+        for name, time in self.stages:
+            result.append((name, milliseconds(time - previous)))
+            previous = time
+        return result
+
+
+    def format(self):
+        """Timeline of the dialogue as text """
+
+        text = SESSION + " {0} on site {1}{2} : {3} ms"\
+            .format(self.sessionId,
+                    site(self.siteId or "?"),
+                    " for intent " + colored(self.intentName,'green', attrs=['bold']) if self.intentName else "",
+                    milliseconds(self.end - self.start))
+
+        for name, latency in self.latencies():
+            text = text + "\n           {0:<20} +{1:>6} ms".format(name, latency)
+
+        return text
+
+
+
+class SessionCorrelator:
+
+    def __init__(self, timeout=300, preSessionTimeout=30):
+        """Group messages in dialogues and compute the latency of each stage.
+        Args:
+            timeout (int)           : A dialogue not ended after timeout
+                                      seconds is returned as it is.
+            preSessionTimeout (int) : Hotword detections older than this
+                                      are not linked to a new session.
+
+        Messages with a sessionId are grouped by sessionId. Hotword
+        detections (before the session exists) are grouped by siteId and
+        linked to the next session of the site. Messages with a siteId
+        but no sessionId go to the current session of the site.
+        """
+        self.timeout = timedelta(seconds=timeout)
+        self.preSessionTimeout = timedelta(seconds=preSessionTimeout)
+
+        ## Key is sessionId / Value is Dialogue
+        self.__dialogues = {}
+        ## Key is siteId / Value is the current sessionId
+        self.__sites = {}
+        ## Key is siteId / Value is [(stage, datetime)] before a session
+        self.__pending = {}
+
+        self.__lastExpire = None
+
+
+
+    def __dialogue(self, sessionId, siteId):
+        """Return the dialogue of sessionId, created if needed """
+
+        dialogue = self.__dialogues.get(sessionId)
+        if dialogue is None:
+            dialogue = self.__dialogues[sessionId] = Dialogue(sessionId, siteId)
+
+            ## Stages before the session on this site
+            for stage, logTime in self.__pending.pop(siteId, []):
+                dialogue.add(stage, logTime)
+
+        if siteId is not None:
+            dialogue.siteId = siteId
+            self.__sites[siteId] = sessionId
+
+        return dialogue
+
+
+
+    def feed(self, message):
+        """Add a message (class:message.Message) to its dialogue.
+        Return the list of dialogues finished (ended or expired).
+        """
+
+        finished = self.expire(message.time)
+
+        stage = STAGES.resolve(message.topic)
+        payload = message.payload
+        if stage is None or not isinstance(payload, dict):
+            return finished
+
+        siteId = payload.get('siteId')
+        sessionId = payload.get('sessionId') or self.__sites.get(siteId)
+
+        ## Hotword always comes before its session
+        if stage == "hotword":
+            sessionId = None
+
+        if not sessionId:
+            if siteId is not None:
+                pending = self.__pending.setdefault(siteId, [])
+                ## A new hotword restarts the pre-session
+                if stage == "hotword":
+                    pending.clear()
+                pending.append((stage, message.time))
+            return finished
+
+        dialogue = self.__dialogue(sessionId, siteId)
+        dialogue.add(stage, message.time)
+
+        if (stage == "intent") and isinstance(payload.get('intent'), dict):
+            dialogue.intentName = payload['intent'].get('intentName')
+
+        if stage == "sessionEnded":
+            finished.append(self.__finish(sessionId))
+
+        return finished
+
+
+
+    def __finish(self, sessionId):
+        """Remove and return the dialogue of sessionId """
+
+        dialogue = self.__dialogues.pop(sessionId)
+        if self.__sites.get(dialogue.siteId) == sessionId:
+            del self.__sites[dialogue.siteId]
+        return dialogue
+
+
+
+    def expire(self, now):
+        """Return dialogues without end since timeout, forget old hotwords.
+        Checked once per second at most. """
+
+        if (self.__lastExpire is not None) and (now - self.__lastExpire < timedelta(seconds=1)):
+            return []
+        self.__lastExpire = now
+
+        expired = [self.__finish(sessionId)
+                   for sessionId, dialogue in list(self.__dialogues.items())
+                   if now - dialogue.end >= self.timeout]
+
+        for siteId, pending in list(self.__pending.items()):
+            if now - pending[-1][1] >= self.preSessionTimeout:
+                del self.__pending[siteId]
+
+        return expired
+
+
+
+    def close(self):
+        """Return all dialogues not finished yet (end of a search) """
+
+        self.__pending = {}
+        return [self.__finish(sessionId) for sessionId in list(self.__dialogues)]
@@ -0,0 +1,118 @@
+# coding: utf8
+
+import zlib
+from collections import namedtuple
+from writer import BackgroundWriter
+from wavsink import WaveSinks
+
+
+## Options of the wave files (same names as the args of AudioShards)
+AudioOptions = namedtuple('AudioOptions', 'idleTimeout preroll captureTimeout compress', defaults=(30, 1.0, 30, False))
+
+
+class AudioShards:
+
+    def __init__(self, folder, logger, count=1, maxsize=10000, policy='block',
+                 idleTimeout=30, preroll=1.0, captureTimeout=30, trim=None, compress=False):
+        """Audio writes (wave files) hashed by site on a pool of writer threads.
+        Args:
+            folder (str)      : Folder where wave files are saved.
+            logger (class:logging.Logger): Logger object for logging messages.
+            count (int)       : Count of audio writer threads.
+            maxsize (int)     : Max count of writes waiting for each thread.
+            policy (str)      : What to do when a queue is full (see class:writer.BackgroundWriter).
+            idleTimeout (int) : A wave file without new audio since idleTimeout seconds is closed.
+            preroll (float)   : Seconds of audio saved before the start of a capture.
+            captureTimeout (int): Max duration (seconds) of a record wave file.
+            trim (tuple)      : Silence trim of record files (see class:silencegate.TrimOptions), None = no trim.
+            compress (bool)   : Wave files are compressed with gzip when they are closed.
+
+        A site is always written by the same thread, so the audio (and the
+        start and stop of captures) of each site keeps its order, while
+        sites of different threads are written concurrently : a long play
+        stream of a site does not delay the other sites.
+        Each thread has its own wave sinks, only used from this thread.
+        """
+        self.logger = logger
+
+        self.writers = []
+        self.sinks   = []
+        for i in range(max(count, 1)):
+            writer = BackgroundWriter(maxsize, policy, logger, name="rhasspy-watch-audio-{0}".format(i))
+            sinks = WaveSinks(folder, logger, idleTimeout, preroll, captureTimeout, trim, compress)
+            sinks.on_saved_wav = self.__on_sink_saved
+            writer.on_tick = sinks.close_idle
+            self.writers.append(writer)
+            self.sinks.append(sinks)
+
+
+
+    def index(self, siteId):
+        """Index of the thread of siteId (stable from one run to another) """
+        return zlib.crc32(siteId.encode('utf8')) % len(self.writers)
+
+
+
+    def put(self, siteId, kind, function, *args):
+        """Enqueue a write of siteId to its thread """
+        self.writers[self.index(siteId)].put(kind, function, *args)
+
+
+
+    def sinks_of(self, siteId):
+        """Return the class:wavsink.WaveSinks of siteId. Only used from the thread of siteId """
+        return self.sinks[self.index(siteId)]
+
+
+
+    def start(self):
+        """Start the threads """
+
+        for writer in self.writers:
+            writer.start()
+
+
+
+    def stop(self):
+        """Write all queued audio, stop the threads and close all wave files """
+
+        for writer, sinks in zip(self.writers, self.sinks):
+            writer.stop()
+            sinks.close_all()
+
+
+
+    def stats(self):
+        """Return the counters of each thread (see class:writer.BackgroundWriter) """
+        return [writer.stats() for writer in self.writers]
+
+
+
+    def sizes(self):
+        """Return the bytes written in open wave files, by (siteId, flux) """
+
+        sizes = {}
+        for sinks in self.sinks:
+            sizes.update(sinks.sizes())
+        return sizes
+
+
+
+    def buffered(self):
+        """Return the bytes kept in pre-roll buffers, by siteId """
+
+        buffered = {}
+        for sinks in self.sinks:
+            buffered.update(sinks.buffered())
+        return buffered
+
+
+
+    ## Called from the thread of the site
+    def __on_sink_saved(self, filename, siteId, flux, logTime, stats=None):
+        self.on_saved_wav(filename, siteId, flux, logTime, stats)
+
+
+
+    def on_saved_wav (self,filename ,siteId, flux, logTime, stats=None):
+        """Event method """
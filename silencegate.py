@@ -0,0 +1,154 @@
+# coding: utf8
+
+import operator
+from collections import namedtuple
+from audiostats import samples_of
+
+
+## Options of the trim of record wave files (same names as the args of SilenceGate)
+TrimOptions = namedtuple('TrimOptions', 'threshold prePadding postPadding maxGap', defaults=(-50.0, 0.3, 0.5, 0.0))
+
+
+class SilenceGate:
+
+    def __init__(self, params, threshold=-50.0, prePadding=0.3, postPadding=0.5, maxGap=0.0, window=0.01):
+        """Trim the silence of an audio stream, chunk by chunk.
+        Args:
+            params (tuple)      : Wave parameters of the stream (see class:riff.WaveParams).
+            threshold (float)   : A window with a RMS level below threshold dBFS is silent.
+            prePadding (float)  : Seconds of silence kept before the voice.
+            postPadding (float) : Seconds of silence kept after the voice.
+            maxGap (float)      : Silences between voice longer than maxGap seconds
+                                  are cut (only paddings are kept). 0 = never cut.
+            window (float)      : Duration (seconds) of the windows of the gate.
+
+        The energy of each window is summed by builtins over the samples of
+        the chunk (see class:audiostats.AudioStats). Silent windows are kept
+        until the next voiced window (so they are written) or the end of the
+        stream (so only postPadding is written). Before the first voiced
+        window, only the last prePadding seconds are kept.
+        """
+        self.params = params
+
+        frameSize = params.nchannels * params.sampwidth
+        windowFrames = max(int(params.framerate * window), 1)
+        self.windowBytes = windowFrames * frameSize
+        self.windowSamples = windowFrames * params.nchannels
+
+        ## Paddings and max gap in bytes, by whole windows
+        def windowsBytes(seconds):
+            return int(round(seconds / window)) * self.windowBytes
+        self.preBytes  = windowsBytes(prePadding)
+        self.postBytes = windowsBytes(postPadding)
+        self.maxGapBytes = max(windowsBytes(maxGap), self.preBytes + self.postBytes) if maxGap > 0 else 0
+
+        fullScale = float(1 << (8 * params.sampwidth - 1))
+        self.threshold = (fullScale * 10 ** (threshold / 20)) ** 2 * self.windowSamples
+
+        self.received = 0
+        self.written  = 0
+
+        self.__pending = bytearray()
+        self.__started = False
+
+        ## Silence since the last voiced window. When the gap is cut, its
+        ## first postPadding bytes are in __head, __gap keeps its end
+        self.__gap  = bytearray()
+        self.__head = None
+
+
+
+    def feed(self, pcm):
+        """Add PCM frames (bytes or memoryview), return the bytes to write """
+
+        self.received += len(pcm)
+        self.__pending += pcm
+        count = len(self.__pending) // self.windowBytes
+        if count == 0:
+            return b''
+
+        full = count * self.windowBytes
+        samples = samples_of(memoryview(self.__pending)[:full], self.params.sampwidth)
+        if samples is None:
+            ## Unknown sample width : nothing is trimmed
+            voiced = [True] * count
+        else:
+            squares = list(map(operator.mul, samples, samples))
+            size = self.windowSamples
+            voiced = [sum(squares[i * size:(i + 1) * size]) >= self.threshold for i in range(count)]
+
+        output = bytearray()
+        for i in range(count):
+            window = self.__pending[i * self.windowBytes:(i + 1) * self.windowBytes]
+            if voiced[i]:
+                self.__voiced(window, output)
+            else:
+                self.__silent(window)
+        del self.__pending[:full]
+
+        self.written += len(output)
+        return bytes(output)
+
+
+
+    def __voiced(self, window, output):
+        """Write the silence kept before a voiced window, then the window """
+
+        if not self.__started:
+            self.__started = True
+            output += self.__prepadding()
+        elif self.__head is not None:
+            output += self.__head
+            output += self.__prepadding()
+        else:
+            output += self.__gap
+
+        self.__gap.clear()
+        self.__head = None
+        output += window
+
+
+
+    def __prepadding(self):
+        """Return the last prePadding bytes of the silence """
+        return self.__gap[max(len(self.__gap) - self.preBytes, 0):]
+
+
+
+    def __silent(self, window):
+        """Keep a silent window, memory is bounded when it can't be written """
+
+        gap = self.__gap
+        gap += window
+
+        if (not self.__started) or (self.__head is not None):
+            keep = self.preBytes
+        elif self.maxGapBytes and len(gap) > self.maxGapBytes:
+            self.__head = gap[:self.postBytes]
+            keep = self.preBytes
+        else:
+            return
+
+        ## Amortized : the start of the gap is deleted once it's twice as long as kept
+        if len(gap) >= 2 * keep + self.windowBytes:
+            del gap[:len(gap) - keep]
+
+
+
+    def close(self):
+        """End of the stream, return the last bytes to write (postPadding of
+        the final silence, or prePadding if no window was voiced) """
+
+        self.__gap += self.__pending
+        self.__pending.clear()
+
+        if not self.__started:
+            output = bytes(self.__prepadding())
+        elif self.__head is not None:
+            output = bytes(self.__head)
+        else:
+            output = bytes(self.__gap[:self.postBytes])
+
+        self.__gap.clear()
+        self.written += len(output)
+        return output
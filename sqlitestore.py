@@ -0,0 +1,222 @@
+# coding: utf8
+
+import os
+import sqlite3
+import time
+from journal import to_micros, from_micros
+
+DATABASE_NAME = "rhasspy-watch.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id          INTEGER PRIMARY KEY,
+    time        INTEGER NOT NULL,
+    topic       TEXT NOT NULL,
+    siteId      TEXT,
+    sessionId   TEXT,
+    intentName  TEXT,
+    payload     BLOB NOT NULL,
+    broker      TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_time       ON messages (time);
+CREATE INDEX IF NOT EXISTS messages_site       ON messages (siteId, time);
+CREATE INDEX IF NOT EXISTS messages_topic      ON messages (topic, time);
+CREATE INDEX IF NOT EXISTS messages_session    ON messages (sessionId, time);
+CREATE INDEX IF NOT EXISTS messages_intent     ON messages (intentName, time);
+"""
+
+
+def glob_escape(text):
+    """Escape GLOB special characters """
+    return "".join("[" + c + "]" if c in "*?[" else c for c in text)
+
+
+
+def has_broker(connection):
+    """Return True if the messages table has the broker column """
+    return any(column[1] == "broker" for column in connection.execute("PRAGMA table_info(messages)"))
+
+
+
+class SqliteStore:
+
+    def __init__(self, folder, logger=None, batchSize=500, batchInterval=1.0):
+        """Storage of MQTT messages in a SQLite database (rhasspy-watch.db).
+        Args:
+            folder (str)          : Folder of the database.
+            logger (class:logging.Logger): Logger object for logging messages.
+            batchSize (int)       : Messages are committed by batchSize...
+            batchInterval (float) : ...or at least every batchInterval seconds.
+
+        time, topic, siteId, sessionId and intentName are indexed columns,
+        so searches on them do not read all messages. The database uses
+        WAL mode, so it can be searched while recording.
+        """
+        self.filename      = os.path.join(folder, DATABASE_NAME)
+        self.logger        = logger
+        self.batchSize     = batchSize
+        self.batchInterval = batchInterval
+
+        self.__connection = None
+        self.__batch      = []
+        self.__committed  = time.monotonic()
+
+
+
+    def __connect(self):
+        """Open (and create if needed) the database """
+
+        ## Written by the writer thread, closed by the main thread
+        connection = sqlite3.connect(self.filename, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+
+        ## Databases of previous versions have no broker column
+        if not has_broker(connection):
+            connection.execute("ALTER TABLE messages ADD COLUMN broker TEXT")
+        return connection
+
+
+
+    def append_message(self, message):
+        """Add a message (class:message.Message) to the current batch.
+        Return the location of the message : (database filename, None) """
+
+        payload = message.payload
+        siteId = sessionId = intentName = None
+        if isinstance(payload, dict):
+            siteId    = payload.get('siteId')
+            sessionId = payload.get('sessionId')
+            intent    = payload.get('intent')
+            if isinstance(intent, dict):
+                intentName = intent.get('intentName')
+
+        self.__batch.append((to_micros(message.time), message.topic, siteId, sessionId, intentName, message.raw,
+                             message.broker))
+
+        if (len(self.__batch) >= self.batchSize) \
+                or (time.monotonic() - self.__committed >= self.batchInterval):
+            self.flush()
+
+        return (DATABASE_NAME, None)
+
+
+
+    def flush(self):
+        """Commit the current batch in a single transaction """
+
+        self.__committed = time.monotonic()
+        if not self.__batch:
+            return
+
+        if self.__connection is None:
+            self.__connection = self.__connect()
+
+        with self.__connection:
+            self.__connection.executemany(
+                "INSERT INTO messages (time, topic, siteId, sessionId, intentName, payload, broker) VALUES (?,?,?,?,?,?,?)",
+                self.__batch)
+        self.__batch = []
+
+
+
+    def close(self):
+        """Commit the current batch and close the database """
+
+        self.flush()
+        if self.__connection is not None:
+            self.__connection.close()
+            self.__connection = None
+
+
+
+    def delete_before(self, logTime):
+        """Delete messages saved before logTime (own connection, so it can
+        run beside the writer thread). Return the count of deleted messages """
+
+        if not os.path.exists(self.filename):
+            return 0
+
+        connection = sqlite3.connect(self.filename, timeout=30)
+        try:
+            with connection:
+                count = connection.execute("DELETE FROM messages WHERE time < ?", (to_micros(logTime),)).rowcount
+        finally:
+            connection.close()
+        return count
+
+
+
+    def first_time(self):
+        """Return the datetime of the first message, or None """
+
+        if not os.path.exists(self.filename):
+            return None
+
+        connection = sqlite3.connect(self.filename)
+        try:
+            micros = connection.execute("SELECT MIN(time) FROM messages").fetchone()[0]
+        finally:
+            connection.close()
+        return from_micros(micros) if micros is not None else None
+
+
+
+    def read_record(self, logTime, topic):
+        """Return the (datetime, topic, payload, broker) message of topic
+        saved at logTime, or None """
+
+        if not os.path.exists(self.filename):
+            return None
+
+        connection = sqlite3.connect(self.filename)
+        try:
+            query = "SELECT payload, {0} FROM messages WHERE time = ? AND topic = ? ORDER BY id LIMIT 1"
+            row = connection.execute(query.format("broker" if has_broker(connection) else "NULL"),
+                                     (to_micros(logTime), topic)).fetchone()
+        finally:
+            connection.close()
+        return (logTime, topic, row[0], row[1]) if row is not None else None
+
+
+
+    def read(self, datestart, datestop, siteId=None, topic=None, sessionId=None):
+        """Generator of (datetime, topic, payload, broker) messages saved between
+        datestart and datestop, sorted by datetime.
+        Filters are done by the database (indexed columns). For a topic
+        filter with MQTT wildcards, only the part before the first wildcard
+        is filtered by the database.
+        """
+
+        if not os.path.exists(self.filename):
+            return
+
+        query = "SELECT time, topic, payload, {0} FROM messages WHERE time BETWEEN ? AND ?"
+        parameters = [to_micros(datestart), to_micros(datestop)]
+
+        if siteId:
+            query += " AND siteId = ?"
+            parameters.append(siteId)
+        if sessionId:
+            query += " AND sessionId = ?"
+            parameters.append(sessionId)
+        if topic:
+            if ('+' in topic) or ('#' in topic):
+                prefix = topic.split('+')[0].split('#')[0]
+                query += " AND topic GLOB ?"
+                parameters.append(glob_escape(prefix) + "*")
+            else:
+                query += " AND topic = ?"
+                parameters.append(topic)
+
+        query += " ORDER BY time, id"
+
+        connection = sqlite3.connect(self.filename)
+        try:
+            ## The database is not migrated by a search
+            query = query.format("broker" if has_broker(connection) else "NULL")
+            for micros, msgTopic, payload, broker in connection.execute(query, parameters):
+                yield (from_micros(micros), msgTopic, payload, broker)
+        finally:
+            connection.close()
@@ -0,0 +1,100 @@
+# coding: utf8
+
+from paho.mqtt.client import topic_matches_sub
+
+
+## Topic families of Hermes protocol
+FAMILIES = {"hotword"         : "hermes/hotword/#",
+            "asr"             : "hermes/asr/#",
+            "nlu"             : "hermes/nlu/#",
+            "intent"          : "hermes/intent/#",
+            "tts"             : "hermes/tts/#",
+            "dialogueManager" : "hermes/dialogueManager/#",
+            "audioServer"     : "hermes/audioServer/#"}
+
+AUDIO_PREFIX = "hermes/audioServer/"
+
+
+def split_filter(text):
+    """Split a comma separated list like 'a,b,-c' in (['a','b'], ['c']) """
+
+    include = []
+    exclude = []
+    for item in text.split(","):
+        item = item.strip()
+        if item.startswith("-"):
+            exclude.append(item[1:])
+        elif item != "":
+            include.append(item)
+    return (include, exclude)
+
+
+
+class SubscriptionPlan:
+
+    def __init__(self, recording, sites="", topics="", logger=None):
+        """Topics to subscribe, depending on the mode and on the filters.
+        Args:
+            recording (bool) : Audio topics are only subscribed if recording.
+            sites (str)      : Sites to watch ('kitchen,living') or to
+                               ignore ('-bedroom'). Empty = all sites.
+            topics (str)     : Families ('intent,asr') or topic filters
+                               ('hermes/intent/#') to watch, or to ignore
+                               ('-tts'). Empty = all families.
+            logger (class:logging.Logger): Logger object for logging messages.
+
+        Filtering is done by the broker when possible : audio topics are
+        subscribed by site. Other topics have the site in their payload, and
+        excluded topic filters can't be subscribed, so they are filtered by
+        the client (accept_site / accept_topic).
+        """
+        self.logger = logger
+        self.sites, self.excludedSites = split_filter(sites)
+        includedTopics, excludedTopics = split_filter(topics)
+
+        ## Default : all families
+        if not includedTopics:
+            includedTopics = list(FAMILIES)
+
+        excluded = [FAMILIES.get(topic, topic) for topic in excludedTopics]
+        self.excludedTopics = [topic for topic in excluded if topic not in FAMILIES.values()]
+
+        self.topics = []
+        for topic in includedTopics:
+            topic = FAMILIES.get(topic, topic)
+            if topic in excluded:
+                continue
+
+            if topic.startswith(AUDIO_PREFIX):
+                ## Audio is only used to save wave files
+                if not recording:
+                    self.logger.info("Audio topic %s not subscribed (no recording)", topic)
+                    continue
+
+                ## Audio topics contain the site : hermes/audioServer/<siteId>/...
+                if self.sites and (topic == FAMILIES["audioServer"]):
+                    self.topics.extend(AUDIO_PREFIX + site + "/#" for site in self.sites)
+                    continue
+
+            self.topics.append(topic)
+
+
+
+    def accept_site(self, siteId):
+        """Return False if messages of this site are filtered """
+
+        if siteId is None:
+            return True
+        if self.sites and (siteId not in self.sites):
+            return False
+        return siteId not in self.excludedSites
+
+
+
+    def accept_topic(self, topic):
+        """Return False if this topic is excluded """
+
+        for excluded in self.excludedTopics:
+            if topic_matches_sub(excluded, topic):
+                return False
+        return True
@@ -0,0 +1,323 @@
+# coding: utf8
+
+import os
+import re
+import shlex
+import sqlite3
+import time
+from datetime import datetime
+from journal import to_micros, from_micros
+from sqlitestore import glob_escape
+
+INDEX_NAME = "rhasspy-watch-index.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id          INTEGER PRIMARY KEY,
+    time        INTEGER NOT NULL,
+    topic       TEXT NOT NULL,
+    site        TEXT,
+    location    TEXT NOT NULL,
+    offset      INTEGER
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term        TEXT NOT NULL,
+    record      INTEGER NOT NULL,
+    PRIMARY KEY (term, record)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS wavs (
+    start       INTEGER NOT NULL,
+    end         INTEGER NOT NULL,
+    site        TEXT NOT NULL,
+    filename    TEXT NOT NULL,
+    flux        TEXT,
+    duration    REAL,
+    rms         REAL,
+    peak        REAL,
+    clipping    REAL,
+    dcOffset    REAL,
+    silence     REAL,
+    size        INTEGER,
+    savedBytes  INTEGER
+);
+CREATE INDEX IF NOT EXISTS records_time ON records (time);
+CREATE INDEX IF NOT EXISTS postings_record ON postings (record);
+CREATE INDEX IF NOT EXISTS wavs_site ON wavs (site, end);
+CREATE INDEX IF NOT EXISTS wavs_start ON wavs (start);
+"""
+
+## Statistics of wave files (see class:audiostats.AudioStats), columns of wavs
+WAV_STATS = ("duration", "rms", "peak", "clipping", "dcOffset", "silence", "size", "savedBytes")
+
+## Topics of utterances and intents (other messages are not indexed)
+INDEXED_TOPICS = ("hermes/asr/textCaptured", "hermes/nlu/query", "hermes/nlu/intentParsed",
+                  "hermes/nlu/intentNotRecognized", "hermes/intent/")
+
+WORD = re.compile(r"\w+")
+
+
+def words(text):
+    """Return the words of text, in lower case """
+    return [word.casefold() for word in WORD.findall(text)]
+
+
+
+def slot_term(name, value):
+    """Term of a slot value : name=value """
+    return "{0}={1}".format(name, value).casefold()
+
+
+
+def has_wav_stats(connection):
+    """Return True if the wavs table has the flux and statistics columns """
+    return any(column[1] == "flux" for column in connection.execute("PRAGMA table_info(wavs)"))
+
+
+
+def terms(message):
+    """Return the set of terms of a message (class:message.Message) :
+    words of text and input, intent:<intent name> and <slot name>=<slot value> """
+
+    payload = message.payload
+    if not (isinstance(payload, dict) and message.topic.startswith(INDEXED_TOPICS)):
+        return set()
+
+    found = set()
+    for field in ('text', 'input'):
+        if isinstance(payload.get(field), str):
+            found.update(words(payload[field]))
+
+    intent = payload.get('intent')
+    if isinstance(intent, dict) and intent.get('intentName'):
+        found.add("intent:" + intent['intentName'].casefold())
+
+    for slot in payload.get('slots') or []:
+        if not isinstance(slot, dict) or not slot.get('slotName'):
+            continue
+        value = slot.get('value')
+        if isinstance(value, dict) and value.get('value') is not None:
+            found.add(slot_term(slot['slotName'], value['value']))
+        if slot.get('rawValue'):
+            found.add(slot_term(slot['slotName'], slot['rawValue']))
+
+    return found
+
+
+
+def query_terms(query):
+    """Return the [(term, prefix)] of a query, all terms must match :
+        lumière            : a word of text or input
+        lum*               : a word starting with lum
+        intent:LightOn     : an intent
+        room=cuisine       : a slot value ("room=salle de bain" with spaces)
+    """
+
+    found = []
+    for token in shlex.split(query):
+        prefix = token.endswith("*")
+        token = token.rstrip("*")
+        if token.lower().startswith("intent:"):
+            found.append(("intent:" + token[len("intent:"):].casefold(), prefix))
+        elif "=" in token:
+            name, value = token.split("=", 1)
+            found.append((slot_term(name, value), prefix))
+        else:
+            tokenWords = words(token)
+            found.extend((word, False) for word in tokenWords[:-1])
+            if tokenWords:
+                found.append((tokenWords[-1], prefix))
+    return found
+
+
+
+class TextIndex:
+
+    def __init__(self, folder, logger=None, batchSize=500, batchInterval=1.0):
+        """Inverted index of utterances and intents (rhasspy-watch-index.db).
+        Args:
+            folder (str)          : Folder of the index (the json folder).
+            logger (class:logging.Logger): Logger object for logging messages.
+            batchSize (int)       : Records are committed by batchSize...
+            batchInterval (float) : ...or at least every batchInterval seconds.
+
+        Each indexed message is a record with its location in the storage
+        (segment and offset, or database), and a posting by term. Wave files
+        are saved with their site, datetimes and signal statistics : record
+        wave files are linked to the messages of the same site.
+        So a query only reads the matching messages.
+        """
+        self.filename      = os.path.join(folder, INDEX_NAME)
+        self.logger        = logger
+        self.batchSize     = batchSize
+        self.batchInterval = batchInterval
+
+        self.__connection = None
+        self.__records    = []
+        self.__wavs       = []
+        self.__committed  = time.monotonic()
+
+
+
+    def __connect(self):
+        """Open (and create if needed) the index """
+
+        ## Written by the writer thread, closed by the main thread
+        connection = sqlite3.connect(self.filename, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+
+        ## Indexes of previous versions have no flux nor statistics of wave files
+        if not has_wav_stats(connection):
+            for column in ("flux",) + WAV_STATS:
+                columnType = "TEXT" if column == "flux" else "INTEGER" if column in ("size", "savedBytes") else "REAL"
+                connection.execute("ALTER TABLE wavs ADD COLUMN {0} {1}".format(column, columnType))
+        return connection
+
+
+
+    def add_message(self, message, site, location):
+        """Index a message (class:message.Message) of site (siteId@broker
+        with several brokers) saved at location (see append_message of storages) """
+
+        found = terms(message)
+        if not found:
+            return
+
+        self.__records.append((to_micros(message.time), message.topic, site, location[0], location[1], found))
+        self.__autoflush()
+
+
+
+    def add_wav(self, filename, site, flux, logTime, stats=None):
+        """Index a wave file of site, saved at logTime, with its statistics
+        (dict of class:audiostats.AudioStats, None if unknown) """
+
+        ## Wave files are named with the datetime of their first chunk
+        start = datetime.strptime(filename.split("_")[0], '%Y%m%d%H%M%S%f')
+        values = tuple((stats or {}).get(column) for column in WAV_STATS)
+        self.__wavs.append((to_micros(start), to_micros(logTime), site, filename, flux) + values)
+        self.__autoflush()
+
+
+
+    def __autoflush(self):
+        """Commit when the batch is full or old enough """
+        if (len(self.__records) + len(self.__wavs) >= self.batchSize) \
+                or (time.monotonic() - self.__committed >= self.batchInterval):
+            self.flush()
+
+
+
+    def flush(self):
+        """Commit the current batch in a single transaction """
+
+        self.__committed = time.monotonic()
+        if not (self.__records or self.__wavs):
+            return
+
+        if self.__connection is None:
+            self.__connection = self.__connect()
+
+        with self.__connection:
+            for micros, topic, site, location, offset, found in self.__records:
+                record = self.__connection.execute(
+                    "INSERT INTO records (time, topic, site, location, offset) VALUES (?,?,?,?,?)",
+                    (micros, topic, site, location, offset)).lastrowid
+                self.__connection.executemany("INSERT OR IGNORE INTO postings (term, record) VALUES (?,?)",
+                                              [(term, record) for term in found])
+            self.__connection.executemany("INSERT INTO wavs (start, end, site, filename, flux, {0}) VALUES ({1})"
+                                          .format(", ".join(WAV_STATS), ",".join("?" * (5 + len(WAV_STATS)))),
+                                          self.__wavs)
+        self.__records = []
+        self.__wavs = []
+
+
+
+    def close(self):
+        """Commit the current batch and close the index """
+
+        self.flush()
+        if self.__connection is not None:
+            self.__connection.close()
+            self.__connection = None
+
+
+
+    def delete_before(self, logTime):
+        """Delete records and wave files saved before logTime (own
+        connection, so it can run beside the writer thread) """
+
+        if not os.path.exists(self.filename):
+            return
+
+        micros = to_micros(logTime)
+        connection = sqlite3.connect(self.filename, timeout=30)
+        try:
+            with connection:
+                connection.execute("DELETE FROM postings WHERE record IN (SELECT id FROM records WHERE time < ?)", (micros,))
+                connection.execute("DELETE FROM records WHERE time < ?", (micros,))
+                connection.execute("DELETE FROM wavs WHERE end < ?", (micros,))
+        finally:
+            connection.close()
+
+
+
+    def query(self, datestart, datestop, query, linkWindow=30):
+        """Generator of (datetime, topic, location, offset, wav filename)
+        of the records matching all terms of query, saved between datestart
+        and datestop, sorted by datetime. wav filename is the last record
+        wave file of the site, closed at most linkWindow seconds before the
+        record (None if there is none).
+        """
+
+        found = query_terms(query)
+        if not found or not os.path.exists(self.filename):
+            return
+
+        sql = "SELECT id, time, topic, site, location, offset FROM records WHERE time BETWEEN ? AND ?"
+        parameters = [to_micros(datestart), to_micros(datestop)]
+        for term, prefix in found:
+            if prefix:
+                sql += " AND id IN (SELECT record FROM postings WHERE term GLOB ?)"
+                parameters.append(glob_escape(term) + "*")
+            else:
+                sql += " AND id IN (SELECT record FROM postings WHERE term = ?)"
+                parameters.append(term)
+        sql += " ORDER BY time, id"
+
+        connection = sqlite3.connect(self.filename)
+        try:
+            ## Only record wave files are linked (indexes of previous versions have no play file)
+            wavSql = "SELECT filename FROM wavs WHERE site = ? AND end BETWEEN ? AND ? {0}ORDER BY end DESC LIMIT 1" \
+                .format("AND flux IS NOT 'play' " if has_wav_stats(connection) else "")
+            for record, micros, topic, site, location, offset in connection.execute(sql, parameters).fetchall():
+                wav = None
+                if site is not None:
+                    row = connection.execute(wavSql, (site, micros - linkWindow * 1000000, micros)).fetchone()
+                    if row is not None:
+                        wav = row[0]
+                yield (from_micros(micros), topic, location, offset, wav)
+        finally:
+            connection.close()
+
+
+
+    def wav_stats(self, datestart, datestop):
+        """Return the statistics of the wave files started between datestart
+        and datestop : dict of filename / dict of statistics """
+
+        if not os.path.exists(self.filename):
+            return {}
+
+        connection = sqlite3.connect(self.filename)
+        try:
+            if not has_wav_stats(connection):
+                return {}
+            rows = connection.execute("SELECT filename, {0} FROM wavs WHERE start BETWEEN ? AND ? AND duration IS NOT NULL"
+                                      .format(", ".join(WAV_STATS)),
+                                      (to_micros(datestart), to_micros(datestop))).fetchall()
+        finally:
+            connection.close()
+
+        return {row[0]: dict(zip(WAV_STATS, row[1:])) for row in rows}
@@ -0,0 +1,368 @@
+# coding: utf8
+
+import os
+import gzip
+import shutil
+import wave
+from datetime import datetime, timedelta
+from riff import ChunkParser
+from audiostats import AudioStats
+from silencegate import SilenceGate
+from journal import COMPRESSED_EXT
+
+WAV_EXT = ".wav"
+
+
+def wav_name(filename):
+    """Return (datetime string, siteId, flux) of a wave file name
+    (ex: 20200429195055646804_bureau_play.wav, or .wav.gz if compressed) """
+
+    if filename.endswith(COMPRESSED_EXT):
+        filename = filename[:-len(COMPRESSED_EXT)]
+    strDate, siteId, flux = os.path.splitext(filename)[0].split("_")
+    return (strDate, siteId, flux)
+
+
+
+def open_wav(path):
+    """Open a wave file (compressed or not) for reading, as a binary file """
+    return gzip.open(path, 'rb') if path.endswith(COMPRESSED_EXT) else open(path, 'rb')
+
+
+
+class WaveSink:
+
+    def __init__(self, filename, params, logTime, gate=None, compress=False):
+        """A wave file written incrementally, chunk by chunk.
+        Args:
+            filename (str)    : Full name of the wave file.
+            params (tuple)    : Wave parameters (as returned by getparams).
+            logTime (datetime): Datetime of the first chunk.
+            gate (class:silencegate.SilenceGate): Trim of the silence (None = no trim).
+            compress (bool)   : The file is compressed with gzip when it's closed.
+
+        The RIFF header is written with a length of 0 and patched when
+        the sink is closed, so nothing is kept in memory.
+        Signal statistics are computed on each chunk (before the trim,
+        see class:audiostats.AudioStats).
+        """
+        self.filename  = filename
+        self.startTime = logTime
+        self.lastWrite = logTime
+        self.size      = 0
+        self.received  = 0
+        self.fileSize  = 0
+        self.savedBytes = 0
+        self.stats     = AudioStats(params)
+        self.gate      = gate
+        self.compress  = compress
+
+        self.__wave = wave.open(filename, 'wb')
+        self.__wave.setparams(params)
+
+
+
+    def write(self, pcm, logTime):
+        """Append PCM frames (bytes or memoryview) to the wave file """
+
+        self.received += len(pcm)
+        self.lastWrite = logTime
+        self.stats.add(pcm)
+
+        if self.gate is not None:
+            pcm = self.gate.feed(pcm)
+
+        ## writeframesraw does not patch the header on each call
+        self.__wave.writeframesraw(pcm)
+        self.size += len(pcm)
+
+
+
+    def close(self):
+        """Write the end of the trimmed audio, patch the RIFF header and
+        close the wave file. If compress, the file is replaced by its gzip
+        (filename ends with .wav.gz) """
+
+        if self.gate is not None:
+            pcm = self.gate.close()
+            self.__wave.writeframesraw(pcm)
+            self.size += len(pcm)
+        self.__wave.close()
+
+        ## Size of the wave file without trim nor compression
+        fullSize = os.path.getsize(self.filename) + self.received - self.size
+
+        if self.compress:
+            ## Renamed when complete, so search never reads a partial file
+            compressed = self.filename + COMPRESSED_EXT
+            with open(self.filename, 'rb') as f_in:
+                with gzip.open(compressed + ".tmp", 'wb') as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+            os.replace(compressed + ".tmp", compressed)
+            os.remove(self.filename)
+            self.filename = compressed
+
+        self.fileSize = os.path.getsize(self.filename)
+        self.savedBytes = fullSize - self.fileSize
+
+
+
+class RingBuffer:
+
+    def __init__(self, capacity):
+        """Fixed capacity buffer keeping the last bytes written.
+        Args:
+            capacity (int) : Size (bytes) of the buffer, allocated once.
+        """
+        self.capacity = capacity
+        self.__buffer = bytearray(capacity)
+        self.__view   = memoryview(self.__buffer)
+        self.__pos    = 0
+        self.__size   = 0
+
+
+
+    def __len__(self):
+        return self.__size
+
+
+
+    def write(self, data):
+        """Write data, overwriting the oldest bytes if the buffer is full """
+
+        data = memoryview(data)
+        length = len(data)
+        if length == 0 or self.capacity == 0:
+            return
+
+        ## Only the end of data is kept
+        if length >= self.capacity:
+            self.__view[:] = data[length - self.capacity:]
+            self.__pos  = 0
+            self.__size = self.capacity
+            return
+
+        end = self.__pos + length
+        if end <= self.capacity:
+            self.__view[self.__pos:end] = data
+        else:
+            first = self.capacity - self.__pos
+            self.__view[self.__pos:] = data[:first]
+            self.__view[:length - first] = data[first:]
+
+        self.__pos  = end % self.capacity
+        self.__size = min(self.__size + length, self.capacity)
+
+
+
+    def read(self):
+        """Return the content of the buffer (oldest bytes first) """
+
+        if self.__size < self.capacity:
+            return bytes(self.__view[self.__pos - self.__size:self.__pos])
+        return bytes(self.__view[self.__pos:]) + bytes(self.__view[:self.__pos])
+
+
+
+    def clear(self):
+        self.__pos  = 0
+        self.__size = 0
+
+
+
+class WaveSinks:
+
+    def __init__(self, folder, logger, idleTimeout=30, preroll=1.0, captureTimeout=30, trim=None, compress=False):
+        """Wave sinks by site and flux ('record' or 'play').
+        Args:
+            folder (str)      : Folder where wave files are saved.
+            logger (class:logging.Logger): Logger object for logging messages.
+            idleTimeout (int) : A sink without new chunk since idleTimeout
+                                seconds is closed.
+            preroll (float)   : Seconds of audio kept before the start of a capture.
+            captureTimeout (int): A capture is stopped after captureTimeout seconds.
+            trim (tuple)      : Options of the silence trim of record files
+                                (see class:silencegate.TrimOptions), None = no trim.
+            compress (bool)   : Wave files are compressed with gzip when they are closed.
+
+        'record' chunks are only saved during a capture (started on hotword
+        or ASR start listening). Out of a capture, the last preroll seconds
+        are kept in a ring buffer by site, and saved at the start of the
+        next capture. 'play' chunks are always saved.
+
+        Must be used from a single thread (the background writer).
+        """
+        self.folder      = folder
+        self.logger      = logger
+        self.idleTimeout = timedelta(seconds=idleTimeout)
+        self.preroll     = preroll
+        self.captureTimeout = timedelta(seconds=captureTimeout)
+        self.trim        = trim
+        self.compress    = compress
+        self.__dateFileFormat = '%Y%m%d%H%M%S%f'
+
+        ## Key is (siteId, flux) / Value is the opened WaveSink
+        self.__sinks = {}
+
+        ## Key is siteId / Value is the datetime of the start of capture
+        self.__captures = {}
+
+        ## Key is siteId / Value is (wave params, RingBuffer)
+        self.__prerolls = {}
+
+        ## Key is (siteId, flux) / Value is the ChunkParser of the stream
+        self.__parsers = {}
+
+
+
+    def is_open(self, siteId, flux):
+        """Return True if a wave file is being written for site and flux """
+        return (siteId, flux) in self.__sinks
+
+
+
+    def sizes(self):
+        """Return a dict with bytes written by (siteId, flux) in opened sinks """
+        return {key: sink.size for key, sink in list(self.__sinks.items())}
+
+
+
+    def buffered(self):
+        """Return a dict with bytes kept in pre-roll buffer by siteId """
+        return {siteId: len(ring) for siteId, (params, ring) in list(self.__prerolls.items())}
+
+
+
+    def __open(self, siteId, flux, params, logTime):
+        """Create the wave file of site and flux """
+
+        filename = logTime.strftime(self.__dateFileFormat) + "_" + siteId + "_" + flux + WAV_EXT
+        self.logger.debug("Opening wave file %s", filename)
+
+        ## Only record files are trimmed (play files are TTS or sounds)
+        gate = SilenceGate(params, **self.trim._asdict()) if (self.trim is not None) and (flux == 'record') else None
+        sink = WaveSink(os.path.join(self.folder, filename), params, logTime, gate, self.compress)
+        self.__sinks[(siteId, flux)] = sink
+
+        return sink
+
+
+
+    def write(self, siteId, flux, wav, logTime):
+        """Append frames of a wave chunk to the sink of site and flux.
+        The wave file is created on the first chunk.
+        Out of a capture, 'record' frames go to the pre-roll buffer.
+        """
+
+        parser = self.__parsers.get((siteId, flux))
+        if parser is None:
+            parser = self.__parsers[(siteId, flux)] = ChunkParser()
+        params, pcm = parser.pcm(wav)
+
+        if (flux == 'record') and (siteId not in self.__captures):
+            self.__buffer(siteId, params, pcm)
+            return
+
+        sink = self.__sinks.get((siteId, flux))
+        if sink is None:
+            sink = self.__open(siteId, flux, params, logTime)
+
+            ## The capture starts with the pre-roll
+            if flux == 'record' and siteId in self.__prerolls:
+                ringParams, ring = self.__prerolls[siteId]
+                if ringParams[:3] == params[:3]:
+                    sink.write(ring.read(), logTime)
+                ring.clear()
+
+        sink.write(pcm, logTime)
+
+
+
+    def __buffer(self, siteId, params, pcm):
+        """Keep record frames in the pre-roll buffer of the site """
+
+        if self.preroll <= 0:
+            return
+
+        ringParams, ring = self.__prerolls.get(siteId, (None, None))
+
+        ## Buffer is allocated once by site (and again if the format changes)
+        if (ringParams is None) or (ringParams[:3] != params[:3]):
+            frameSize = params.nchannels * params.sampwidth
+            ring = RingBuffer(int(self.preroll * params.framerate) * frameSize)
+            self.__prerolls[siteId] = (params, ring)
+
+        ring.write(pcm)
+
+
+
+    def start_capture(self, siteId, logTime):
+        """Start to save record frames of the site (with the pre-roll) """
+
+        if siteId not in self.__captures:
+            self.logger.debug("Start of capture on site %s", siteId)
+            self.__captures[siteId] = logTime
+
+
+
+    def stop_capture(self, siteId, logTime):
+        """Stop to save record frames of the site and close the wave file """
+
+        self.__captures.pop(siteId, None)
+        self.close(siteId, 'record', logTime)
+
+
+
+    def close(self, siteId, flux, logTime):
+        """Close the sink of site and flux (if any) and call on_saved_wav
+        with the statistics of the wave file """
+
+        sink = self.__sinks.pop((siteId, flux), None)
+        if sink is None:
+            return
+
+        sink.close()
+        self.logger.debug("%s saved successfully ", sink.filename)
+
+        ## Bytes saved by the trim of silence and the compression
+        stats = sink.stats.result()
+        if stats is not None:
+            stats['size'] = sink.fileSize
+            stats['savedBytes'] = sink.savedBytes
+
+        self.on_saved_wav(os.path.basename(sink.filename), siteId, flux, logTime, stats)
+
+
+
+    def close_idle(self):
+        """Close sinks without new chunk since idleTimeout,
+        and stop captures started since captureTimeout """
+
+        now = datetime.now()
+        for siteId, startTime in list(self.__captures.items()):
+            if now - startTime >= self.captureTimeout:
+                self.logger.warning("Capture started at %s on site %s is too long, record wave file closed", startTime, siteId)
+                self.stop_capture(siteId, now)
+
+        for (siteId, flux), sink in list(self.__sinks.items()):
+            if now - sink.lastWrite >= self.idleTimeout:
+                self.logger.warning("No audio since %s on site %s, %s wave file closed", sink.lastWrite, siteId, flux)
+                if flux == 'record':
+                    self.stop_capture(siteId, now)
+                else:
+                    self.close(siteId, flux, now)
+
+
+
+    def close_all(self):
+        """Close all sinks """
+
+        now = datetime.now()
+        self.__captures.clear()
+        for siteId, flux in list(self.__sinks):
+            self.close(siteId, flux, now)
+
+
+
+    def on_saved_wav (self,filename ,siteId, flux, logTime, stats=None):
+        """Event method """
@@ -0,0 +1,205 @@
+# coding: utf8
+
+import threading
+import time
+from collections import deque, namedtuple
+
+
+## What to do when the queue is full
+POLICIES = ('block', 'drop-oldest', 'drop-audio-first')
+
+## Options of the writer threads : max count of waiting writes and policy
+## of each queue, count of audio writer threads (see class:shards.AudioShards)
+WriterOptions = namedtuple('WriterOptions', 'queueSize policy audioWorkers', defaults=(10000, 'block', 1))
+
+
+class BackgroundWriter:
+
+    def __init__(self, maxsize=10000, policy='block', logger=None, tickInterval=1.0, name="rhasspy-watch-writer"):
+        """Run disk writes on a dedicated thread, fed by a bounded queue.
+        Args:
+            maxsize (int)  : Max count of writes waiting in the queue.
+            policy (str)   : What to do when the queue is full
+                block            : wait for a free place (default)
+                drop-oldest      : drop the oldest write of the queue (not a 'control' one)
+                drop-audio-first : drop the oldest audio write of the queue,
+                                   or the new audio write. Wait if only
+                                   json writes are queued.
+            logger (class:logging.Logger): Logger object for logging messages.
+            tickInterval (float): on_tick is called on the writer thread
+                                  every tickInterval seconds.
+            name (str)     : Name of the writer thread.
+
+        So the MQTT network loop only enqueues and is never delayed by a
+        slow disk (except with the 'block' policy when the queue is full).
+        """
+        if policy not in POLICIES:
+            raise ValueError("Unknown writer policy : {0}".format(policy))
+
+        self.maxsize = maxsize
+        self.policy  = policy
+        self.logger  = logger
+        self.tickInterval = tickInterval
+        self.name    = name
+
+        ## Queue of (kind, function, args)
+        self.__queue    = deque()
+        self.__lock     = threading.Lock()
+        self.__notEmpty = threading.Condition(self.__lock)
+        self.__notFull  = threading.Condition(self.__lock)
+        self.__stopping = False
+        self.__thread   = None
+
+        ## Counters
+        self.__maxDepth     = 0
+        self.__written      = 0
+        self.__dropped      = 0
+        self.__droppedAudio = 0
+        self.__errors       = 0
+        self.__latencyTotal = 0.0
+        self.__latencyMax   = 0.0
+
+
+
+    def start(self):
+        """Start the writer thread """
+
+        if self.__thread is None:
+            self.__stopping = False
+            self.__thread = threading.Thread(target=self.__run, name=self.name, daemon=True)
+            self.__thread.start()
+
+
+
+    def stop(self):
+        """Write all queued items then stop the writer thread """
+
+        if self.__thread is not None:
+            with self.__lock:
+                self.__stopping = True
+                self.__notEmpty.notify()
+            self.__thread.join()
+            self.__thread = None
+
+
+
+    def __drop_audio(self):
+        """Drop the oldest audio write of the queue. Return False if there is none """
+
+        for item in self.__queue:
+            if item[0] == 'audio':
+                self.__queue.remove(item)
+                self.__droppedAudio += 1
+                return True
+        return False
+
+
+
+    def __drop_oldest(self):
+        """Drop the oldest write of the queue that is not a 'control' one.
+        Return False if there is none """
+
+        for item in self.__queue:
+            if item[0] != 'control':
+                self.__queue.remove(item)
+                if item[0] == 'audio':
+                    self.__droppedAudio += 1
+                return True
+        return False
+
+
+
+    def put(self, kind, function, *args):
+        """Enqueue a write. kind is 'json', 'audio' or 'control'.
+        'control' writes are never dropped, only 'audio' writes are dropped
+        by the drop-audio-first policy.
+        """
+
+        with self.__lock:
+            while len(self.__queue) >= self.maxsize:
+
+                if self.policy == 'drop-oldest':
+                    if self.__drop_oldest():
+                        self.__dropped += 1
+                        break
+
+                if self.policy == 'drop-audio-first':
+                    if self.__drop_audio():
+                        self.__dropped += 1
+                        break
+                    if kind == 'audio':
+                        self.__droppedAudio += 1
+                        self.__dropped += 1
+                        return
+
+                self.__notFull.wait()
+
+            self.__queue.append((kind, function, args))
+            if len(self.__queue) > self.__maxDepth:
+                self.__maxDepth = len(self.__queue)
+            self.__notEmpty.notify()
+
+
+
+    def __run(self):
+        """Loop of the writer thread """
+
+        nextTick = time.monotonic() + self.tickInterval
+
+        while True:
+            with self.__lock:
+                while not self.__queue and not self.__stopping:
+                    if time.monotonic() >= nextTick:
+                        break
+                    self.__notEmpty.wait(nextTick - time.monotonic())
+                if self.__queue:
+                    kind, function, args = self.__queue.popleft()
+                    self.__notFull.notify()
+                elif self.__stopping:
+                    return
+                else:
+                    kind = None
+
+            ## Periodic event, in the writer thread
+            if time.monotonic() >= nextTick:
+                nextTick = time.monotonic() + self.tickInterval
+                try:
+                    self.on_tick()
+                except Exception:
+                    self.logger.exception("ERROR : Failed on writer tick")
+
+            if kind is None:
+                continue
+
+            start = time.perf_counter()
+            try:
+                function(*args)
+            except Exception:
+                self.__errors += 1
+                self.logger.exception("ERROR : Failed to write %s", kind)
+            latency = time.perf_counter() - start
+
+            self.__written += 1
+            self.__latencyTotal += latency
+            if latency > self.__latencyMax:
+                self.__latencyMax = latency
+
+
+
+    def stats(self):
+        """Return the counters of the writer as a dict """
+
+        written = self.__written
+        return {"depth"         : len(self.__queue),
+                "maxDepth"      : self.__maxDepth,
+                "written"       : written,
+                "dropped"       : self.__dropped,
+                "droppedAudio"  : self.__droppedAudio,
+                "errors"        : self.__errors,
+                "latencyAverage": (self.__latencyTotal / written) if written else 0.0,
+                "latencyMax"    : self.__latencyMax}
+
+
+
+    def on_tick(self):
+        """Event method """